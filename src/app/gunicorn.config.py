@@ -1,16 +1,93 @@
 #!/usr/bin/python3.11
 # Configuration file for gunicorn server
 
+import gc
 import multiprocessing
+import os
+import resource
+import time
+
+from os import getenv
 
 bind = "unix:/run/gunicorn/gunicorn.sock"
 
 workers = multiprocessing.cpu_count() * 2 + 1
 
+# Threads per worker; more than one serves requests concurrently in each worker
+# with the gthread worker, which needs fewer memory heavy worker processes
+threads = int(getenv('GUNICORN_THREADS', '1'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
 loglevel = "info"
 #accesslog = "/var/log/gunicorn/access.log"
 #errorlog = "/var/log/gunicorn/error.log"
 #capture_output = True
 
 max_requests = 1000
-max_requests_jitter = 50
\ No newline at end of file
+max_requests_jitter = 50
+
+# Load the app once in the master and fork workers from it. Clients, connections
+# and background threads are created per worker after fork.
+preload_app = getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+# Collections in the master would touch the pages workers share with it, so
+# garbage collection is off in the master until workers re-enable it
+if preload_app:
+    gc.disable()
+
+# Metrics files left by a previous run would be merged into the new counts.
+# Only metrics files are removed, and only from a directory created here, so a
+# misconfigured path never deletes anything else.
+def clear_metrics(path: str):
+    marker = os.path.join(path, '.dashboard-metrics')
+    if os.path.islink(path):
+        raise RuntimeError(f'Metrics directory {path} is a symlink')
+    os.makedirs(path, exist_ok=True)
+
+    entries = [entry for entry in os.scandir(path) if entry.path != marker]
+    if entries and not os.path.isfile(marker):
+        raise RuntimeError(f'Metrics directory {path} was not created by the '
+                           'dashboard and is not empty')
+    with open(marker, 'a'):
+        pass
+
+    for entry in entries:
+        if entry.name.endswith('.db') and entry.is_file(follow_symlinks=False):
+            os.remove(entry.path)
+
+# Workers write metrics to files in a subdirectory of this directory that the
+# dashboard creates and owns, so /metrics can merge them. It is prepared when
+# gunicorn first loads this file, before a preloaded app is imported, and kept
+# apart so reloading this file neither nests another subdirectory nor clears
+# the metrics of running workers.
+metrics_dir = getenv('DASHBOARD_METRICS_DIR')
+if not metrics_dir:
+    metrics_dir = os.path.join(getenv('PROMETHEUS_MULTIPROC_DIR',
+                                      '/run/gunicorn/metrics'), 'dashboard')
+    clear_metrics(metrics_dir)
+    os.environ['DASHBOARD_METRICS_DIR'] = metrics_dir
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = metrics_dir
+
+# Move everything the master loaded into the permanent generation once, so
+# garbage collection in workers does not touch, and copy, the shared pages.
+# Runs after a preloaded app is loaded and before the first worker is forked.
+def when_ready(server):
+    if preload_app:
+        gc.freeze()
+
+# Record worker boot time and memory so startup cost is visible in the logs
+def post_fork(server, worker):
+    worker.boot_started = time.monotonic()
+    if preload_app:
+        gc.enable()
+
+def post_worker_init(worker):
+    worker.log.info('Worker %s booted in %.2fs with max RSS %d KiB', worker.pid,
+                    time.monotonic() - worker.boot_started,
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+# Drop the live values of a stopped worker, its counters and histograms are kept
+def child_exit(server, worker):
+    # Imported once the metrics directory is set, which fixes how values are kept
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -2,5 +2,7 @@
 
 from .config import Configuration
 from .signer import create_signer
+from .ratelimit import RateLimiter, create_client
 from .handlers import add_handlers
-from .utils import generate_csrf_tokens, log_factory
\ No newline at end of file
+from .utils import create_csrf_token, verify_csrf_token
+from .log import LogPipeline, get_logger
\ No newline at end of file
@@ -1 +1,2 @@
-from .authenticator import Authenticator
\ No newline at end of file
+from .authenticator import Authenticator, JWKSClient, create_session
+from .vault import TokenVault
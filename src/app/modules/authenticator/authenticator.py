@@ -1,68 +1,145 @@
 import jwt
-import json
+import os
 import requests
 import logging
 
+from cachelib import SimpleCache
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from werkzeug import exceptions
 
-from ..utils import log_factory
+from ..log import get_logger
+from ..metrics import cache_lookup
+from ..tracing import span
 
 
 class Authenticator:
+    # Where user claims are read from. auto reads the verified ID token and
+    # falls back to userinfo when a claim is missing, idtoken and userinfo read
+    # only from one.
+    claim_sources = ('auto', 'idtoken', 'userinfo')
+
     def __init__(self,
                  oidc_provider: str,
                  client_id: str,
                  client_secret:str,
                  scope: str='openid email',
-                 handler=logging.StreamHandler(),
                  log_level=logging.INFO,
+                 metadata: dict | None=None,
+                 timeout: float=10,
+                 retries: int=3,
+                 pool_size: int=10,
+                 claim_source: str='auto',
+                 claims: tuple[str, ...]=('email',),
+                 userinfo_ttl: float=300,
                  **kwargs):
         
         # Logging
-        self.logger = log_factory(__name__, log_level, handler)
+        self.logger = get_logger(__name__, log_level)
 
         self.idm_url = oidc_provider
         self.client = client_id
         self.secret = client_secret
-        self.oidc_config = requests.get(
-            f'{oidc_provider}/.well-known/openid-configuration').json()
-        self.algos = self.oidc_config['id_token_signing_alg_values_supported']
         self.scope = scope
-        self.jwks_client = jwt.PyJWKClient(self.oidc_config['jwks_uri'])
+
+        if claim_source not in self.claim_sources:
+            raise ValueError(f'Claim source must be one of {self.claim_sources}, '
+                             f'not {claim_source}')
+        self.claim_source = claim_source
+        self.claims = claims
+        # Userinfo rarely changes between logins, keep it per subject briefly
+        self.userinfo_cache = (SimpleCache(threshold=1024,
+                                           default_timeout=userinfo_ttl)
+                               if userinfo_ttl > 0 else None)
+
+        # Every call to the identity domain shares one pool of kept alive
+        # connections per worker
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self._reset_session()
+        # Pooled connections must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._reset_session)
+
+        # Use OIDC configuration and JWKS from startup metadata if provided
+        if metadata:
+            self.set_metadata(metadata)
+        else:
+            self.set_oidc_config(self.http.get(
+                f'{oidc_provider}/.well-known/openid-configuration',
+                timeout=self.timeout).json())
+
         self.logger.info('Authenticator initialized')
-        self.logger.debug(f'\tIDM URL: {self.idm_url}\n'
-                          f'\tClient ID: {self.client}\n'
-                          f'\tOIDC Config: {json.dumps(self.oidc_config)}\n'
-                          f'\tSigning Algorithms: {self.algos}\n'
-                          f'\tScope: {self.scope}\n')
+        self.logger.debug('\tIDM URL: %s\n'
+                          '\tClient ID: %s\n'
+                          '\tOIDC Config: %s\n'
+                          '\tSigning Algorithms: %s\n'
+                          '\tScope: %s\n'
+                          '\tClaim Source: %s\n',
+                          self.idm_url, self.client, self.oidc_config,
+                          self.algos, self.scope, self.claim_source)
+
+    def _reset_session(self):
+        self.http = create_session(self.pool_size, self.retries)
+        if getattr(self, 'jwks_client', None):
+            self.jwks_client.session = self.http
+
+    def set_oidc_config(self, oidc_config: dict):
+        self.oidc_config = oidc_config
+        self.algos = self.oidc_config['id_token_signing_alg_values_supported']
+        self.jwks_client = JWKSClient(self.oidc_config['jwks_uri'], self.http,
+                                      timeout=self.timeout)
+
+    # Return OIDC configuration and JWKS for the startup snapshot
+    def metadata(self) -> dict:
+        return {
+            'oidc_config': self.oidc_config,
+            'jwks': self.jwks_client.fetch_data()
+        }
+
+    def set_metadata(self, metadata: dict):
+        self.set_oidc_config(metadata['oidc_config'])
+        # Seed the JWKS cache so the first login does not fetch keys
+        self.jwks_client.jwk_set_cache.put(metadata['jwks'])
+
+    # Fetch OIDC configuration and JWKS again, returning the new metadata
+    def refresh_metadata(self) -> dict:
+        self.set_oidc_config(self.http.get(
+            f'{self.idm_url}/.well-known/openid-configuration',
+            timeout=self.timeout).json())
+
+        return self.metadata()
 
     # Returns a crafted redirect to send users to the OIDC provider endpoint. State
     # and nonce should be cryptographically randomized strings.
     def login_redirect_uri(self, callback: str, nonce: str, state: str) -> str:
-        self.logger.debug(f'Crafting redirect URL with state {state} and nonce {nonce}')
+        self.logger.debug('Crafting redirect URL with state %s and nonce %s',
+                          state, nonce)
 
         url = (f'{self.idm_url}/oauth2/v1/authorize'
                f'?client_id={self.client}&response_type=code'
                f'&redirect_uri={callback}'
                f'&scope={self.scope}&nonce={nonce}&state={state}')
         
-        self.logger.debug(f'Redirect URL: {url}')
+        self.logger.debug('Redirect URL: %s', url)
         return url
     
     def logout_redirect_uri(self, id_token: str, redirect_uri:str) -> str:
         url = (f'{self.idm_url}/oauth2/v1/userlogout?id_token_hint={id_token}'
                f'&post_logout_redirect_uri={redirect_uri}')
         
-        self.logger.debug(f'Post Logout URL: {url}')
+        self.logger.debug('Post Logout URL: %s', url)
         
         return url
     
     # Retrieves token and returns a tuple of (JWT, Access Token, Decoded ID Token)
     def retrive_token(self, code: str, nonce: str | None) -> dict:
-        r = requests.post(f'{self.idm_url}/oauth2/v1/token',
-                          auth=(self.client, self.secret),
-                          data={'grant_type': 'authorization_code',
-                                'code': code})
+        with span('idp_token'):
+            r = self.http.post(f'{self.idm_url}/oauth2/v1/token',
+                               auth=(self.client, self.secret),
+                               data={'grant_type': 'authorization_code',
+                                     'code': code},
+                               timeout=self.timeout)
         
         token = r.json() # Raw token in JSON format
 
@@ -76,13 +153,17 @@ class Authenticator:
                                              nonce)
         }
 
-        self.logger.debug(f'Retrieved token {tokens}')
+        # Token material is never logged
+        self.logger.debug('Retrieved tokens for %s',
+                          tokens['decoded_token'].get('sub'))
         
         return tokens
     
     # Decode and verify returned JWT
     def decode_jwt(self, id_token: str, nonce: str | None) -> dict:
-        signing_key = self.jwks_client.get_signing_key_from_jwt(id_token)
+        # Keys are fetched from the IdP when not cached
+        with span('idp_jwks'):
+            signing_key = self.jwks_client.get_signing_key_from_jwt(id_token)
 
         try:
             data = jwt.decode(
@@ -93,25 +174,100 @@ class Authenticator:
                 issuer=self.oidc_config['issuer']
             )
         except jwt.DecodeError as e:
-            self.logger.error(f'Failed to decode token: {e}')
+            self.logger.error('Failed to decode token: %s', e)
             raise exceptions.BadRequest
         except Exception as e:
-            self.logger.info(f'Token failed inspection with exception {e}: {id_token}')
+            self.logger.info('Token failed inspection with exception %s', e)
             raise exceptions.BadRequest
         
         if nonce:
             if nonce != data['nonce']:
                 raise exceptions.BadRequest
         
-        self.logger.debug(f'Decoded ID Token: {data}')
+        self.logger.debug('Decoded ID Token for %s', data.get('sub'))
         return data
     
-    # Recieves an access token and returns info about the user from the IdP
-    def retrieve_userinfo(self, at: str):
-        r = requests.get(f'{self.idm_url}/oauth2/v1/userinfo', headers={
-            'Authorization': f'Bearer {at}',
-            'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'
-        })
-
-        self.logger.debug(f'Returned user info: {r.json()}')
-        return r.json()
\ No newline at end of file
+    # Returns claims about the user for tokens from retrive_token, from the
+    # verified ID token when it carries every claim needed to skip a round trip
+    # to the IdP, or from userinfo otherwise
+    def user_claims(self, tokens: dict) -> dict:
+        decoded = tokens['decoded_token']
+        if (self.claim_source != 'userinfo'
+                and all(claim in decoded for claim in self.claims)):
+            return decoded
+
+        if self.claim_source == 'idtoken':
+            self.logger.error('ID token is missing claims %s', self.claims)
+            raise exceptions.BadRequest
+
+        return self.retrieve_userinfo(tokens['access_token'], decoded.get('sub'))
+
+    # Recieves an access token and returns info about the user from the IdP.
+    # Given the subject of the token, userinfo is cached for the subject.
+    def retrieve_userinfo(self, at: str, sub: str | None=None):
+        cache = self.userinfo_cache if sub else None
+        if cache is not None:
+            userinfo = cache.get(sub)
+            cache_lookup('userinfo', userinfo is not None)
+            if userinfo is not None:
+                return userinfo
+
+        with span('idp_userinfo'):
+            r = self.http.get(f'{self.idm_url}/oauth2/v1/userinfo', headers={
+                'Authorization': f'Bearer {at}',
+                'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'
+            }, timeout=self.timeout)
+
+        userinfo = r.json()
+        self.logger.debug('Returned user info: %s', userinfo)
+
+        if cache is not None and userinfo.get('sub', sub) == sub:
+            cache.set(sub, userinfo)
+
+        return userinfo
+
+
+class JWKSClient(jwt.PyJWKClient):
+    """JWKSClient fetches signing keys through the Authenticator's pooled
+       session instead of opening a new connection for every fetch.
+    """
+
+    def __init__(self, uri: str, session: requests.Session, **kwargs):
+        super().__init__(uri, **kwargs)
+        self.session = session
+
+    def fetch_data(self):
+        try:
+            r = self.session.get(self.uri, headers=self.headers,
+                                 timeout=self.timeout)
+            r.raise_for_status()
+            jwk_set = r.json()
+        except (requests.RequestException, ValueError) as e:
+            if self.jwk_set_cache is not None:
+                self.jwk_set_cache.put(None)
+            raise jwt.PyJWKClientConnectionError(
+                f'Fail to fetch data from the url, err: "{e}"')
+
+        if self.jwk_set_cache is not None:
+            self.jwk_set_cache.put(jwk_set)
+
+        return jwk_set
+
+
+# Create an HTTP session that keeps up to pool_size connections to each host
+# alive between calls. Connection failures are retried with backoff for every
+# method, throttling and gateway errors only for idempotent methods so an
+# authorization code is never sent twice.
+def create_session(pool_size: int=10, retries: int=3,
+                   backoff: float=0.5) -> requests.Session:
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
@@ -0,0 +1,48 @@
+#!/usr/bin/python3.11
+
+from cachelib import BaseCache
+from secrets import token_urlsafe
+
+
+class TokenVault:
+    """TokenVault keeps heavy token material such as the raw token response, ID
+       token and userinfo out of the session. Sessions hold only the vault key,
+       so the token material is only loaded by handlers that need it.
+
+       Keyword arguments:
+       cache -- cachelib cache to store entries in, usually the session store
+       timeout -- seconds before entries expire, no shorter than the time
+                  between writes that extend a session plus its lifetime
+    """
+
+    key_prefix = 'vault:'
+
+    def __init__(self, cache: BaseCache, timeout: int):
+        self.cache = cache
+        self.timeout = timeout
+
+    def __repr__(self) -> str:
+        return f'TokenVault - cache: {self.cache} timeout: {self.timeout}'
+
+    # Store entry and return the key to keep in the session
+    def put(self, entry: dict) -> str:
+        key = token_urlsafe()
+        self.cache.set(self.key_prefix + key, entry, timeout=self.timeout)
+
+        return key
+
+    def get(self, key: str | None) -> dict | None:
+        if not key:
+            return None
+
+        return self.cache.get(self.key_prefix + key)
+
+    # Extend an entry's expiry along with the session holding its key
+    def touch(self, key: str | None):
+        entry = self.get(key)
+        if entry is not None:
+            self.cache.set(self.key_prefix + key, entry, timeout=self.timeout)
+
+    def delete(self, key: str | None):
+        if key:
+            self.cache.delete(self.key_prefix + key)
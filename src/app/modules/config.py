@@ -7,6 +7,8 @@ import logging.handlers
 from oci.config import DEFAULT_LOCATION, DEFAULT_PROFILE
 from os import PathLike, getenv
 
+from .log import JsonFormatter, parse_sample
+
 class Configuration:
     """Configuration is the object that takes in arguments and options from various
        sources and turns them into an application configuration. This is intended
@@ -26,10 +28,46 @@ class Configuration:
         # Dictionaries for property storage with defaults
         self.app: dict = {
             'uri': 'http://localhost:5000',
+            'searchworkers': '8',
+            'cachettl': '60',
+            'cachesize': '1024',
+            'cachepath': 'cache',
+            'indexinterval': '60',
+            'indexfullinterval': '900',
+            'indexsweep': '500',
+            'ownershipage': '300',
+            'sessionbackend': 'filesystem',
+            'sessionrefresh': '60',
+            'clientidle': '900',
+            'snapshotttl': '3600',
+            'bulkworkers': '8',
+            'bulkservicelimit': '4',
+            'jobpath': 'jobs.db',
+            'jobinterval': '5',
+            'jobtimeout': '3600',
+            'prefetchdepth': '1',
+            'prefetchttl': '30',
+            'prefetchpath': 'prefetch',
+            'teamchunksize': '50',
+            'teamworkers': '8',
+            'flighttimeout': '10',
+            'ratelimit': '0',
+            'rateburst': '20',
+            'rateconcurrency': '16',
+            'rateattempts': '4',
+            # 'snapshotpath': '/var/lib/app/snapshot.json', # Optional
+            # 'sessionpath': 'session/session.db', # Optional
+            # 'sessionurl': 'redis://localhost:6379/0', # Optional
+            # 'indexpath': '/var/lib/app/inventory.db', # Optional
+            # 'flightpath': '/run/dashboard/flight', # Optional
+            # 'ratepath': '/run/dashboard/ratelimit.db', # Optional
+            # 'teamcompartments': 'ocid1.compartment.oc1..a,ocid1.compartment.oc1..b', # Optional
             # 'tagnamespace': 'foo',
             # 'tagkey': 'bar',
             # 'filternamespace': 'baz',         # Optional
-            # 'filterkey': 'bob'                # Optional
+            # 'filterkey': 'bob',               # Optional
+            # 'filterstates': 'RUNNING,STOPPED', # Optional
+            # 'filtercompartments': 'ocid1.compartment.oc1..a,ocid1.compartment.oc1..b', # Optional
             }
         self.auth: dict = {
             'authtype': 'profile',
@@ -37,14 +75,25 @@ class Configuration:
             'profile': 'DEFAULT'
         }
         self.idm: dict = {
+            'idmtimeout': '10',
+            'idmretries': '3',
+            'idmpoolsize': '10',
+            'claimsource': 'auto',
+            'userinfottl': '300',
             # 'endpoint': 'https://idcs-123.oraclecloud.com',
             # 'clientid': 'abcd',
-            # 'clientsecret': 'wxyz'
+            # 'clientsecret': 'wxyz',
+            # 'csrfsecret': 'lmno'              # Optional
         }
         self.logging: dict = {
             'loglevel': 'info',
+            'logstyle': 'json',
             'logformat': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
             # 'logfile': '/var/log/app.log'     # Optional
+            'servertiming': 'false',
+            # 'logsample': 'modules.search=0.1' # Optional
+            # 'tracepath': '/var/log/traces.jsonl' # Optional
+            # 'metricstoken': 'pqrs'           # Optional
         }
 
         # Parsers
@@ -58,6 +107,19 @@ class Configuration:
         # Enable falsy if filter attributes not passed
         self.filternamespace = None
         self.filterkey = None
+        self.filterstates = None
+        self.filtercompartments = None
+        self.teamcompartments = None
+        self.flightpath = None
+        self.ratepath = None
+        self.indexpath = None
+        self.csrfsecret = None
+        self.sessionpath = None
+        self.sessionurl = None
+        self.snapshotpath = None
+        self.logsample = None
+        self.tracepath = None
+        self.metricstoken = None
         
         # Set attributes as properties
         for dictionary in [self.app, self.auth, self.idm, self.logging]:
@@ -106,6 +168,8 @@ class Configuration:
             f'{PREFIX}_CLIENT_ID')
         if getenv(f'{PREFIX}_CLIENT_SECRET'): idm['clientsecret'] = getenv(
             f'{PREFIX}_CLIENT_SECRET')
+        if getenv(f'{PREFIX}_CSRF_SECRET'): idm['csrfsecret'] = getenv(
+            f'{PREFIX}_CSRF_SECRET')
         if getenv(f'{PREFIX}_TAG_NAMESPACE'): app['tagnamespace'] = getenv(
             f'{PREFIX}_TAG_NAMESPACE')
         if getenv(f'{PREFIX}_TAG_KEY'): app['tagkey'] = getenv(f'{PREFIX}_TAG_KEY')
@@ -113,16 +177,74 @@ class Configuration:
             f'{PREFIX}_FILTER_NAMESPACE')
         if getenv(f'{PREFIX}_FILTER_KEY'): app['filterkey'] = getenv(
             f'{PREFIX}_FILTER_KEY')
+        if getenv(f'{PREFIX}_FILTER_STATES'): app['filterstates'] = getenv(
+            f'{PREFIX}_FILTER_STATES')
+        if getenv(f'{PREFIX}_FILTER_COMPARTMENTS'): app['filtercompartments'] = getenv(
+            f'{PREFIX}_FILTER_COMPARTMENTS')
         if getenv(f'{PREFIX}_LOG_FILE'): logging['logfile'] = getenv(
             f'{PREFIX}_LOG_FILE')
+        if getenv(f'{PREFIX}_LOG_SAMPLE'): logging['logsample'] = getenv(
+            f'{PREFIX}_LOG_SAMPLE')
+        if getenv(f'{PREFIX}_TRACE_PATH'): logging['tracepath'] = getenv(
+            f'{PREFIX}_TRACE_PATH')
+        if getenv(f'{PREFIX}_METRICS_TOKEN'): logging['metricstoken'] = getenv(
+            f'{PREFIX}_METRICS_TOKEN')
+        if getenv(f'{PREFIX}_INDEX_PATH'): app['indexpath'] = getenv(
+            f'{PREFIX}_INDEX_PATH')
+        if getenv(f'{PREFIX}_SESSION_PATH'): app['sessionpath'] = getenv(
+            f'{PREFIX}_SESSION_PATH')
+        if getenv(f'{PREFIX}_SESSION_URL'): app['sessionurl'] = getenv(
+            f'{PREFIX}_SESSION_URL')
+        if getenv(f'{PREFIX}_SNAPSHOT_PATH'): app['snapshotpath'] = getenv(
+            f'{PREFIX}_SNAPSHOT_PATH')
+        if getenv(f'{PREFIX}_TEAM_COMPARTMENTS'): app['teamcompartments'] = getenv(
+            f'{PREFIX}_TEAM_COMPARTMENTS')
+        if getenv(f'{PREFIX}_FLIGHT_PATH'): app['flightpath'] = getenv(
+            f'{PREFIX}_FLIGHT_PATH')
+        if getenv(f'{PREFIX}_RATE_PATH'): app['ratepath'] = getenv(
+            f'{PREFIX}_RATE_PATH')
 
 
         # Variables with defaults
         app['uri'] = getenv(f'{PREFIX}_APP_URI', 'http://localhost:5000')
+        app['searchworkers'] = getenv(f'{PREFIX}_SEARCH_WORKERS', '8')
+        app['cachettl'] = getenv(f'{PREFIX}_CACHE_TTL', '60')
+        app['cachesize'] = getenv(f'{PREFIX}_CACHE_SIZE', '1024')
+        app['cachepath'] = getenv(f'{PREFIX}_CACHE_PATH', 'cache')
+        app['indexinterval'] = getenv(f'{PREFIX}_INDEX_INTERVAL', '60')
+        app['indexfullinterval'] = getenv(f'{PREFIX}_INDEX_FULL_INTERVAL', '900')
+        app['indexsweep'] = getenv(f'{PREFIX}_INDEX_SWEEP', '500')
+        app['ownershipage'] = getenv(f'{PREFIX}_OWNERSHIP_AGE', '300')
+        app['sessionbackend'] = getenv(f'{PREFIX}_SESSION_BACKEND', 'filesystem')
+        app['sessionrefresh'] = getenv(f'{PREFIX}_SESSION_REFRESH', '60')
+        app['clientidle'] = getenv(f'{PREFIX}_CLIENT_IDLE', '900')
+        app['snapshotttl'] = getenv(f'{PREFIX}_SNAPSHOT_TTL', '3600')
+        app['bulkworkers'] = getenv(f'{PREFIX}_BULK_WORKERS', '8')
+        app['bulkservicelimit'] = getenv(f'{PREFIX}_BULK_SERVICE_LIMIT', '4')
+        app['jobpath'] = getenv(f'{PREFIX}_JOB_PATH', 'jobs.db')
+        app['jobinterval'] = getenv(f'{PREFIX}_JOB_INTERVAL', '5')
+        app['jobtimeout'] = getenv(f'{PREFIX}_JOB_TIMEOUT', '3600')
+        app['prefetchdepth'] = getenv(f'{PREFIX}_PREFETCH_DEPTH', '1')
+        app['prefetchttl'] = getenv(f'{PREFIX}_PREFETCH_TTL', '30')
+        app['prefetchpath'] = getenv(f'{PREFIX}_PREFETCH_PATH', 'prefetch')
+        app['teamchunksize'] = getenv(f'{PREFIX}_TEAM_CHUNK_SIZE', '50')
+        app['teamworkers'] = getenv(f'{PREFIX}_TEAM_WORKERS', '8')
+        app['flighttimeout'] = getenv(f'{PREFIX}_FLIGHT_TIMEOUT', '10')
+        app['ratelimit'] = getenv(f'{PREFIX}_RATE_LIMIT', '0')
+        app['rateburst'] = getenv(f'{PREFIX}_RATE_BURST', '20')
+        app['rateconcurrency'] = getenv(f'{PREFIX}_RATE_CONCURRENCY', '16')
+        app['rateattempts'] = getenv(f'{PREFIX}_RATE_ATTEMPTS', '4')
         auth['authtype'] = auth_type = getenv(f'{PREFIX}_AUTH_TYPE', 'profile')
         auth['profile'] = getenv(f'{PREFIX}_PROFILE', DEFAULT_PROFILE)
         auth['configfile'] = getenv(f'{PREFIX}_LOCATION', DEFAULT_LOCATION)
+        idm['idmtimeout'] = getenv(f'{PREFIX}_IDM_TIMEOUT', '10')
+        idm['idmretries'] = getenv(f'{PREFIX}_IDM_RETRIES', '3')
+        idm['idmpoolsize'] = getenv(f'{PREFIX}_IDM_POOL_SIZE', '10')
+        idm['claimsource'] = getenv(f'{PREFIX}_CLAIM_SOURCE', 'auto')
+        idm['userinfottl'] = getenv(f'{PREFIX}_USERINFO_TTL', '300')
         logging['loglevel'] = getenv(f'{PREFIX}_LOG_LEVEL', 'info')
+        logging['logstyle'] = getenv(f'{PREFIX}_LOG_STYLE', 'json')
+        logging['servertiming'] = getenv(f'{PREFIX}_SERVER_TIMING', 'false')
         logging['logformat'] = getenv(f'{PREFIX}_LOG_FORMAT',
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -147,6 +269,10 @@ class Configuration:
     def set_log_handler(self, handler: logging.Handler):
         self.handler = handler
 
+    # Share of debug records kept by logger name
+    def get_log_sample(self) -> dict[str, float]:
+        return parse_sample(self.logsample)
+
     def _create_handler(self) -> logging.Handler:
         handler = logging.StreamHandler()
 
@@ -157,6 +283,7 @@ class Configuration:
             )
 
         handler.setLevel(self.logging.get('loglevel', 'info').upper())
-        handler.setFormatter(logging.Formatter(self.logformat))
+        handler.setFormatter(JsonFormatter() if self.logstyle.lower() == 'json'
+                             else logging.Formatter(self.logformat))
 
         return handler
@@ -1,3 +1,4 @@
 #!/usr/python3.11
 
-from .delete import Deleter
\ No newline at end of file
+from .delete import Deleter
+from .jobs import DeleteJobs, JobTracker
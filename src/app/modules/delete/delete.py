@@ -1,10 +1,16 @@
 #!/usr/python3.11
 
+import contextvars
 import logging
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from http import HTTPStatus
+from oci.exceptions import ServiceError
 
-from .client_bundle import ClientBundle
-from ..utils import log_factory
+from .registry import ClientRegistry, SERVICES
+from ..log import get_logger
+from ..tracing import span
 
 
 class Deleter:
@@ -14,73 +20,115 @@ class Deleter:
 
     def __init__(self, config,
                  signer,
-                 handler=logging.StreamHandler(),
                  log_level=logging.INFO,
-                 regions: list[str] | None=None):
+                 regions: list[str] | None=None,
+                 idle_timeout: float=900,
+                 workers: int=8,
+                 service_limit: int=4,
+                 limiter=None):
         
         # Logging
-        self.logger = log_factory(__name__, log_level, handler)
+        self.logger = get_logger(__name__, log_level)
 
         # Authentication variables
         self.config = config
         self.signer = signer
 
-        # Dictionary of client bundles
-        self.clients: dict[str, ClientBundle] = self.create_clients(regions)
+        # Clients are created per region and service on first use
+        self.clients = ClientRegistry(config, signer, regions=regions,
+                                      idle_timeout=idle_timeout, limiter=limiter)
 
-        # Use this dictionary to select the correct method for resource type
+        # Use this dictionary to select the service and correct method for
+        # resource type
         self.control_tree = {
-            'AnalyticsInstance': self.terminate_analytics_instance,
-            'Instance': self.terminate_instance,
-            'DedicatedVmHost': self.terminate_dedicated_vm,
-            'Image': self.terminate_image,
-            'BootVolume': self.terminate_boot_volume,
-            'BootVolumeBackup': self.terminate_boot_volume_backup,
-            'Volume': self.terminate_volume,
-            'VolumeBackup': self.terminate_volume_backup,
-            'VolumeBackupPolicy': self.terminate_volume_backup_policy,
-            'VolumeGroup': self.terminate_volume_group,
-            'VolumeGroupBackup': self.terminate_volume_group_backup,
-            'AutonomousDatabase': self.terminate_autonomous_database,
-            'AutonomousDatabaseBackup': self.terminate_autonomous_database_backup,
-            'AutonomousContainerDatabase': self.terminate_autonomous_container_database,
-            'DbSystem': self.terminate_dbsystem,
-            'IntegrationInstance': self.terminate_integration_instance,
-            'Bastion': self.terminate_bastion,
-            'OdaInstance': self.terminate_oda_instance
+            'AnalyticsInstance': ('analytics', self.terminate_analytics_instance),
+            'Instance': ('compute', self.terminate_instance),
+            'DedicatedVmHost': ('compute', self.terminate_dedicated_vm),
+            'Image': ('compute', self.terminate_image),
+            'BootVolume': ('blockstorage', self.terminate_boot_volume),
+            'BootVolumeBackup': ('blockstorage', self.terminate_boot_volume_backup),
+            'Volume': ('blockstorage', self.terminate_volume),
+            'VolumeBackup': ('blockstorage', self.terminate_volume_backup),
+            'VolumeBackupPolicy': ('blockstorage', self.terminate_volume_backup_policy),
+            'VolumeGroup': ('blockstorage', self.terminate_volume_group),
+            'VolumeGroupBackup': ('blockstorage', self.terminate_volume_group_backup),
+            'AutonomousDatabase': ('database', self.terminate_autonomous_database),
+            'AutonomousDatabaseBackup': ('database',
+                                         self.terminate_autonomous_database_backup),
+            'AutonomousContainerDatabase': ('database',
+                                            self.terminate_autonomous_container_database),
+            'DbSystem': ('database', self.terminate_dbsystem),
+            'IntegrationInstance': ('integration', self.terminate_integration_instance),
+            'Bastion': ('bastion', self.terminate_bastion),
+            'OdaInstance': ('oda', self.terminate_oda_instance)
         }
 
-        self.logger.info('Deleter initialized')
-
-    def create_clients(self, regions: list[str] | None) -> dict[str, ClientBundle]:
-        clients = {}
-
-        # Use single bundle with region in config if regions not passed
-        if not regions:
-            clients[self.config['region']] = ClientBundle(self.config, self.signer)
-        else:
-            for region in regions:
-                self.config['region'] = region
-                self.signer.region = region
-                clients[region] = ClientBundle(self.config, self.signer)
+        # Bulk deletes run on a bounded pool with a limit per service
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='delete')
+        self.service_limits = {service: threading.BoundedSemaphore(service_limit)
+                               for service in SERVICES}
 
-        return clients
+        self.logger.info('Deleter initialized')
 
     # terminate checks a resources against the control tree and runs the function
     # if it has been implemented, passing all args as kwargs
     def terminate(self, resource: dict, **kwargs) -> int:
-        self.logger.info(f'Request to delete {resource["resource_type"]}: '
-                      f'{resource["identifier"]} in '
-                      f'{kwargs.get("region", "undefined region")}')
+        self.logger.info('Request to delete %s: %s in %s',
+                         resource["resource_type"], resource["identifier"],
+                         kwargs.get("region", "undefined region"))
         
         try:
-            terminate_func = self.control_tree[resource['resource_type']]
-            self.logger.debug(f'Calling {terminate_func.__name__}')
-            return terminate_func(**resource, **kwargs)
+            _, terminate_func = self.control_tree[resource['resource_type']]
         except KeyError:
-            self.logger.info(f'Resource type {resource["resource_type"]} not supported')
+            self.logger.info('Resource type %s not supported',
+                             resource["resource_type"])
             return HTTPStatus.NOT_IMPLEMENTED
-        
+
+        # Unsubscribed regions are rejected before a client is created, errors
+        # from creating clients or calling OCI are raised to the caller
+        if not self.clients.serves(kwargs.get('region')):
+            self.logger.info('Region %s not subscribed', kwargs.get('region'))
+            return HTTPStatus.BAD_REQUEST
+
+        self.logger.debug('Calling %s', terminate_func.__name__)
+        with span('oci_delete', resource_type=resource['resource_type'],
+                  region=kwargs.get('region')):
+            return terminate_func(**resource, **kwargs)
+
+    def terminate_many(self, resources: list[tuple[dict, str]]
+                       ) -> Iterator[tuple[dict, str, int]]:
+        '''Terminate (resource, region) pairs concurrently, yielding
+        (resource, region, status) as each one completes. No more than the service
+        limit of deletes run against one service at a time.
+        '''
+
+        futures = {self.executor.submit(contextvars.copy_context().run,
+                                        self._terminate_limited, resource,
+                                        region): (resource, region)
+                   for resource, region in resources}
+
+        for future in as_completed(futures):
+            yield *futures[future], future.result()
+
+    # Terminate within the concurrency limit of the resource's service,
+    # returning errors as statuses so one failure does not stop the others
+    def _terminate_limited(self, resource: dict, region: str) -> int:
+        service, _ = self.control_tree.get(resource['resource_type'], (None, None))
+        limit = self.service_limits.get(service)
+        if limit is None:
+            return self.terminate(resource, region=region)
+
+        with limit:
+            try:
+                return self.terminate(resource, region=region)
+            except ServiceError as e:
+                self.logger.error('Failed to delete %s: %s', resource["identifier"], e)
+                return e.status
+            except Exception as e:
+                self.logger.error('Failed to delete %s: %s', resource["identifier"], e)
+                return HTTPStatus.INTERNAL_SERVER_ERROR
+
     """Terminate_resource methods have the signature:
        terminate_xyz(self, identifier: str=None, region: str=None, **kwargs).
        Terminate passes keyword arguments for identifier, region, and any optional
@@ -91,7 +139,7 @@ class Deleter:
 
     def terminate_analytics_instance(self, identifier: str=None, region: str=None,
                                      **kwargs) -> int:
-        return self.clients[region].analytics_client.delete_analytics_instance(
+        return self.clients.get(region, 'analytics').delete_analytics_instance(
             identifier).status
 
     ### COMPUTE ###
@@ -99,100 +147,100 @@ class Deleter:
     def terminate_instance(self, identifier: str=None, region: str=None,
                            **kwargs) -> int:
         # Delete instance but not boot volume by default
-        return self.clients[region].compute_client.terminate_instance(identifier,
+        return self.clients.get(region, 'compute').terminate_instance(identifier,
             preserve_boot_volume=kwargs.get('preserve_boot_volume', True)).status
     
     def terminate_dedicated_vm(self, identifier: str=None, region:str=None,
                                **kwargs) -> int:
-        return self.clients[region].compute_client.delete_dedicated_vm_host(
+        return self.clients.get(region, 'compute').delete_dedicated_vm_host(
             identifier).status
     
     def terminate_image(self, identifier: str=None, region: str=None, **kwargs) -> int:
-        return self.clients[region].compute_client.delete_image(identifier).status
+        return self.clients.get(region, 'compute').delete_image(identifier).status
         
     ### BLOCK STORAGE ###
 
     def terminate_boot_volume(self, identifier: str=None, region: str=None,
                               **kwargs) -> int:
-        return self.clients[region].blockstorage_client.delete_boot_volume(
+        return self.clients.get(region, 'blockstorage').delete_boot_volume(
             identifier).status
     
     def terminate_boot_volume_backup(self, identifier: str=None, region: str=None,
                                      **kwargs) -> int:
-        return self.clients[region].blockstorage_client.delete_boot_volume_backup(
+        return self.clients.get(region, 'blockstorage').delete_boot_volume_backup(
             identifier).status
     
     def terminate_volume(self, identifier: str=None, region: str=None,
                          **kwargs) -> int:
-        return self.clients[region].blockstorage_client.delete_volume(
+        return self.clients.get(region, 'blockstorage').delete_volume(
             identifier).status
     
     def terminate_volume_backup(self, identifier: str=None, region: str=None,
                                 **kwargs) -> int:
-        return self.clients[region].blockstorage_client.delete_volume_backup(
+        return self.clients.get(region, 'blockstorage').delete_volume_backup(
             identifier).status
     
     def terminate_volume_backup_policy(self, identifier: str=None, region: str=None,
                                        **kwargs) -> int:
-        return self.clients[region].blockstorage_client.delete_volume_backup_policy(
+        return self.clients.get(region, 'blockstorage').delete_volume_backup_policy(
             identifier).status
     
     def terminate_volume_group(self, identifier: str=None, region: str=None,
                                **kwargs) -> int:
-        return self.clients[region].blockstorage_client.delete_volume_group(
+        return self.clients.get(region, 'blockstorage').delete_volume_group(
             identifier).status
     
     def terminate_volume_group_backup(self, identifier: str=None, region: str=None,
                                       **kwargs) -> int:
-        return self.clients[region].blockstorage_client.delete_volume_group_backup(
+        return self.clients.get(region, 'blockstorage').delete_volume_group_backup(
             identifier).status
     
     ### DATABASE ###
 
     def terminate_autonomous_database(self, identifier: str=None, region: str=None,
                                      **kwargs) -> int:
-        return self.clients[region].database_client.delete_autonomous_database(
+        return self.clients.get(region, 'database').delete_autonomous_database(
             identifier).status
     
     def terminate_autonomous_database_backup(self, identifier: str=None,
                                            region: str=None, **kwargs) -> int:
-        return self.clients[region].database_client.delete_autonomous_database_backup(
+        return self.clients.get(region, 'database').delete_autonomous_database_backup(
             identifier).status
     
     def terminate_dbsystem(self, identifier: str=None, region: str=None,
                            **kwargs) -> int:
-        return self.clients[region].database_client.terminate_db_system(
+        return self.clients.get(region, 'database').terminate_db_system(
             identifier).status
     
     def terminate_autonomous_container_database(self, identifier: str=None,
                                                 region: str=None, **kwargs) -> int:
-        return self.clients[region].database_client.terminate_autonomous_container_database(
+        return self.clients.get(region, 'database').terminate_autonomous_container_database(
             identifier).status
     
     def terminate_database_backup(self, identifier: str=None, region: str=None,
                                   **kwargs) -> int:
-        return self.clients[region].database_client.delete_backup(identifier).status
+        return self.clients.get(region, 'database').delete_backup(identifier).status
     
     ### INTEGRATION CLOUD ###
 
     def terminate_integration_instance(self, identifier: str=None, region: str=None,
                                        **kwargs) -> int:
-        return self.clients[region].integration_client.delete_integration_instance(
+        return self.clients.get(region, 'integration').delete_integration_instance(
             identifier).status
     
     ### BASTION SERVICE ###
 
     def terminate_bastion(self, identifier: str=None, region: str=None,
                           **kwargs) -> int:
-        return self.clients[region].bastion_client.delete_bastion(identifier).status
+        return self.clients.get(region, 'bastion').delete_bastion(identifier).status
     
     # This doesn't appear to be supported by search, so can't be used yet
     def terminate_session(self, identifier: str=None, region: str=None,
                           **kwargs) -> int:
-        return self.clients[region].bastion_client.delete_session(identifier).status
+        return self.clients.get(region, 'bastion').delete_session(identifier).status
     
     ### DIGITAL ASSISTANT ###
 
     def terminate_oda_instance(self, identifier: str=None, region: str=None,
                                **kwargs) -> int:
-        return self.clients[region].oda_client.delete_oda_instance(identifier).status
\ No newline at end of file
+        return self.clients.get(region, 'oda').delete_oda_instance(identifier).status
\ No newline at end of file
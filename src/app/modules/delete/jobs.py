@@ -0,0 +1,236 @@
+#!/usr/bin/python3.11
+
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+
+from http import HTTPStatus
+from time import time
+
+from ..log import get_logger
+
+
+class DeleteJobs:
+    """DeleteJobs is a SQLite store of accepted deletes, tracked until the
+       resource leaves its terminating state. The store is shared by all workers
+       on a host so any worker can report on a job another accepted.
+
+       Keyword arguments:
+       path -- SQLite database file, shared by all workers on the host
+    """
+
+    # Job states
+    pending = 'pending'
+    done = 'done'
+    failed = 'failed'
+    expired = 'expired'
+
+    # Status reported to the delete button for each job state
+    statuses = {
+        pending: HTTPStatus.ACCEPTED,
+        done: HTTPStatus.OK,
+        failed: HTTPStatus.INTERNAL_SERVER_ERROR,
+        expired: HTTPStatus.GATEWAY_TIMEOUT
+    }
+
+    # Lifecycle states a deleted resource settles in across services
+    terminal_states = {'TERMINATED', 'DELETED'}
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            identifier TEXT NOT NULL,
+            region TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            resource_type TEXT NOT NULL,
+            state TEXT NOT NULL,
+            lifecycle_state TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            reported INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (identifier, region)
+        );
+        CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, reported);
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, region);
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        # Connections must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._reset)
+
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.schema)
+
+    def __repr__(self) -> str:
+        return f'DeleteJobs - path: {self.path}'
+
+    def _reset(self):
+        self.local = threading.local()
+
+    # SQLite connections cannot be shared between threads, keep one per thread
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+
+        return conn
+
+    def add(self, owner: str, region: str, identifier: str, resource_type: str):
+        now = time()
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, NULL, ?, ?, 0)',
+                         (identifier, region, owner, resource_type, self.pending,
+                          now, now))
+
+    # Return identifiers of pending jobs grouped by region
+    def pending_by_region(self) -> dict[str, list[str]]:
+        regions: dict[str, list[str]] = {}
+        for identifier, region in self.connection().execute(
+                'SELECT identifier, region FROM jobs WHERE state = ?', (self.pending,)):
+            regions.setdefault(region, []).append(identifier)
+
+        return regions
+
+    def update(self, region: str, states: dict[str, str], timeout: float
+               ) -> list[tuple[str, str]]:
+        '''Record the lifecycle states found for a region's pending jobs and
+        finish jobs whose resource has terminated, failed, gone missing or
+        outlived the timeout. Returns (owner, identifier) of finished jobs.
+        '''
+
+        now = time()
+        finished = []
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT identifier, owner, created FROM jobs '
+                'WHERE state = ? AND region = ?', (self.pending, region)).fetchall()
+
+            for identifier, owner, created in rows:
+                lifecycle_state = states.get(identifier)
+                if lifecycle_state is None or lifecycle_state in self.terminal_states:
+                    state = self.done
+                elif lifecycle_state == 'FAILED':
+                    state = self.failed
+                elif now - created > timeout:
+                    state = self.expired
+                else:
+                    state = self.pending
+
+                if state != self.pending:
+                    finished.append((owner, identifier))
+                conn.execute(
+                    'UPDATE jobs SET state = ?, lifecycle_state = ?, updated = ? '
+                    'WHERE identifier = ? AND region = ?',
+                    (state, lifecycle_state, now, identifier, region))
+
+        return finished
+
+    def report(self, owner: str) -> tuple[list[tuple[str, int]], bool]:
+        '''Return (identifier, status) for an owner's pending jobs and jobs
+        finished since the last report, and whether any are still pending.
+        Finished jobs are only reported once.
+        '''
+
+        # Read and mark in one transaction, and mark only the finished jobs
+        # read, so a job the tracker finishes meanwhile is reported next time
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                'SELECT identifier, region, state FROM jobs '
+                'WHERE owner = ? AND reported = 0', (owner,)).fetchall()
+            conn.executemany(
+                'UPDATE jobs SET reported = 1 WHERE identifier = ? AND region = ?',
+                [(identifier, region) for identifier, region, state in rows
+                 if state != self.pending])
+
+        return ([(identifier, self.statuses[state]) for identifier, _, state in rows],
+                any(state == self.pending for _, _, state in rows))
+
+    # Drop finished jobs last updated more than retention seconds ago
+    def purge(self, retention: float):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM jobs WHERE state != ? AND updated < ?',
+                         (self.pending, time() - retention))
+
+
+class JobTracker:
+    """JobTracker polls the lifecycle state of every pending delete job with
+       one batched search per region rather than one call per resource. Only
+       one worker on a host polls at a time, guarded by a lock file next to the
+       job database.
+
+       Keyword arguments:
+       interval -- seconds between polls (default 5)
+       timeout -- seconds before a job still terminating is given up on (default 3600)
+    """
+
+    def __init__(self, search, jobs: DeleteJobs, interval: float=5,
+                 timeout: float=3600,
+                 log_level: int | str=logging.INFO):
+        # Logging
+        self.logger = get_logger(__name__, log_level)
+
+        self.search = search
+        self.jobs = jobs
+        self.interval = interval
+        self.timeout = timeout
+        self.stop = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.pid: int | None = None
+
+    def __repr__(self) -> str:
+        return (f'JobTracker - interval: {self.interval} timeout: {self.timeout} '
+                f'jobs: {self.jobs}')
+
+    def start(self):
+        '''Start polling in a background thread. Safe to call on every request
+        as the thread is started once per process.
+        '''
+
+        if self.pid == os.getpid():
+            return
+
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name='jobs', daemon=True)
+        self.thread.start()
+        self.logger.info('Started %s', self)
+
+    def run(self):
+        with open(f'{self.jobs.path}.lock', 'w') as lock:
+            while not self.stop.is_set():
+                try:
+                    # Another worker holds the lock and is polling
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.stop.wait(self.interval)
+                    continue
+
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.logger.error('Delete job poll failed: %s', e)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+                self.stop.wait(self.interval)
+
+    def poll(self):
+        for region, identifiers in self.jobs.pending_by_region().items():
+            states = self.search.lifecycle_states(identifiers, region)
+            finished = self.jobs.update(region, states, self.timeout)
+
+            # Drop finished resources from cached pages and the index
+            for owner, identifier in finished:
+                self.search.invalidate(owner, region, identifier)
+
+            self.logger.debug('Polled %s delete jobs in %s: %s finished',
+                              len(identifiers), region, len(finished))
+
+        # Keep finished jobs long enough for every open page to be told
+        self.jobs.purge(self.timeout)
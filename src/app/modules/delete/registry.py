@@ -0,0 +1,91 @@
+#!/usr/python3.11
+
+import os
+import threading
+
+from time import monotonic
+from oci.analytics import AnalyticsClient
+from oci.bastion import BastionClient
+from oci.core import BlockstorageClient, ComputeClient
+from oci.oda import OdaClient
+from oci.database import DatabaseClient
+from oci.integration import IntegrationInstanceClient
+
+from ..ratelimit import RateLimiter, create_client
+
+# Client classes by service name
+SERVICES = {
+    'analytics': AnalyticsClient,
+    'bastion': BastionClient,
+    'blockstorage': BlockstorageClient,
+    'compute': ComputeClient,
+    'oda': OdaClient,
+    'database': DatabaseClient,
+    'integration': IntegrationInstanceClient
+}
+
+class ClientRegistry:
+    """ClientRegistry creates OCI clients on first use for a (region, service)
+       pair instead of building every client for every region up front. Clients
+       that have not been used for idle_timeout seconds are closed and removed.
+
+       Keyword arguments:
+       regions -- region names clients may be created for (default any region)
+       idle_timeout -- seconds before an unused client is evicted (default 900)
+       limiter -- RateLimiter pacing calls made by the clients (default none)
+    """
+
+    def __init__(self, config: dict, signer, regions: list[str] | None=None,
+                 idle_timeout: float=900, limiter: RateLimiter | None=None):
+        self.config = config
+        self.signer = signer
+        self.regions = regions
+        self.idle_timeout = idle_timeout
+        self.limiter = limiter
+        self.clients: dict[tuple[str, str], list] = {}
+        self.lock = threading.Lock()
+        # Connection pools must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (f'ClientRegistry - clients: {list(self.clients)} '
+                f'idle_timeout: {self.idle_timeout}')
+
+    # Whether clients may be created for the region
+    def serves(self, region: str) -> bool:
+        return not self.regions or region in self.regions
+
+    def get(self, region: str, service: str):
+        '''Return the client for a service in a region, creating it if needed.
+        Raises KeyError for unknown regions or services.
+        '''
+
+        if not self.serves(region):
+            raise KeyError(region)
+
+        now = monotonic()
+        with self.lock:
+            self.evict(now)
+
+            entry = self.clients.get((region, service))
+            if entry is None:
+                client = create_client(SERVICES[service], self.config, region,
+                                       signer=self.signer, limiter=self.limiter,
+                                       service=service)
+                entry = self.clients[(region, service)] = [client, now]
+
+            entry[1] = now
+            return entry[0]
+
+    # Close and remove clients unused for longer than the idle timeout. Called
+    # with the lock held.
+    def evict(self, now: float):
+        idle = [key for key, (_, used) in self.clients.items()
+                if now - used > self.idle_timeout]
+        for key in idle:
+            client, _ = self.clients.pop(key)
+            client.base_client.session.close()
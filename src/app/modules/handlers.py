@@ -1,55 +1,276 @@
 #!/usr/bin/python3.11
 
+import hmac
+
 from http import HTTPStatus, HTTPMethod
-from flask import Flask, session, redirect, render_template, url_for, request
-from oci.util import to_dict
+from flask import (Flask, Response, g, session, redirect, render_template,
+                   url_for, request, stream_template, stream_with_context,
+                   before_render_template, template_rendered)
+from hashlib import sha256
 from secrets import token_urlsafe
-from time import sleep
+from time import perf_counter, perf_counter_ns, sleep, time
 from werkzeug import exceptions
-from .utils import generate_csrf_tokens
+from .utils import create_csrf_token, verify_csrf_token
 from .config import Configuration
 
 from modules.search import SearchError
-from modules import create_signer
-from modules.authenticator import Authenticator
-from modules.search import Search, SearchError, ExpiryFilter
-from modules.delete import Deleter
+from modules import create_signer, RateLimiter
+from modules.authenticator import Authenticator, TokenVault
+from modules.search import (Search, SearchError, ExpiryFilter, LifecycleFilter,
+                            CompartmentFilter, FilterPipeline, SearchCache,
+                            Invalidations,
+                            InventoryIndex, Indexer, Prefetcher, TeamSearch,
+                            SingleFlight, encode_response, decode_response)
+from modules.delete import Deleter, DeleteJobs, JobTracker
+from modules.snapshot import Snapshot
+from modules.metrics import (CONTENT_TYPE_LATEST, REQUEST_SECONDS, SESSION_LOAD,
+                             MeasuredSessionInterface, collect)
+from modules.tracing import TraceExporter, current_trace, start_trace, end_trace
 
 
 def add_handlers(app: Flask, config: Configuration, **kwargs) -> Flask:
+    """Create application components and register handlers on the app.
+
+       Components created here are shared by every request thread in a worker,
+       so they must be safe under threaded workers:
+       - Search and Deleter create clients per region with their own config,
+         guarded against concurrent creation, sharing one signer
+       - SearchCache, Prefetcher, SingleFlight, RateLimiter and ClientRegistry
+         guard their state with a lock
+       - InventoryIndex, DeleteJobs, SqliteCache and RespCache keep one
+         connection per thread
+       - Region and resource lists are only replaced in place by snapshot refresh
+       - Handlers keep per user state in the session, never in closures
+    """
 
     # OCI SDK Authentication
     cfg, signer = create_signer(config.authtype,
                             profile=config.profile,
                             location=config.configfile)
 
+    # Startup metadata snapshot lets workers boot without network calls
+    snapshot = None
+    if config.snapshotpath:
+        snapshot = Snapshot(config.snapshotpath,
+                            ttl=float(config.snapshotttl),
+                            log_level=config.get_log_level())
+
+    # Pace and retry OCI calls, shared by workers if a path is provided
+    limiter = None
+    if float(config.ratelimit) > 0:
+        limiter = RateLimiter(config.ratepath,
+                              rate=float(config.ratelimit),
+                              burst=float(config.rateburst),
+                              concurrency=int(config.rateconcurrency),
+                              attempts=int(config.rateattempts),
+                              log_level=config.get_log_level())
+
     # Search
     search = Search(
         config.tagnamespace,
         config.tagkey,
         cfg,
         signer=signer,
-        handler=config.get_log_handler(),
-        log_level=config.get_log_level())
+        log_level=config.get_log_level(),
+        workers=int(config.searchworkers),
+        metadata=snapshot.get('search') if snapshot else None,
+        limiter=limiter)
+    # Compose filters from those configured, run in one pass over results
+    filters = []
     # Set expiry filter if tag is provided
-    if config.filterkey: search.set_filter(ExpiryFilter(
+    if config.filterkey: filters.append(ExpiryFilter(
                                     config.filternamespace,
                                     config.filterkey,
                                     log_level=app.logger.getEffectiveLevel()))
+    if config.filterstates: filters.append(LifecycleFilter(
+                                    *config.filterstates.split(','),
+                                    log_level=app.logger.getEffectiveLevel()))
+    if config.filtercompartments: filters.append(CompartmentFilter(
+                                    *config.filtercompartments.split(','),
+                                    log_level=app.logger.getEffectiveLevel()))
+    if filters: search.set_filter(FilterPipeline(
+                                    *filters,
+                                    log_level=app.logger.getEffectiveLevel()))
+    # Deletes in any worker invalidate cached and prefetched results through
+    # a directory shared by the workers
+    invalidations = Invalidations(config.cachepath,
+                                  retention=max(float(config.cachettl),
+                                                float(config.prefetchttl)))
+    # Cache search results unless disabled with a zero TTL
+    if float(config.cachettl) > 0: search.set_cache(SearchCache(
+                                    ttl=float(config.cachettl),
+                                    maxsize=int(config.cachesize),
+                                    invalidations=invalidations))
+    # Share identical searches across workers, not only within this one
+    if config.flightpath: search.set_flight(SingleFlight(
+                                    config.flightpath,
+                                    timeout=float(config.flighttimeout),
+                                    encode=encode_response,
+                                    decode=decode_response))
+    # Fetch the pages after the one served ahead of infinite scroll, into a
+    # directory shared by the workers so whichever serves the next page has it
+    if int(config.prefetchdepth) > 0: search.set_prefetcher(Prefetcher(
+                                    depth=int(config.prefetchdepth),
+                                    ttl=float(config.prefetchttl),
+                                    path=config.prefetchpath,
+                                    timeout=float(config.flighttimeout),
+                                    encode=encode_response,
+                                    decode=decode_response,
+                                    invalidations=invalidations))
+    # Serve searches from a local inventory index if a path is provided
+    if config.indexpath:
+        search.set_index(InventoryIndex(config.indexpath))
+        indexer = Indexer(search,
+                          search.index,
+                          interval=float(config.indexinterval),
+                          full_interval=float(config.indexfullinterval),
+                          sweep_size=int(config.indexsweep),
+                          log_level=config.get_log_level())
+
+        # Start in the worker serving requests, not a preloading master
+        app.before_request(indexer.start)
+
+    # List every resource in the team compartments if any are provided
+    team = None
+    if config.teamcompartments:
+        team = TeamSearch(search,
+                          config.teamcompartments.split(','),
+                          chunk_size=int(config.teamchunksize),
+                          workers=int(config.teamworkers),
+                          log_level=config.get_log_level())
 
     # Delete
     deleter = Deleter(cfg,
                     signer=signer,
                     regions=search.region_names,
-                    handler=config.get_log_handler(),
+                    idle_timeout=float(config.clientidle),
+                    workers=int(config.bulkworkers),
+                    service_limit=int(config.bulkservicelimit),
+                    limiter=limiter,
                     log_level=config.get_log_level())
 
+    # Accepted deletes are tracked until the resource finishes terminating
+    jobs = DeleteJobs(config.jobpath)
+    tracker = JobTracker(search,
+                         jobs,
+                         interval=float(config.jobinterval),
+                         timeout=float(config.jobtimeout),
+                         log_level=config.get_log_level())
+    app.before_request(tracker.start)
+    job_interval = float(config.jobinterval)
+
+    # Seconds a listed resource is trusted as owned without another search
+    ownership_age = float(config.ownershipage)
+
+    # CSRF tokens are signed rather than stored; the key must be shared by all
+    # workers so defaults to one derived from the OIDC client secret
+    csrf_key = sha256(f'csrf.{config.csrfsecret or config.clientsecret}'.encode()
+                      ).digest()
+    csrf_lifetime = int(app.permanent_session_lifetime.total_seconds())
+
     # OIDC
     oauth = Authenticator(config.endpoint,
                     config.clientid,
                     config.clientsecret,
-                    handler=config.get_log_handler(),
-                    log_level=config.get_log_level())
+                    log_level=config.get_log_level(),
+                    metadata=snapshot.get('oidc') if snapshot else None,
+                    timeout=float(config.idmtimeout),
+                    retries=int(config.idmretries),
+                    pool_size=int(config.idmpoolsize),
+                    claim_source=config.claimsource.lower(),
+                    userinfo_ttl=float(config.userinfottl))
+
+    # Save metadata fetched at boot, then keep the snapshot and this worker's
+    # metadata fresh in the background
+    if snapshot:
+        if not snapshot.data:
+            snapshot.save({'search': search.metadata(), 'oidc': oauth.metadata()})
+        snapshot.track({'search': (search.refresh_metadata, search.set_metadata),
+                        'oidc': (oauth.refresh_metadata, oauth.set_metadata)})
+
+        # Start in the worker serving requests, not a preloading master
+        app.before_request(snapshot.start)
+
+    # Sessions are only saved when changed, so active sessions are marked
+    # refreshed at most once per interval to keep sliding their expiry
+    session_refresh = float(config.sessionrefresh)
+
+    # Token material is kept out of the session in the session store. Entries
+    # are extended on each refresh, other changes to the session extend it by
+    # up to the refresh interval beyond the entry
+    vault = TokenVault(app.config['SESSION_CACHELIB'],
+                       int(app.permanent_session_lifetime.total_seconds()
+                           + session_refresh))
+
+    @app.before_request
+    def refresh_session():
+        if (session.get('user')
+                and time() - session.get('refreshed', 0) > session_refresh):
+            session['refreshed'] = int(time())
+            vault.touch(session.get('vault'))
+
+    # Metrics
+    app.session_interface = MeasuredSessionInterface(app.session_interface)
+
+    @app.before_request
+    def start_timer():
+        g.started = perf_counter()
+
+    @app.after_request
+    def record_latency(response: Response):
+        if 'started' in g:
+            REQUEST_SECONDS.labels(
+                request.url_rule.rule if request.url_rule else 'unmatched',
+                request.method, response.status_code
+            ).observe(perf_counter() - g.started)
+
+        return response
+
+    # Tracing, each request's time broken down by span in a Server-Timing
+    # header and optionally exported as OTLP JSON lines
+    server_timing = config.servertiming.lower() == 'true'
+    exporter = TraceExporter(config.tracepath) if config.tracepath else None
+
+    @app.before_request
+    def begin_trace():
+        # Sessions are loaded before any before_request hook runs
+        loaded = request.environ.get(SESSION_LOAD)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        trace = start_trace(request.endpoint or 'unmatched',
+                            started=loaded[0] if loaded else None,
+                            route=route, method=request.method)
+        if loaded:
+            trace.add('session_load', *loaded)
+
+    # Timings describe the backend, only signed in users are sent them
+    @app.after_request
+    def add_server_timing(response: Response):
+        trace = current_trace.get()
+        if server_timing and trace is not None and session.get('user'):
+            response.headers['Server-Timing'] = trace.server_timing()
+
+        return response
+
+    # Streamed responses end their trace once the stream is consumed
+    @app.teardown_request
+    def finish_trace(e: BaseException | None):
+        trace = end_trace()
+        if exporter and trace is not None:
+            exporter.export(trace)
+
+    def render_started(sender, template, context, **extra):
+        g.setdefault('renders', []).append(perf_counter_ns())
+
+    def render_finished(sender, template, context, **extra):
+        trace = current_trace.get()
+        renders = g.get('renders')
+        if trace is not None and renders:
+            trace.add('render', renders.pop(), perf_counter_ns(),
+                      template=template.name)
+
+    # Receivers are local, hold them strongly so they are not collected
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
 
     # Homepage handler
     @app.route('/', methods=[HTTPMethod.GET])
@@ -59,7 +280,11 @@ def add_handlers(app: Flask, config: Configuration, **kwargs) -> Flask:
                                 user=session.get('user'),
                                 selections=search.resource_list,
                                 regions=search.region_names,
-                                home=search.home_region)
+                                all_regions=search.all_regions,
+                                home=search.home_region,
+                                staleness=search.staleness(),
+                                job_interval=job_interval,
+                                team=team is not None)
         
         return render_template('index.html')
 
@@ -69,41 +294,62 @@ def add_handlers(app: Flask, config: Configuration, **kwargs) -> Flask:
         if session.get('user'):
 
             # Check to see if resource filter has changed
-            if request.args.get('resource_type'):
-                session['resource_type'] = request.args.get('resource_type')
+            resource_type = request.args.get('resource_type')
+            if resource_type and resource_type != session['resource_type']:
+                session['resource_type'] = resource_type
 
             # Check if region has changed
-            if request.args.get('region'):
-                session['region'] = request.args.get('region')
+            region = request.args.get('region')
+            if region and region != session['region']:
+                session['region'] = region
 
             try:
                 results = search.get_user_resources(
                     session.get('user'),
                     page=request.args.get('next_page', None),
                     resource=session['resource_type'],
-                    region=session['region'])
+                    region=session['region'],
+                    session=session.sid)
             except SearchError:
                 raise exceptions.InternalServerError
             
-            items = to_dict(results.data)['items']
-            app.logger.debug(f'Items returned for user {session.get("user")}:'
-                            f'\t{items}')
+            items = results.data.items
+            app.logger.debug('Returned %s items for user %s',
+                             len(items), session.get('user'))
 
-            # Generate CSRF tokens to attach to possible requests generated by the template
-            tokens = generate_csrf_tokens(len(items))
-            session['csrf_tokens'].update(tokens)
-            app.logger.debug(f'Valid CSRF Tokens for user {session.get("user")}\n'
-                            f'{session["csrf_tokens"]}')
+            # Generate CSRF tokens to attach to possible requests generated by the
+            # template, each signing the resource and region handed to the user
+            # and when its owner was read, which cached pages make older
+            expiry = int(time()) + csrf_lifetime
+            listed = int(results.data.fetched)
+            tokens = [create_csrf_token(csrf_key,
+                                        session.sid,
+                                        item.identifier,
+                                        item.region or session['region'],
+                                        listed,
+                                        expiry) for item in items]
 
-            
             return render_template('cards.html',
                                 items=items,
                                 next_page=results.next_page,
-                                tokens=list(tokens.keys()))
+                                tokens=tokens)
         
         # If you're here and unauthenticated that's tough luck
         raise exceptions.Unauthorized
 
+    # Read only view of the team compartments, streamed as searches complete
+    @app.route('/team', methods=[HTTPMethod.GET])
+    def team_view():
+        if not session.get('user'):
+            raise exceptions.Unauthorized
+        if not team:
+            raise exceptions.NotFound
+
+        return Response(stream_template('team.html',
+                                        user=session.get('user'),
+                                        items=team.resources()),
+                        mimetype='text/html')
+
     # OpenID Connect Sign in via OCI IAM Identity Domain Provider
     @app.route('/login', methods=[HTTPMethod.GET])
     def login():
@@ -129,16 +375,16 @@ def add_handlers(app: Flask, config: Configuration, **kwargs) -> Flask:
         # Verify tokens and decode ID Token
         tok = oauth.retrive_token(request.args.get('code'),
                                                     session.pop('nonce'))
-        userinfo = oauth.retrieve_userinfo(tok['access_token'])
+        userinfo = oauth.user_claims(tok)
 
-        # Create user session
+        # Create user session, only fields read on every request are kept in the
+        # session and token material goes to the vault
         # session['user'] = f'{tok["decoded_token"]["domain"]}/{tok["decoded_token"]["sub"]}'
         session['user'] = userinfo['email'] # Primary user identifier
-        session['jwt'] = tok
-        session['userinfo'] = userinfo
-        session['csrf_tokens'] = {}
+        session['vault'] = vault.put({'jwt': tok, 'userinfo': userinfo})
         session['resource_type'] = 'all' # Support search filtering
         session['region'] = search.home_region
+        session['refreshed'] = int(time())
 
         # Get full list of compartments from search
         # Search all where session["user"] in compartment.tag
@@ -150,10 +396,16 @@ def add_handlers(app: Flask, config: Configuration, **kwargs) -> Flask:
     def logout():
         if session.get('user'):
             if not app.debug:
-                url = oauth.logout_redirect_uri(session['jwt']['id_token'],
-                                                url_for('home', _external=True))
+                tokens = vault.get(session.get('vault'))
+                vault.delete(session.get('vault'))
                 session.clear()
-                return redirect(url)
+
+                # Vault entry may have expired, end the local session regardless
+                if not tokens:
+                    return redirect(url_for('home'))
+
+                return redirect(oauth.logout_redirect_uri(tokens['jwt']['id_token'],
+                                                          url_for('home', _external=True)))
             else:
                 app.logger.debug('Debug prevents session clear for testing.'
                                 ' Remove session in client as needed.')
@@ -163,29 +415,135 @@ def add_handlers(app: Flask, config: Configuration, **kwargs) -> Flask:
     # Resource deletion logic
     @app.route('/delete', methods=[HTTPMethod.DELETE])
     def delete():
-        app.logger.debug(f'Delete form data: {request.form}')
-        app.logger.info(f'Recieved delete request for {request.form.get("display_name")} '
-                        f'from {session.get("user")}')
+        app.logger.debug('Delete form data: %s', request.form)
+        app.logger.info('Recieved delete request for %s from %s',
+                        request.form.get("display_name"), session.get("user"))
         
-        # Check session to see if CSRF token in user's pool, True if CSRF token
-        # not found causing CSRF violation and halting delete
-        if session.get('csrf_tokens').get(request.form.get('csrf_token'), True):
-            app.logger.info(f'CSRF Token violation from {session.get("user")} '
-                            f'for {request.form.get("identifier")}')
+        # Verify CSRF token was signed for this session and resource, None if
+        # forged or expired causing CSRF violation and halting delete
+        identifier = request.form.get('identifier')
+        record = verify_csrf_token(csrf_key, request.form.get('csrf_token'),
+                                   session.sid, identifier)
+        if not record or not session.get('user'):
+            app.logger.info('CSRF Token violation from %s for %s',
+                            session.get("user"), identifier)
             return render_template('button.html', status=HTTPStatus.BAD_REQUEST)
         
-        # Validate user owns the resource
-        if not search.validate_resource(session.get('user'),
-                                        request.form.get('identifier'),
-                                        region=session.get('region')):
+        # Region the resource was listed in and when its owner was read
+        region, listed = record
+
+        # The token records that the resource was listed for this user; only
+        # search again if the ownership data of that listing is too old to trust
+        if time() - listed > ownership_age and not search.validate_resource(
+                session.get('user'), identifier, region=region):
             return render_template('button.html', status=HTTPStatus.UNAUTHORIZED)
 
-        result = deleter.terminate(request.form.copy(), region=session.get('region'))
+        result = deleter.terminate(request.form.copy(), region=region)
+        if not 200 <= result <= 299:
+            return render_template('button.html', status=result,
+                                   target=f'delete-{identifier}')
+
+        # Cached pages still list the resource after any accepted delete, which
+        # is tracked until it terminates and reported through the job poller
+        search.invalidate(session.get('user'), region, identifier)
+        jobs.add(session.get('user'), region, identifier,
+                 request.form.get('resource_type'))
+
+        return (render_template('button.html', status=HTTPStatus.ACCEPTED,
+                                target=f'delete-{identifier}') +
+                render_template('jobs.html', updates=[], poll=True, restart=True,
+                                job_interval=job_interval))
+
+    # Bulk deletion logic; results stream back as each delete completes
+    @app.route('/delete/bulk', methods=[HTTPMethod.POST])
+    def bulk_delete():
+        if not session.get('user'):
+            raise exceptions.Unauthorized
+
+        user = session.get('user')
+        app.logger.info('Recieved bulk delete request for %s resources from %s',
+                        len(request.form.getlist("resource")), user)
+
+        # Entries are "identifier resource_type csrf_token"
+        rejected = []
+        accepted = []
+        stale: dict[str, list[str]] = {}
+        for entry in request.form.getlist('resource'):
+            try:
+                identifier, resource_type, token = entry.split(' ')
+            except ValueError:
+                app.logger.info('Malformed bulk delete entry from %s: %s', user, entry)
+                continue
+
+            record = verify_csrf_token(csrf_key, token, session.sid, identifier)
+            if not record:
+                app.logger.info('CSRF Token violation from %s for %s', user, identifier)
+                rejected.append((identifier, HTTPStatus.BAD_REQUEST))
+                continue
+
+            region, listed = record
+            accepted.append(({'identifier': identifier,
+                              'resource_type': resource_type}, region))
+            if time() - listed > ownership_age:
+                stale.setdefault(region, []).append(identifier)
+
+        # Validate ownership of stale listings with one search per region
+        owned = set()
+        for region, identifiers in stale.items():
+            owned |= search.validate_resources(user, identifiers, region=region)
+        unowned = {identifier for identifiers in stale.values()
+                   for identifier in identifiers} - owned
+        rejected += [(identifier, HTTPStatus.UNAUTHORIZED) for identifier in unowned]
+        accepted = [(resource, region) for resource, region in accepted
+                    if resource['identifier'] not in unowned]
+
+        def results():
+            for identifier, status in rejected:
+                yield render_template('button.html', status=status, oob=True,
+                                      target=f'delete-{identifier}')
+
+            deleted = 0
+            for resource, region, status in deleter.terminate_many(accepted):
+                if 200 <= status <= 299:
+                    deleted += 1
+                    status = HTTPStatus.ACCEPTED
+                    search.invalidate(user, region, resource['identifier'])
+                    jobs.add(user, region, resource['identifier'],
+                             resource['resource_type'])
+                yield render_template('button.html', status=status, oob=True,
+                                      target=f'delete-{resource["identifier"]}')
+
+            if deleted:
+                yield render_template('jobs.html', updates=[], poll=True,
+                                      restart=True, job_interval=job_interval)
+            yield f'<p class="m-2">Deleting {deleted} of {len(accepted) + len(rejected)}</p>'
+
+        return Response(stream_with_context(results()), mimetype='text/html')
+
+    # Delete job state for the user's page, polled by HTMX until no jobs are
+    # pending; status 286 tells HTMX to stop polling
+    @app.route('/jobs', methods=[HTTPMethod.GET])
+    def delete_jobs():
+        if not session.get('user'):
+            raise exceptions.Unauthorized
+
+        updates, pending = jobs.report(session.get('user'))
+
+        return render_template('jobs.html', updates=updates), 200 if pending else 286
 
-        # Remove CSRF token on successful result
-        if result == 200: session.get('csrf_tokens').pop(request.form.get('csrf_token'))
+    # Prometheus metrics, merged across workers under gunicorn. Only served to
+    # scrapers presenting the metrics token, not found without one configured
+    metrics_token = (config.metricstoken or '').encode()
+    @app.route('/metrics', methods=[HTTPMethod.GET])
+    def metrics():
+        if not metrics_token:
+            raise exceptions.NotFound
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if (scheme.lower() != 'bearer'
+                or not hmac.compare_digest(token.encode(), metrics_token)):
+            raise exceptions.Unauthorized
 
-        return render_template('button.html', status=result)
+        return Response(collect(), content_type=CONTENT_TYPE_LATEST)
 
     # Resource update logic; Will be used for updating expiry tag
     @app.route('/update', methods=[HTTPMethod.PATCH])
@@ -0,0 +1,153 @@
+#!/usr/bin/python3.11
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import random
+
+from datetime import datetime, timezone
+from queue import SimpleQueue
+
+# Attributes every LogRecord has, anything else was passed in extra
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord(
+    '', logging.INFO, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class LogPipeline:
+    """LogPipeline moves log output off request threads. Attached loggers put
+       records on a queue and a listener thread formats and writes them with
+       the handler, so a slow disk or terminal never blocks a request. Debug
+       records can be sampled per logger before they are queued. A new queue
+       and listener are started in forked workers and queued records are
+       flushed at exit.
+
+       Keyword arguments:
+       handler -- handler that formats and writes records
+       sample -- share of debug records kept by logger name prefix (default all)
+    """
+
+    def __init__(self, handler: logging.Handler,
+                 sample: dict[str, float] | None=None):
+        self.handler = handler
+        self.sample = sample or {}
+        self.queue_handler = QueueHandler(SimpleQueue())
+        if self.sample:
+            self.queue_handler.addFilter(SampleFilter(self.sample))
+
+        self.listener = None
+        self.start()
+        # The listener thread does not survive fork, start one per worker
+        os.register_at_fork(after_in_child=self.start)
+        atexit.register(self.stop)
+
+    def __repr__(self) -> str:
+        return f'LogPipeline - handler: {self.handler} sample: {self.sample}'
+
+    def start(self):
+        self.queue_handler.queue = SimpleQueue()
+        self.listener = logging.handlers.QueueListener(
+            self.queue_handler.queue, self.handler, respect_handler_level=True)
+        self.listener.start()
+
+    # Write queued records and stop the listener
+    def stop(self):
+        if self.listener and self.listener._thread:
+            self.listener.stop()
+
+    def attach(self, logger: logging.Logger, log_level: int | str | None=None):
+        '''Send a logger's records, and those of its children, through the
+        pipeline instead of its own handlers.
+        '''
+
+        logger.handlers.clear()
+        logger.addHandler(self.queue_handler)
+        logger.propagate = False
+        if log_level is not None:
+            logger.setLevel(log_level)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler queues records for a listener in the same process. Only
+       the message is merged with its arguments before queueing, so objects
+       logged can change afterwards, and formatting is left to the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """SampleFilter keeps a share of debug records from loggers matching a name
+       prefix, the longest matching prefix deciding. Other levels are kept.
+    """
+
+    def __init__(self, sample: dict[str, float]):
+        super().__init__()
+        # Longest prefixes first so the most specific rate is found first
+        self.sample = sorted(sample.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+
+        for prefix, rate in self.sample:
+            if record.name == prefix or record.name.startswith(f'{prefix}.'):
+                return random.random() < rate
+
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """JsonFormatter formats a record as one JSON object per line with the
+       time, level, logger, message, any exception and any fields passed in
+       extra.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc
+                                           ).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in RECORD_ATTRIBUTES)
+
+        return json.dumps(entry, default=str)
+
+
+# Return the logger for a module. Output is configured once for the app by
+# attaching the package logger to a LogPipeline, so no handler is added here.
+def get_logger(name: str, log_level: int | str | None=None) -> logging.Logger:
+    logger = logging.getLogger(name)
+    if log_level is not None:
+        logger.setLevel(log_level)
+
+    return logger
+
+# Parse sampling rates given as 'logger=rate,logger=rate'
+def parse_sample(value: str | None) -> dict[str, float]:
+    sample = {}
+    for entry in (value or '').split(','):
+        if entry.strip():
+            name, rate = entry.split('=')
+            sample[name.strip()] = float(rate)
+
+    return sample
@@ -0,0 +1,130 @@
+#!/usr/bin/python3.11
+
+import functools
+import os
+
+from flask.sessions import SessionInterface
+from oci.exceptions import ServiceError
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               Counter, Histogram, generate_latest, multiprocess)
+from time import perf_counter, perf_counter_ns
+
+from .tracing import current_trace, span
+
+# Metrics are kept per process. Under gunicorn PROMETHEUS_MULTIPROC_DIR must be
+# set before the app is imported so every worker writes its values to files
+# there, which are merged when metrics are collected.
+REQUEST_SECONDS = Histogram('dashboard_request_seconds',
+                            'Time to handle a request',
+                            ['route', 'method', 'status'])
+OCI_SECONDS = Histogram('dashboard_oci_call_seconds',
+                        'Time of OCI API calls, each retry counted once',
+                        ['service', 'region'])
+OCI_ERRORS = Counter('dashboard_oci_call_errors_total',
+                     'OCI API calls that raised, by status or error type',
+                     ['service', 'region', 'status'])
+SESSION_SECONDS = Histogram('dashboard_session_seconds',
+                            'Time to load or save a session in the session store',
+                            ['operation'],
+                            buckets=(.0005, .001, .0025, .005, .01, .025, .05,
+                                     .1, .25, .5, 1))
+CACHE_LOOKUPS = Counter('dashboard_cache_lookups_total',
+                        'Cache lookups by cache and result', ['cache', 'result'])
+
+# Request environ key holding the perf_counter_ns (start, end) of session load,
+# which runs before the request's trace is started
+SESSION_LOAD = 'dashboard.session_load'
+
+
+class MeasuredClient:
+    """MeasuredClient records the time and errors of every call to an OCI
+       client's operations by service and region. Other attributes are read
+       from the client as is.
+    """
+
+    def __init__(self, client, service: str, region: str):
+        self.client = client
+        self.service = service
+        self.region = region
+        self.seconds = OCI_SECONDS.labels(service, region)
+
+    def __repr__(self) -> str:
+        return (f'MeasuredClient - service: {self.service} region: {self.region} '
+                f'client: {self.client}')
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def measured(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            except ServiceError as e:
+                OCI_ERRORS.labels(self.service, self.region, str(e.status)).inc()
+                raise
+            except Exception as e:
+                OCI_ERRORS.labels(self.service, self.region, type(e).__name__).inc()
+                raise
+            finally:
+                self.seconds.observe(perf_counter() - start)
+
+        return measured
+
+
+class MeasuredSessionInterface(SessionInterface):
+    """MeasuredSessionInterface records the time a session interface takes to
+       load and save sessions, passing everything else to it. Load times are
+       left in the request environ for its trace and saves are traced as they
+       run, after every after_request hook, so Server-Timing is updated then.
+    """
+
+    def __init__(self, interface: SessionInterface):
+        self.interface = interface
+
+    def __getattr__(self, name: str):
+        return getattr(self.interface, name)
+
+    def open_session(self, app, request):
+        start = perf_counter_ns()
+        try:
+            return self.interface.open_session(app, request)
+        finally:
+            end = perf_counter_ns()
+            request.environ[SESSION_LOAD] = (start, end)
+            SESSION_SECONDS.labels('load').observe((end - start) / 1e9)
+
+    def save_session(self, app, session, response):
+        start = perf_counter()
+        try:
+            with span('session_save'):
+                return self.interface.save_session(app, session, response)
+        finally:
+            SESSION_SECONDS.labels('save').observe(perf_counter() - start)
+
+            trace = current_trace.get()
+            if trace is not None and 'Server-Timing' in response.headers:
+                response.headers['Server-Timing'] = trace.server_timing()
+
+    def make_null_session(self, app):
+        return self.interface.make_null_session(app)
+
+    def is_null_session(self, obj) -> bool:
+        return self.interface.is_null_session(obj)
+
+
+# Count a cache lookup as a hit or miss
+def cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+# Return metrics in the Prometheus text format, merged across workers when
+# running under gunicorn
+def collect() -> bytes:
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+    return generate_latest(REGISTRY)
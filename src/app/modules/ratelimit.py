@@ -0,0 +1,431 @@
+#!/usr/bin/python3.11
+
+import functools
+import logging
+import os
+import random
+import sqlite3
+import threading
+
+from collections.abc import Callable
+from contextlib import contextmanager
+from time import sleep, time
+
+from circuitbreaker import CircuitBreakerError
+from oci._vendor.requests.exceptions import RequestException
+from oci.exceptions import ServiceError
+from oci.retry import NoneRetryStrategy
+
+from .log import get_logger
+from .metrics import MeasuredClient
+
+
+class RateLimiter:
+    """RateLimiter paces and retries every OCI call made through the clients it
+       wraps. Each (service, region) pair has a token bucket refilled at a rate
+       that halves when OCI throttles and recovers linearly, and a concurrency
+       limit that halves on throttling or server errors and grows by one call
+       per limit's worth of successes. Given a path, buckets and concurrency
+       limits are kept in SQLite so they bound the calls of every worker on a
+       host together, otherwise they only bound the calls of this process.
+       Wrapped clients are retried here rather than by the SDK, so every retry
+       is paced too. Calls are retried with full jitter backoff on the errors
+       the SDK's default strategy retries: throttling, server errors other
+       than 501, 409 IncorrectState, timeouts, connection failures and open
+       circuit breakers.
+
+       Keyword arguments:
+       path -- SQLite database file shared by workers, None for in process only
+       rate -- calls per second allowed for each service and region (default 10)
+       burst -- calls allowed at once after being idle (default 20)
+       concurrency -- most calls in flight per service and region, across
+                      workers sharing path (default 16)
+       attempts -- tries per call before the error is raised (default 4)
+    """
+
+    # Rate never drops below this many calls per second
+    min_rate = 0.5
+    # Calls per second the rate recovers by each second after throttling
+    recovery = 0.5
+    # Seconds after lowering the rate before throttling lowers it again, calls
+    # already in flight are throttled together and count once
+    cooldown = 1
+    # Backoff base and cap in seconds
+    backoff = 0.5
+    backoff_cap = 20
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,
+            rate REAL NOT NULL,
+            throttled REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS windows (
+            key TEXT PRIMARY KEY,
+            size REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS inflight (
+            key TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            active INTEGER NOT NULL,
+            PRIMARY KEY (key, pid)
+        );
+    '''
+
+    def __init__(self, path: str | None=None, rate: float=10, burst: float=20,
+                 concurrency: int=16, attempts: int=4,
+                 log_level: int | str=logging.INFO):
+        # Logging
+        self.logger = get_logger(__name__, log_level)
+
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self._reset()
+        # Locks and connections must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._reset)
+
+        if path:
+            with self.connection() as conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(self.schema)
+
+    def __repr__(self) -> str:
+        return (f'RateLimiter - path: {self.path} rate: {self.rate} '
+                f'burst: {self.burst} concurrency: {self.concurrency} '
+                f'attempts: {self.attempts}')
+
+    def _reset(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.buckets: dict[str, tuple[float, float, float, float]] = {}
+        self.limits: dict[str, 'ConcurrencyLimit | SharedConcurrencyLimit'] = {}
+
+    # SQLite connections cannot be shared between threads, keep one per thread
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+
+        return conn
+
+    def call(self, key: str, func: Callable, *args, **kwargs):
+        '''Call func within the limits for key, retrying throttled, failed and
+        unreachable calls with backoff.
+        '''
+
+        limit = self.limit(key)
+        for attempt in range(self.attempts):
+            self.acquire(key)
+            with limit:
+                try:
+                    response = func(*args, **kwargs)
+                    limit.increase()
+                    return response
+                except ServiceError as e:
+                    if not self.retryable(e):
+                        raise
+                    error, retry_after = e, (e.headers or {}).get('retry-after')
+                # The SDK raises its vendored requests' errors
+                except (RequestException, CircuitBreakerError) as e:
+                    error, retry_after = e, None
+
+            # A resource in the wrong state says nothing about OCI's load
+            if getattr(error, 'status', None) != 409:
+                limit.decrease()
+            if getattr(error, 'status', None) == 429:
+                self.throttled(key)
+            if attempt == self.attempts - 1:
+                raise error
+
+            delay = random.uniform(0, min(self.backoff_cap,
+                                          self.backoff * 2 ** attempt))
+            try:
+                delay = max(delay, float(retry_after)) if retry_after else delay
+            except ValueError:
+                pass
+            self.logger.warning('Retrying %s %s in %.2fs after %s',
+                                key, func.__name__, delay, error)
+            sleep(delay)
+
+    # Service errors retried, as by the SDK's default retry strategy
+    @staticmethod
+    def retryable(error: ServiceError) -> bool:
+        return (error.status == 429
+                or (error.status == 409 and error.code == 'IncorrectState')
+                or (error.status >= 500 and error.status != 501))
+
+    def limit(self, key: str) -> 'ConcurrencyLimit | SharedConcurrencyLimit':
+        with self.lock:
+            limit = self.limits.get(key)
+            if limit is None:
+                limit = self.limits[key] = (
+                    SharedConcurrencyLimit(self, key, self.concurrency) if self.path
+                    else ConcurrencyLimit(self.concurrency))
+            return limit
+
+    # Wait for a token from the bucket for key
+    def acquire(self, key: str):
+        while True:
+            wait = self.take(key)
+            if wait <= 0:
+                return
+            # Spread waiting callers so they do not all wake at once
+            sleep(wait * random.uniform(1, 1.5))
+
+    def take(self, key: str) -> float:
+        '''Take a token if one is available, returning 0, or return the
+        seconds until the next token.
+        '''
+
+        now = time()
+        with self.transaction() as bucket:
+            tokens, updated, rate, throttled = (bucket(key) or
+                                                (self.burst, now, self.rate, 0))
+            elapsed = max(now - updated, 0)
+            rate = min(self.rate, rate + self.recovery * elapsed)
+            tokens = min(self.burst, tokens + rate * elapsed)
+
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            bucket(key, (tokens, now, rate, throttled))
+
+        return wait
+
+    # Halve the rate of key after OCI throttled a call
+    def throttled(self, key: str):
+        now = time()
+        with self.transaction() as bucket:
+            tokens, updated, rate, throttled = (bucket(key) or
+                                                (self.burst, now, self.rate, 0))
+            if now - throttled < self.cooldown:
+                return
+            rate = max(self.min_rate, rate / 2)
+            bucket(key, (min(tokens, 0), now, rate, now))
+
+        self.logger.info('Throttled on %s, rate lowered to %.2f/s', key, rate)
+
+    def transaction(self) -> 'BucketTransaction':
+        return BucketTransaction(self)
+
+    def client(self, client_class, config: dict, region: str, signer=None,
+               service: str | None=None):
+        '''Create a client for a region that calls OCI through this limiter.'''
+
+        client = create_client(client_class, config, region, signer=signer,
+                               service=service,
+                               retry_strategy=NoneRetryStrategy())
+        return LimitedClient(client, self,
+                             f'{service or client_class.__name__}:{region}')
+
+
+class BucketTransaction:
+    """BucketTransaction reads and writes token buckets atomically, under an
+       immediate SQLite transaction when shared or the limiter lock otherwise.
+       The transaction is a function returning a bucket given only a key, and
+       saving one given a key and bucket.
+    """
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def __enter__(self):
+        if self.limiter.path:
+            self.conn = self.limiter.connection()
+            self.conn.execute('BEGIN IMMEDIATE')
+        else:
+            self.limiter.lock.acquire()
+        return self.bucket
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.limiter.path:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        else:
+            self.limiter.lock.release()
+
+    def bucket(self, key: str,
+               value: tuple[float, float, float, float] | None=None):
+        if not self.limiter.path:
+            if value is None:
+                return self.limiter.buckets.get(key)
+            self.limiter.buckets[key] = value
+        elif value is None:
+            return self.conn.execute(
+                'SELECT tokens, updated, rate, throttled FROM buckets '
+                'WHERE key = ?',
+                (key,)).fetchone()
+        else:
+            self.conn.execute('INSERT OR REPLACE INTO buckets '
+                              'VALUES (?, ?, ?, ?, ?)', (key, *value))
+
+
+class ConcurrencyLimit:
+    """ConcurrencyLimit bounds calls in flight to a limit adjusted by additive
+       increase and multiplicative decrease, between 1 and maximum.
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def increase(self):
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify()
+
+    def decrease(self):
+        with self.condition:
+            self.limit = max(1.0, self.limit / 2)
+
+
+class SharedConcurrencyLimit:
+    """SharedConcurrencyLimit is a ConcurrencyLimit kept in a RateLimiter's
+       SQLite database, bounding calls in flight from every worker sharing it.
+       Each process counts its own calls in flight, so the calls of a worker
+       that died are dropped from the count once another caller has to wait.
+    """
+
+    # Seconds between checks for a free slot
+    poll = 0.02
+
+    def __init__(self, limiter: RateLimiter, key: str, maximum: int):
+        self.limiter = limiter
+        self.key = key
+        self.maximum = maximum
+
+    def __enter__(self):
+        while True:
+            with self.transaction() as conn:
+                size = self.size(conn)
+                active = conn.execute(
+                    'SELECT COALESCE(SUM(active), 0) FROM inflight WHERE key = ?',
+                    (self.key,)).fetchone()[0]
+                if active < int(size):
+                    conn.execute(
+                        'INSERT INTO inflight VALUES (?, ?, 1) ON CONFLICT (key, pid) '
+                        'DO UPDATE SET active = active + 1', (self.key, os.getpid()))
+                    return
+
+            self.reap()
+            sleep(self.poll * random.uniform(1, 1.5))
+
+    def __exit__(self, exc_type, exc, tb):
+        with self.transaction() as conn:
+            conn.execute('UPDATE inflight SET active = active - 1 '
+                         'WHERE key = ? AND pid = ?', (self.key, os.getpid()))
+            # Recycled workers would otherwise leave a row each
+            conn.execute('DELETE FROM inflight WHERE key = ? AND pid = ? '
+                         'AND active <= 0', (self.key, os.getpid()))
+
+    def increase(self):
+        with self.transaction() as conn:
+            size = self.size(conn)
+            self.resize(conn, min(self.maximum, size + 1 / size))
+
+    def decrease(self):
+        with self.transaction() as conn:
+            self.resize(conn, max(1.0, self.size(conn) / 2))
+
+    def size(self, conn: sqlite3.Connection) -> float:
+        row = conn.execute('SELECT size FROM windows WHERE key = ?',
+                           (self.key,)).fetchone()
+        return row[0] if row else float(self.maximum)
+
+    def resize(self, conn: sqlite3.Connection, size: float):
+        conn.execute('INSERT OR REPLACE INTO windows VALUES (?, ?)', (self.key, size))
+
+    # Drop the calls in flight of processes that no longer exist
+    def reap(self):
+        pids = [row[0] for row in self.limiter.connection().execute(
+            'SELECT DISTINCT pid FROM inflight WHERE key = ?', (self.key,))]
+        dead = []
+        for pid in pids:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                dead.append(pid)
+            except PermissionError:
+                pass # Alive, run by another user
+
+        if dead:
+            with self.transaction() as conn:
+                conn.executemany('DELETE FROM inflight WHERE pid = ?',
+                                 [(pid,) for pid in dead])
+
+    @contextmanager
+    def transaction(self):
+        conn = self.limiter.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+class LimitedClient:
+    """LimitedClient passes calls to an OCI client's operations through a
+       RateLimiter. Other attributes are read from the client as is.
+    """
+
+    def __init__(self, client, limiter: RateLimiter, key: str):
+        self.client = client
+        self.limiter = limiter
+        self.key = key
+
+    def __repr__(self) -> str:
+        return f'LimitedClient - key: {self.key} client: {self.client}'
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def limited(*args, **kwargs):
+            return self.limiter.call(self.key, attr, *args, **kwargs)
+
+        return limited
+
+
+# Create an OCI client for a region. Each client gets its own config so regions
+# never leak between clients, the region in config is used over any signer's.
+# One signer is shared by every client: token based signers refresh their token
+# and session key under the SDK's locks, and copies would each refresh their
+# own. Every call made by the client is measured by service and region, and
+# paced by the limiter if one is given.
+def create_client(client_class, config: dict, region: str, signer=None,
+                  limiter: RateLimiter | None=None, service: str | None=None,
+                  **kwargs):
+    if limiter:
+        return limiter.client(client_class, config, region, signer=signer,
+                              service=service)
+
+    config = dict(config, region=region)
+    if signer:
+        kwargs['signer'] = signer
+
+    return MeasuredClient(client_class(config, **kwargs),
+                          service or client_class.__name__, region)
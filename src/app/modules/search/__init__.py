@@ -1,4 +1,11 @@
 #!/usr/bin/python3.11
 
 from .search import Search, SearchError
-from .filter import AbstractFilter, ExpiryFilter
\ No newline at end of file
+from .filter import (AbstractFilter, FilterPipeline, ExpiryFilter, LifecycleFilter,
+                     ResourceTypeFilter, CompartmentFilter)
+from .cache import SearchCache, Invalidations
+from .index import InventoryIndex, Indexer
+from .prefetch import Prefetcher
+from .record import ResourceRecord, RecordPage, encode_response, decode_response
+from .flight import SingleFlight
+from .team import TeamSearch
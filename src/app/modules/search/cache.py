@@ -0,0 +1,148 @@
+#!/usr/bin/python3.11
+
+import os
+import threading
+
+from collections import OrderedDict
+from hashlib import sha256
+from time import monotonic, time, time_ns
+
+from ..metrics import cache_lookup
+
+
+class Invalidations:
+    """Invalidations records when each user's results in a region were last
+       invalidated, as the modification time of a file per user and region in
+       a directory shared by the workers on a host. Caches check it before
+       serving results so a delete handled by one worker is seen by all.
+
+       Keyword arguments:
+       path -- directory for invalidation files
+       retention -- seconds invalidations are kept, at least as long as any
+                    cache holds results (default 3600)
+    """
+
+    def __init__(self, path: str, retention: float=3600):
+        self.path = path
+        self.retention = retention
+        self.purged = time()
+
+        os.makedirs(path, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f'Invalidations - path: {self.path} retention: {self.retention}'
+
+    def file(self, user: str, region: str) -> str:
+        return os.path.join(self.path,
+                            sha256(repr((user, region)).encode()).hexdigest())
+
+    # Invalidate a user's results in each of the given regions
+    def add(self, user: str, *regions: str):
+        # Set the time explicitly, file times from the kernel clock can lag
+        now = time_ns()
+        for region in regions:
+            name = self.file(user, region)
+            with open(name, 'a'):
+                pass
+            os.utime(name, ns=(now, now))
+
+        self._purge()
+
+    # Return the time_ns a user's results in a region were last invalidated,
+    # 0 if they never were
+    def last(self, user: str, region: str) -> int:
+        try:
+            return os.stat(self.file(user, region)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    # Remove invalidations older than any cached result
+    def _purge(self):
+        now = time()
+        if now - self.purged < self.retention:
+            return
+        self.purged = now
+
+        for entry in os.scandir(self.path):
+            try:
+                if entry.stat().st_mtime < now - self.retention:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class SearchCache:
+    """SearchCache holds recent search results in memory so repeated requests for
+       the same page do not go back to OCI. Entries are keyed by
+       (user, resource, region, page), expire after ttl seconds, and the least
+       recently used entry is evicted once the cache holds maxsize entries.
+       Given shared invalidations, entries fetched before a user's results
+       were invalidated by any worker are dropped.
+
+       Keyword arguments:
+       ttl -- seconds an entry stays valid (default 60)
+       maxsize -- maximum number of entries held (default 1024)
+       invalidations -- invalidations shared with other workers (default none)
+    """
+
+    def __init__(self, ttl: float=60, maxsize: int=1024,
+                 invalidations: Invalidations | None=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.invalidations = invalidations
+        self.entries: OrderedDict[tuple, tuple[float, int, object]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f'SearchCache - ttl: {self.ttl} maxsize: {self.maxsize}'
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: tuple):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                cache_lookup('search', False)
+                return None
+
+            expires, fetched, value = entry
+            if expires < monotonic() or (
+                    self.invalidations is not None
+                    and self.invalidations.last(key[0], key[2]) >= fetched):
+                del self.entries[key]
+                cache_lookup('search', False)
+                return None
+
+            self.entries.move_to_end(key)
+            cache_lookup('search', True)
+            return value
+
+    def set(self, key: tuple, value, fetched: int | None=None):
+        '''Cache value for key. fetched is the time_ns the value was fetched
+        at, so invalidations made while fetching it also drop it (default now).
+        '''
+
+        fetched = time_ns() if fetched is None else fetched
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, fetched, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    # Remove every entry for a user in any of the given regions, in every
+    # worker if invalidations are shared
+    def invalidate(self, user: str, *regions: str):
+        with self.lock:
+            stale = [key for key in self.entries
+                     if key[0] == user and key[2] in regions]
+            for key in stale:
+                del self.entries[key]
+
+        if self.invalidations is not None:
+            self.invalidations.add(user, *regions)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -1,57 +1,203 @@
 #!/usr/bin/python3.11
 
 import datetime
+import functools
 import logging
 
 from oci.response import Response
 
-# Used to filter search results
+from ..log import get_logger
+
+# Used to filter search results. Filters decide on one item at a time in keep,
+# so any number of them run in a single pass over the results. Each declares the
+# item fields and defined tags (namespace, key) it reads. Filters that can be
+# expressed in the search language also return a query clause so the search
+# service filters before paging.
 class AbstractFilter:
-    def __init__(self, **kwargs):
-        log_level = kwargs.get('log_level', logging.INFO)
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(log_level)
+    fields: tuple[str, ...] = ()
 
-        handler = logging.StreamHandler()
-        handler.setLevel(log_level)
-        handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        
-        self.logger.addHandler(handler)
+    def __init__(self, **kwargs):
+        self.logger = get_logger(__name__, kwargs.get('log_level', logging.INFO))
 
     def __repr__(self) -> str:
         return f'AbstractFilter - log_level: {self.logger.getEffectiveLevel()}'
 
-    # The filter function takes a response and returns a response.
-    # This method is meant to be overwritten.
+    # Compose filters, an item is kept only if every filter keeps it
+    def __and__(self, other: 'AbstractFilter') -> 'FilterPipeline':
+        return FilterPipeline(self, other)
+
+    @property
+    def tags(self) -> tuple[tuple[str, str], ...]:
+        return ()
+
+    # Called once per results before keep, for state shared by every item
+    def prepare(self):
+        pass
+
+    # Query clause selecting exactly the items kept, '' if every item is kept
+    # or None if the filter cannot be expressed as a clause
+    def clause(self) -> str | None:
+        return ''
+
+    # Searches filtered by the clause need no filtering after paging
+    @property
+    def exact(self) -> bool:
+        return self.clause() is not None
+
+    # Return True to keep an item. This method is meant to be overwritten.
+    def keep(self, item) -> bool:
+        return True
+
+    # The filter function takes a response and returns a response, removing
+    # every item not kept in one pass.
     def results(self, response: Response, **kwargs):
+        self.prepare()
+        response.data.items[:] = [item for item in response.data.items
+                                  if self.keep(item)]
         return response
-    
+
+# Run several filters over results in a single pass
+class FilterPipeline(AbstractFilter):
+    def __init__(self, *filters: AbstractFilter, log_level=logging.INFO, **kwargs):
+        super().__init__(log_level=log_level)
+        self.filters: list[AbstractFilter] = []
+        for filter in filters:
+            self.filters += (filter.filters if isinstance(filter, FilterPipeline)
+                             else [filter])
+
+    def __repr__(self) -> str:
+        return 'FilterPipeline - ' + ' & '.join(repr(f).strip() for f in self.filters)
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        return tuple(dict.fromkeys(f for filter in self.filters
+                                   for f in filter.fields))
+
+    @property
+    def tags(self) -> tuple[tuple[str, str], ...]:
+        return tuple(dict.fromkeys(t for filter in self.filters
+                                   for t in filter.tags))
+
+    def prepare(self):
+        for filter in self.filters:
+            filter.prepare()
+
+    # Clauses of the filters that can be pushed down, the rest filter after paging
+    def clause(self) -> str:
+        return ' && '.join(clause for clause in
+                           (filter.clause() for filter in self.filters) if clause)
+
+    @property
+    def exact(self) -> bool:
+        return all(filter.exact for filter in self.filters)
+
+    def keep(self, item) -> bool:
+        return all(filter.keep(item) for filter in self.filters)
+
+# Expiry tags repeat across resources, parse each value once. Tag values are
+# set by users, so the cache holds a bounded number of values no longer than
+# a date, longer values never parse and are not cached
+def parse_date(value: str) -> datetime.date | None:
+    if not isinstance(value, str) or len(value) > len('YYYY-MM-DD'):
+        return None
+    return _parse_date(value)
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date(value: str) -> datetime.date | None:
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
 # Check for expiring resources. Takes keyword arguments for timedelta. A resource
 # that should be defaulted to a 90 day expiry should be entered as (days=90).
 class ExpiryFilter(AbstractFilter):
+    fields = ('defined_tags',)
+
     def __init__(self, tag:str, key: str, log_level=logging.INFO, **kwargs):
         super().__init__(log_level=log_level)
         self.tag = tag
         self.key = key
-        self.logger.debug(f'Using Expiry Filter: {self}')
+        self.today = datetime.date.today()
+        self.logger.debug('Using Expiry Filter: %s', self)
 
     def __repr__(self) -> str:
         return (f'ExpiryFilter - log_level: {self.logger.getEffectiveLevel()}\n'
                 f'\tTag: {self.tag}\n\tKey: {self.key}\n')
 
-    def results(self, response: Response, **kwargs):
-        today = datetime.date.today()
-        self.logger.debug(f'Today: {today}')
-
-        for i, item in enumerate(response.data.items):
-            try:
-                # If today is before expiry tag, remove item
-                if today <= datetime.datetime.strptime(
-                    item.defined_tags[self.tag][self.key], '%Y-%m-%d').date():
-                    del response.data.items[i]
-            # Retain untagged items
-            except (KeyError, ValueError):
-                pass
-
-        return response
\ No newline at end of file
+    @property
+    def tags(self) -> tuple[tuple[str, str], ...]:
+        return ((self.tag, self.key),)
+
+    def prepare(self):
+        self.today = datetime.date.today()
+        self.logger.debug('Today: %s', self.today)
+
+    # Untagged and unparsable resources are kept, which search cannot express
+    # alongside the owner tag condition, so expiry is always checked after paging
+    def clause(self) -> None:
+        return None
+
+    def keep(self, item) -> bool:
+        try:
+            expiry = parse_date(item.defined_tags[self.tag][self.key])
+        # Retain untagged items
+        except (KeyError, TypeError):
+            return True
+
+        # If today is before expiry tag, remove item
+        return expiry is None or self.today > expiry
+
+# Keep resources in one of the given lifecycle states
+class LifecycleFilter(AbstractFilter):
+    fields = ('lifecycle_state',)
+
+    def __init__(self, *states: str, log_level=logging.INFO, **kwargs):
+        super().__init__(log_level=log_level)
+        self.states = {state.upper() for state in states}
+
+    def __repr__(self) -> str:
+        return f'LifecycleFilter - states: {sorted(self.states)}'
+
+    def clause(self) -> str:
+        return '(' + ' || '.join(f"lifeCycleState = '{state}'"
+                                 for state in sorted(self.states)) + ')'
+
+    def keep(self, item) -> bool:
+        return (item.lifecycle_state or '').upper() in self.states
+
+# Keep resources of one of the given resource types
+class ResourceTypeFilter(AbstractFilter):
+    fields = ('resource_type',)
+
+    def __init__(self, *resource_types: str, log_level=logging.INFO, **kwargs):
+        super().__init__(log_level=log_level)
+        self.resource_types = {resource_type.lower() for resource_type in resource_types}
+
+    def __repr__(self) -> str:
+        return f'ResourceTypeFilter - resource_types: {sorted(self.resource_types)}'
+
+    # Resource types are chosen in the query head by the user's selection
+    def clause(self) -> None:
+        return None
+
+    def keep(self, item) -> bool:
+        return (item.resource_type or '').lower() in self.resource_types
+
+# Keep resources in one of the given compartments
+class CompartmentFilter(AbstractFilter):
+    fields = ('compartment_id',)
+
+    def __init__(self, *compartments: str, log_level=logging.INFO, **kwargs):
+        super().__init__(log_level=log_level)
+        self.compartments = set(compartments)
+
+    def __repr__(self) -> str:
+        return f'CompartmentFilter - compartments: {sorted(self.compartments)}'
+
+    def clause(self) -> str:
+        return '(' + ' || '.join(f"compartmentId = '{compartment}'"
+                                 for compartment in sorted(self.compartments)) + ')'
+
+    def keep(self, item) -> bool:
+        return item.compartment_id in self.compartments
@@ -0,0 +1,130 @@
+#!/usr/bin/python3.11
+
+import fcntl
+import os
+import tempfile
+import threading
+
+from collections.abc import Callable
+from concurrent.futures import Future
+from hashlib import sha256
+from time import monotonic, sleep, time
+
+from ..metrics import cache_lookup
+
+
+class SingleFlight:
+    """SingleFlight coalesces identical concurrent calls so only one runs and
+       the rest share its result. Calls are always coalesced within a process.
+       Given a directory shared by the workers on a host, the thread running a
+       call also takes a lock file for its key so other workers wait for it and
+       read its result from a file rather than making the same call.
+
+       Keyword arguments:
+       path -- directory for lock and result files, None for in process only
+       timeout -- seconds to wait on another worker before calling anyway (default 10)
+       encode -- converts a result to bytes, required with path
+       decode -- converts bytes back to a result, required with path
+    """
+
+    # Seconds result files are kept before being removed
+    retention = 60
+
+    def __init__(self, path: str | None=None, timeout: float=10,
+                 encode: Callable[[object], bytes] | None=None,
+                 decode: Callable[[bytes], object] | None=None):
+        self.path = path
+        self.timeout = timeout
+        self.encode = encode
+        self.decode = decode
+        self.flights: dict[tuple, Future] = {}
+        self.lock = threading.Lock()
+        self.purged = time()
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return (f'SingleFlight - path: {self.path} timeout: {self.timeout} '
+                f'in flight: {len(self.flights)}')
+
+    def do(self, key: tuple, call: Callable[[], object]):
+        '''Return the result of call, shared with any identical call for key
+        already in flight.
+        '''
+
+        with self.lock:
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights[key] = Future()
+
+        # Calls sharing another's result count as hits
+        cache_lookup('flight', not leader)
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._shared(key, call) if self.path else call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+    # Coalesce across workers with a lock file per key
+    def _shared(self, key: tuple, call: Callable[[], object]):
+        name = os.path.join(self.path, sha256(repr(key).encode()).hexdigest())
+        started = time()
+
+        with open(f'{name}.lock', 'w') as lock:
+            deadline = monotonic() + self.timeout
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    # Another worker is making the call
+                    if monotonic() > deadline:
+                        return call()
+                    sleep(0.01)
+
+            try:
+                # A result written since we started waiting is this call's
+                try:
+                    if os.stat(f'{name}.result').st_mtime >= started:
+                        with open(f'{name}.result', 'rb') as f:
+                            result = self.decode(f.read())
+                        cache_lookup('flight_shared', True)
+                        return result
+                except (FileNotFoundError, ValueError):
+                    pass
+
+                cache_lookup('flight_shared', False)
+                result = call()
+                with tempfile.NamedTemporaryFile('wb', dir=self.path,
+                                                 delete=False) as f:
+                    f.write(self.encode(result))
+                os.replace(f.name, f'{name}.result')
+                self._purge()
+
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Remove lock and result files of keys not called recently
+    def _purge(self):
+        now = time()
+        if now - self.purged < self.retention:
+            return
+        self.purged = now
+
+        for entry in os.scandir(self.path):
+            try:
+                if entry.stat().st_mtime < now - self.retention:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
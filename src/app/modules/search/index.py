@@ -0,0 +1,332 @@
+#!/usr/bin/python3.11
+
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+
+import msgspec
+
+from datetime import timezone
+from time import time
+from oci import resource_search
+from oci.pagination import list_call_get_all_results
+from oci.response import Response
+
+from .record import RecordPage, ResourceRecord, to_record
+from ..log import get_logger
+
+
+class InventoryIndex:
+    """InventoryIndex is a local SQLite store of tagged resources keyed by owner,
+       region and resource type. It is filled by the Indexer and read by Search
+       so interactive requests do not have to wait on OCI Search.
+
+       Keyword arguments:
+       path -- SQLite database file, shared by all workers on the host
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS resources (
+            identifier TEXT NOT NULL,
+            region TEXT NOT NULL,
+            owner TEXT,
+            resource_type TEXT NOT NULL,
+            created REAL NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (identifier, region)
+        );
+        CREATE INDEX IF NOT EXISTS resources_owner
+            ON resources (owner, region, resource_type COLLATE NOCASE, created);
+        CREATE INDEX IF NOT EXISTS resources_owner_created
+            ON resources (owner, created);
+        CREATE TABLE IF NOT EXISTS sync (
+            region TEXT PRIMARY KEY,
+            last_sync REAL NOT NULL,
+            last_full REAL NOT NULL,
+            watermark TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sweep (
+            region TEXT PRIMARY KEY,
+            after TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder(ResourceRecord)
+        # Connections must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._reset)
+
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.schema)
+
+    def __repr__(self) -> str:
+        return f'InventoryIndex - path: {self.path}'
+
+    def _reset(self):
+        self.local = threading.local()
+
+    # SQLite connections cannot be shared between threads, keep one per thread
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+
+        return conn
+
+    def page(self, owner: str, region: str | None=None, resource: str='all',
+             offset: int=0, limit: int=25) -> Response:
+        '''Return a page of an owner's resources newest first as a search
+        Response. The next page is the offset of the following page. A region
+        of None returns resources from every region.
+        '''
+
+        query = 'SELECT region, data FROM resources WHERE owner = ?'
+        params: list = [owner]
+        if region:
+            query += ' AND region = ?'
+            params.append(region)
+        if resource != 'all':
+            query += ' AND resource_type = ? COLLATE NOCASE'
+            params.append(resource)
+        query += ' ORDER BY created DESC LIMIT ? OFFSET ?'
+        # Read one extra row to know if there is another page
+        params += [limit + 1, offset]
+
+        rows = self.connection().execute(query, params).fetchall()
+
+        items = []
+        for row_region, data in rows[:limit]:
+            item = self.decoder.decode(data)
+            item.region = row_region
+            items.append(item)
+
+        headers = {}
+        if len(rows) > limit:
+            headers['opc-next-page'] = str(offset + limit)
+
+        return Response(200, headers, RecordPage(items=items), None)
+
+    # Return identifiers of resources indexed in a region in order, only those
+    # after the given identifier and no more than limit if given
+    def identifiers(self, region: str, after: str | None=None,
+                    limit: int | None=None) -> list[str]:
+        return [row[0] for row in self.connection().execute(
+            'SELECT identifier FROM resources WHERE region = ? AND identifier > ? '
+            'ORDER BY identifier LIMIT ?', (region, after or '', -1 if limit is None else limit))]
+
+    # Return the identifier the next termination sweep of a region starts after
+    def sweep_position(self, region: str) -> str | None:
+        row = self.connection().execute('SELECT after FROM sweep WHERE region = ?',
+                                        (region,)).fetchone()
+        return row[0] if row else None
+
+    def set_sweep_position(self, region: str, after: str | None):
+        with self.connection() as conn:
+            if after is None:
+                conn.execute('DELETE FROM sweep WHERE region = ?', (region,))
+            else:
+                conn.execute('INSERT OR REPLACE INTO sweep VALUES (?, ?)',
+                             (region, after))
+
+    def upsert(self, region: str, owners: list[tuple[str, ResourceRecord]]):
+        with self.connection() as conn:
+            conn.executemany('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)',
+                             self.rows(region, owners))
+
+    def remove(self, region: str, identifiers: list[str]):
+        with self.connection() as conn:
+            conn.executemany(
+                'DELETE FROM resources WHERE identifier = ? AND region = ?',
+                [(identifier, region) for identifier in identifiers])
+
+    # Replace every resource in a region with a fresh full listing in one
+    # transaction so readers never see the region empty
+    def replace(self, region: str, owners: list[tuple[str, ResourceRecord]]):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM resources WHERE region = ?', (region,))
+            conn.executemany('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)',
+                             self.rows(region, owners))
+
+    def rows(self, region: str, owners: list[tuple[str, ResourceRecord]]
+             ) -> list[tuple]:
+        return [(item.identifier, region, owner, item.resource_type,
+                 item.time_created.timestamp() if item.time_created else 0,
+                 self.encoder.encode(item).decode())
+                for owner, item in owners]
+
+    def mark_synced(self, region: str, watermark: str | None, full: bool):
+        now = time()
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT INTO sync VALUES (?, ?, ?, ?) ON CONFLICT (region) DO UPDATE '
+                'SET last_sync = excluded.last_sync, watermark = excluded.watermark, '
+                'last_full = CASE WHEN ? THEN excluded.last_full ELSE last_full END',
+                (region, now, now if full else 0, watermark, full))
+
+    # Return (last sync, last full sync, watermark) for a region or None
+    def sync_state(self, region: str) -> tuple[float, float, str | None] | None:
+        return self.connection().execute(
+            'SELECT last_sync, last_full, watermark FROM sync WHERE region = ?',
+            (region,)).fetchone()
+
+    def staleness(self, regions: list[str]) -> float | None:
+        '''Return seconds since the least recently synced region was refreshed,
+        or None if any region has never been synced.
+        '''
+
+        syncs = [self.sync_state(region) for region in regions]
+        if not syncs or None in syncs:
+            return None
+
+        return time() - min(sync[0] for sync in syncs)
+
+
+class Indexer:
+    """Indexer periodically copies every resource carrying the owner tag into an
+       InventoryIndex. Only one worker on a host syncs at a time, guarded by a
+       lock file next to the database. Regular syncs fetch resources created
+       since the last sync and check the next sweep_size indexed resources for
+       terminations, rotating through the index so each sync makes a bounded
+       number of searches. Full syncs replace the region, dropping every
+       terminated resource and picking up tag changes. Tag changes are not seen
+       until then, so ownership is never authorized from the index.
+
+       Keyword arguments:
+       interval -- seconds between syncs (default 60)
+       full_interval -- seconds between full syncs (default 900)
+       sweep_size -- indexed resources checked for termination per sync, 0
+                     leaves terminations to full syncs (default 500)
+    """
+
+    def __init__(self, search, index: InventoryIndex, interval: float=60,
+                 full_interval: float=900, sweep_size: int=500,
+                 log_level: int | str=logging.INFO):
+        # Logging
+        self.logger = get_logger(__name__, log_level)
+
+        self.search = search
+        self.index = index
+        self.interval = interval
+        self.full_interval = full_interval
+        self.sweep_size = sweep_size
+        self.stop = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.pid: int | None = None
+
+    def __repr__(self) -> str:
+        return (f'Indexer - interval: {self.interval} '
+                f'full_interval: {self.full_interval} sweep_size: {self.sweep_size} '
+                f'index: {self.index}')
+
+    def start(self):
+        '''Start syncing in a background thread. Safe to call on every request
+        as the thread is started once per process, so a preloaded app starts it
+        in each worker rather than in the master.
+        '''
+
+        if self.pid == os.getpid():
+            return
+
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name='indexer', daemon=True)
+        self.thread.start()
+        self.logger.info('Started %s', self)
+
+    def run(self):
+        with open(f'{self.index.path}.lock', 'w') as lock:
+            while not self.stop.is_set():
+                try:
+                    # Another worker holds the lock and is syncing
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.stop.wait(self.interval)
+                    continue
+
+                try:
+                    self.sync()
+                except Exception as e:
+                    self.logger.error('Inventory sync failed: %s', e)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+                self.stop.wait(self.interval)
+
+    def sync(self):
+        for region in self.search.region_names:
+            state = self.index.sync_state(region)
+            if state and state[0] > time() - self.interval / 2:
+                continue # Recently synced by another worker
+
+            if not state or state[1] < time() - self.full_interval:
+                self.sync_full(region)
+            else:
+                self.sync_incremental(region, state[2])
+
+    def sync_full(self, region: str):
+        owners = self.fetch(region, "lifeCycleState != 'TERMINATED' && "
+                                    "lifeCycleState != 'TERMINATING'")
+        self.index.replace(region, owners)
+        self.index.set_sweep_position(region, None)
+        self.index.mark_synced(region, self.watermark(owners), full=True)
+        self.logger.info('Full inventory sync of %s: %s resources', region, len(owners))
+
+    def sync_incremental(self, region: str, watermark: str | None):
+        clause = "lifeCycleState != 'TERMINATED' && lifeCycleState != 'TERMINATING'"
+        if watermark:
+            clause += f" && timeCreated >= '{watermark}'"
+        owners = self.fetch(region, clause)
+        self.index.upsert(region, owners)
+
+        # Only look for indexed resources, not every terminated one in the
+        # region, and only the next slice of them. Full syncs drop the rest.
+        identifiers = self.index.identifiers(region,
+                                             after=self.index.sweep_position(region),
+                                             limit=self.sweep_size)
+        terminated = self.search.search_identifiers(
+            identifiers, region,
+            "(lifeCycleState = 'TERMINATED' || lifeCycleState = 'TERMINATING')")
+        self.index.remove(region, [item.identifier for item in terminated])
+        # Start again from the beginning once the end of the index is reached
+        self.index.set_sweep_position(region, identifiers[-1] if identifiers and
+                                      len(identifiers) == self.sweep_size else None)
+
+        self.index.mark_synced(region, self.watermark(owners) or watermark, full=False)
+        self.logger.debug('Incremental inventory sync of %s: %s new, %s removed',
+                          region, len(owners), len(terminated))
+
+    # Search a region for tagged resources returning (owner, record) pairs
+    def fetch(self, region: str, clause: str) -> list[tuple[str, ResourceRecord]]:
+        query = (f"query all resources where definedTags.namespace = "
+                 f"'{self.search.tag}' && definedTags.key = '{self.search.key}' "
+                 f"&& {clause}")
+        details = resource_search.models.StructuredSearchDetails(query=query)
+
+        response = list_call_get_all_results(
+            self.search.client[region].search_resources, details, limit=1000)
+
+        owners = []
+        for resource in response.data:
+            try:
+                owner = resource.defined_tags[self.search.tag][self.search.key]
+            except KeyError:
+                owner = None
+            owners.append((owner, to_record(resource)))
+
+        return owners
+
+    # Creation time of the newest resource in a search query friendly format
+    @staticmethod
+    def watermark(owners: list[tuple[str, ResourceRecord]]) -> str | None:
+        created = [item.time_created for _, item in owners if item.time_created]
+        if not created:
+            return None
+
+        return max(created).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -0,0 +1,272 @@
+#!/usr/bin/python3.11
+
+import fcntl
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from time import monotonic, sleep, time, time_ns
+from typing import IO
+
+from oci.response import Response
+
+from ..metrics import cache_lookup
+from .cache import Invalidations
+
+
+class Prefetcher:
+    """Prefetcher fetches the pages following a page just served in the
+       background, so the next infinite scroll request is answered from a short
+       lived buffer rather than waiting on a search. Pages are keyed by a prefix
+       of (user, resource, region, limit, session) and the page token.
+       Given a directory shared by the workers on a host, prefetched pages are
+       also written there, so the next request is answered whichever worker it
+       reaches and a page another worker is fetching is not fetched again.
+
+       Keyword arguments:
+       depth -- number of pages fetched ahead of the page served (default 1)
+       ttl -- seconds a prefetched page stays valid (default 30)
+       maxsize -- maximum number of pages buffered in process (default 256)
+       workers -- threads fetching pages (default 4)
+       path -- directory for lock and page files, None for in process only
+       timeout -- seconds to wait on another worker's fetch (default 10)
+       encode -- converts a page to bytes, required with path
+       decode -- converts bytes back to a page, required with path
+       invalidations -- invalidations shared with other workers (default none)
+    """
+
+    def __init__(self, depth: int=1, ttl: float=30, maxsize: int=256,
+                 workers: int=4, path: str | None=None, timeout: float=10,
+                 encode: Callable[[Response], bytes] | None=None,
+                 decode: Callable[[bytes], Response] | None=None,
+                 invalidations: Invalidations | None=None):
+        self.depth = depth
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = path
+        self.timeout = timeout
+        self.encode = encode
+        self.decode = decode
+        self.invalidations = invalidations
+        self.buffer: OrderedDict[tuple, tuple[float, int, Future]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='prefetch')
+        self.purged = time()
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+        # Usage counters; unused counts pages dropped before they were served
+        self.hits = 0
+        self.misses = 0
+        self.unused = 0
+
+    def __repr__(self) -> str:
+        return (f'Prefetcher - depth: {self.depth} ttl: {self.ttl} '
+                f'maxsize: {self.maxsize} path: {self.path} stats: {self.stats()}')
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def get(self, key: tuple) -> Response | None:
+        '''Take a prefetched page out of the buffer, waiting for it if the
+        fetch is still running. Pages not prefetched by this worker are taken
+        from the shared directory. Returns None if the page was not prefetched,
+        has expired, was invalidated or failed to fetch.
+        '''
+
+        with self.lock:
+            entry = self.buffer.pop(key, None)
+            if entry is not None and (entry[0] < monotonic()
+                                      or self._invalidated(key, entry[1])):
+                self.unused += 1
+                entry = None
+
+        results = None
+        if entry is not None:
+            try:
+                results = entry[2].result()
+            except Exception:
+                pass
+            # Served here, so no other worker takes the shared copy
+            if self.path:
+                try:
+                    os.remove(f'{self.file(key)}.result')
+                except FileNotFoundError:
+                    pass
+        elif self.path:
+            results = self._shared(key)
+
+        with self.lock:
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        cache_lookup('prefetch', results is not None)
+        return results
+
+    def prefetch(self, prefix: tuple, page: str | None,
+                 fetch: Callable[[str], Response], depth: int | None=None):
+        '''Fetch page and up to depth - 1 pages after it in the background.'''
+
+        depth = self.depth if depth is None else depth
+        if not page or depth < 1:
+            return
+
+        key = (*prefix, page)
+        with self.lock:
+            entry = self.buffer.get(key)
+            if entry is None or entry[0] < monotonic():
+                # Leave pages another worker is fetching or has fetched to it
+                lock = self._claim(key) if self.path else None
+                if self.path and lock is None:
+                    return
+
+                started = time_ns()
+                future = self.executor.submit(self._fetch, prefix, page, fetch,
+                                              depth, started, lock)
+                self.buffer[key] = (monotonic() + self.ttl, started, future)
+                self.buffer.move_to_end(key)
+                self._evict()
+                return
+
+        # Already buffered, but possibly fetched with less depth remaining
+        if depth > 1:
+            entry[2].add_done_callback(
+                lambda f: self._chain(prefix, f, fetch, depth - 1))
+
+    def _fetch(self, prefix: tuple, page: str, fetch: Callable[[str], Response],
+               depth: int, started: int, lock: IO | None) -> Response:
+        try:
+            results = fetch(page)
+            if lock is not None:
+                self._write((*prefix, page), results, started)
+        finally:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+
+        self.prefetch(prefix, results.next_page, fetch, depth - 1)
+        return results
+
+    def _chain(self, prefix: tuple, future: Future,
+               fetch: Callable[[str], Response], depth: int):
+        if not future.exception():
+            self.prefetch(prefix, future.result().next_page, fetch, depth)
+
+    # Drop the least recently buffered pages once over maxsize, lock held
+    def _evict(self):
+        while len(self.buffer) > self.maxsize:
+            self.buffer.popitem(last=False)
+            self.unused += 1
+
+    # Remove every buffered page for a user in any of the given regions, in
+    # every worker if invalidations are shared
+    def invalidate(self, user: str, *regions: str):
+        with self.lock:
+            stale = [key for key in self.buffer
+                     if key[0] == user and key[2] in regions]
+            for key in stale:
+                del self.buffer[key]
+
+        if self.invalidations is not None:
+            self.invalidations.add(user, *regions)
+
+    # Whether a page fetched at started was invalidated by any worker since
+    def _invalidated(self, key: tuple, started: int) -> bool:
+        return (self.invalidations is not None
+                and self.invalidations.last(key[0], key[2]) >= started)
+
+    def file(self, key: tuple) -> str:
+        return os.path.join(self.path, sha256(repr(key).encode()).hexdigest())
+
+    # Take the lock file for a page unless another worker is fetching it or a
+    # fetched page is waiting, returning the locked file, lock held
+    def _claim(self, key: tuple) -> IO | None:
+        name = self.file(key)
+        try:
+            if self._fresh(name, key):
+                return None
+        except FileNotFoundError:
+            pass
+
+        lock = open(f'{name}.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock
+        except BlockingIOError:
+            lock.close()
+            return None
+
+    # Whether a page file is within ttl and not invalidated since its fetch
+    def _fresh(self, name: str, key: tuple) -> bool:
+        fetched = os.stat(f'{name}.result').st_mtime_ns
+        return (fetched > time_ns() - self.ttl * 1e9
+                and not self._invalidated(key, fetched))
+
+    # Write a fetched page for other workers, timed from when its fetch started
+    def _write(self, key: tuple, results: Response, started: int):
+        name = self.file(key)
+        with tempfile.NamedTemporaryFile('wb', dir=self.path,
+                                         delete=False) as f:
+            f.write(self.encode(results))
+        os.utime(f.name, ns=(started, started))
+        os.replace(f.name, f'{name}.result')
+        self._purge()
+
+    # Take a page another worker prefetched, waiting for a fetch in progress
+    def _shared(self, key: tuple) -> Response | None:
+        name = self.file(key)
+        try:
+            lock = open(f'{name}.lock', 'rb')
+        except FileNotFoundError:
+            return None
+
+        with lock:
+            deadline = monotonic() + self.timeout
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if monotonic() > deadline:
+                        return None
+                    sleep(0.01)
+
+            try:
+                if not self._fresh(name, key):
+                    return None
+                with open(f'{name}.result', 'rb') as f:
+                    results = self.decode(f.read())
+                # Each page is served once, as from the local buffer
+                os.remove(f'{name}.result')
+                return results
+            except (FileNotFoundError, ValueError):
+                return None
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Remove lock and page files of pages no longer valid
+    def _purge(self):
+        now = time()
+        retention = self.ttl + self.timeout
+        if now - self.purged < retention:
+            return
+        self.purged = now
+
+        for entry in os.scandir(self.path):
+            try:
+                if entry.stat().st_mtime < now - retention:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'unused': self.unused,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0}
@@ -2,6 +2,8 @@
 
 import logging
 
+from ..log import get_logger
+
 
 class Query:
     """Query is meant to be a superclass to create queries. Instead of
@@ -20,23 +22,15 @@ class Query:
 
     def __init__(self, log_level=logging.INFO):
         # Logging
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(log_level)
-
-        handler = logging.StreamHandler()
-        handler.setLevel(log_level)
-        handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        
-        self.logger.addHandler(handler)
-        self.logger.debug(f'Initialized {__class__}')
+        self.logger = get_logger(__name__, log_level)
+        self.logger.debug('Initialized %s', __class__)
 
     def query(self) -> str :
         return "query all resources"
     
     def query_by_id(self, ocid: str) -> str:
         query = f"query all resources where identifier = '{ocid}'"
-        self.logger.debug(f'{__name__} called returning query {query}')
+        self.logger.debug('%s called returning query %s', __name__, query)
 
         return query
     
@@ -47,22 +41,27 @@ class QueryTags(Query):
         self.tag = tag
         self.key = key
 
-        self.logger.debug(f'Key: {key}\n\tTag: {tag}')
+        self.logger.debug('Key: %s\n\tTag: %s', key, tag)
 
     def query(self, **kwargs):
         """Keword arguments:
             user: str = (Required) Username for search
             resource: str = Resource type to search for
+            clauses: list[str] = Further conditions all results must meet
         """
         user = kwargs.get('user')
         if not user:
-            raise QueryError
+            raise QueryError('user is required')
         
         query =  (f"query {kwargs.get('resource', 'all')} resources where "
             f"definedTags.namespace = '{self.tag}' && definedTags.key = "
             f"'{self.key}' && definedTags.value = '{user}' && lifeCycleState "
             "!= 'TERMINATED' && lifeCycleState != 'TERMINATING'")
-        self.logger.debug(f'{__name__} query: {query}')
+        for clause in kwargs.get('clauses', []):
+            query += f' && {clause}'
+        # Can't 'return allAdditionalFields' with 'all' resource type
+        query += ' sorted by timeCreated desc'
+        self.logger.debug('%s query: %s', __name__, query)
 
         return query
     
@@ -73,7 +72,7 @@ class QueryCompartments(Query):
         self.tag = tag
         self.key = key
 
-        self.logger.debug(f'Key: {key}\n\tTag: {tag}')
+        self.logger.debug('Key: %s\n\tTag: %s', key, tag)
 
     def query(self, **kwargs):
         """Keywork Arguments:
@@ -83,23 +82,29 @@ class QueryCompartments(Query):
 
         compartments = kwargs.get('compartments')
         if not compartments:
-            raise QueryError
+            raise QueryError('compartments are required')
         
-        query = (f"query {kwargs.get('resource', 'all')} resources where ")
+        query = (f"query {kwargs.get('resource', 'all')} resources where (")
 
         # Loop through compartments injecting OR as needed
-        first = True
-        for compartment in compartments:
-            if first:
-                query += f"compartmentId = '{compartment}' "
-                first = False
-            else:
-                query += f" || compartmentId = '{compartment}' "
+        query += ' || '.join(f"compartmentId = '{compartment}'"
+                             for compartment in compartments)
+        query += (") && lifeCycleState != 'TERMINATED' && "
+                  "lifeCycleState != 'TERMINATING'")
 
-        self.logger.debug(f'{__name__} Query {query}')
+        self.logger.debug('%s Query %s', __name__, query)
 
         return query
 
+    def queries(self, compartments: list[str], size: int, **kwargs) -> list[str]:
+        """Split compartments into chunks of at most size compartments so each
+            query stays within search query length limits, returning one query
+            per chunk. Takes the keyword arguments of query.
+        """
+
+        return [self.query(compartments=compartments[i:i + size], **kwargs)
+                for i in range(0, len(compartments), size)]
+
 
 class QueryError(Exception):
     def __init__(self, error):
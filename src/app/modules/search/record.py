@@ -0,0 +1,79 @@
+#!/usr/bin/python3.11
+
+import datetime
+
+import msgspec
+
+from oci.response import Response
+
+
+class ResourceRecord(msgspec.Struct):
+    """ResourceRecord holds only the fields of a search result the dashboard
+       reads. Records are much smaller than SDK models or their to_dict
+       conversion, so they are what caches, the index and pages hold.
+    """
+
+    identifier: str
+    display_name: str | None = None
+    resource_type: str | None = None
+    compartment_id: str | None = None
+    lifecycle_state: str | None = None
+    time_created: datetime.datetime | None = None
+    defined_tags: dict[str, dict[str, str]] = {}
+    region: str | None = None
+
+
+class RecordPage(msgspec.Struct):
+    """RecordPage is the data of a search Response holding records, keeping the
+       items attribute of the SDK collection so filters work on either. fetched
+       is the time the owner tags of the records were read from OCI, which
+       caches and the index can make much older than the page, 0 if unknown.
+    """
+
+    items: list[ResourceRecord]
+    fetched: float = 0
+
+
+# Project an SDK resource summary onto a record, reading only the fields kept
+def to_record(item, region: str | None=None) -> ResourceRecord:
+    return ResourceRecord(identifier=item.identifier,
+                          display_name=item.display_name,
+                          resource_type=item.resource_type,
+                          compartment_id=item.compartment_id,
+                          lifecycle_state=item.lifecycle_state,
+                          time_created=item.time_created,
+                          defined_tags=item.defined_tags or {},
+                          region=region)
+
+
+def project(items: list, region: str | None=None) -> list[ResourceRecord]:
+    return [to_record(item, region) for item in items]
+
+
+class PageResult(msgspec.Struct):
+    """PageResult is a search Response holding records in a form that can be
+       shared between workers.
+    """
+
+    status: int
+    headers: dict[str, str]
+    data: RecordPage
+
+
+page_encoder = msgspec.msgpack.Encoder()
+page_decoder = msgspec.msgpack.Decoder(PageResult)
+
+
+def encode_response(response: Response) -> bytes:
+    return page_encoder.encode(PageResult(status=response.status,
+                                          headers=dict(response.headers),
+                                          data=response.data))
+
+
+def decode_response(data: bytes) -> Response:
+    try:
+        result = page_decoder.decode(data)
+    except msgspec.DecodeError as e:
+        raise ValueError(e)
+
+    return Response(result.status, result.headers, result.data, None)
@@ -1,8 +1,18 @@
 #!/usr/bin/python3.11
 
+import base64
+import contextvars
+import heapq
+import json
 import logging
 import logging.handlers
+import os
 
+import msgspec
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import time, time_ns
 from oci import resource_search
 
 from oci.identity import IdentityClient
@@ -12,38 +22,77 @@ from oci.response import Response
 from oci.util import to_dict
 from oci.pagination import list_call_get_all_results
 
+from .cache import SearchCache
 from .filter import AbstractFilter
-from ..utils import log_factory
+from .index import InventoryIndex
+from .flight import SingleFlight
+from .prefetch import Prefetcher
+from .query import QueryTags
+from .record import RecordPage, ResourceRecord, project
+from ..ratelimit import RateLimiter, create_client
+from ..log import get_logger
+from ..tracing import span
+
+# Sort key fallback for resources without a creation time
+EPOCH = datetime.min.replace(tzinfo=timezone.utc)
 
 class Search:
 
     # Resource type to default to in search
     resource_default = 'all'
+    # Region name used to search every subscribed region at once
+    all_regions = 'all'
+    # Identifiers per search when validating many resources at once
+    identifier_batch = 50
+    # Further pages searched to fill a page short after filtering
+    refill_limit = 4
+    # Pages of the inventory index are offsets marked apart from OCI page tokens
+    # and cursors, so a page from before a region was served from the index, or
+    # after, starts the listing again rather than failing
+    index_page = 'index-'
 
     def __init__(self, tag: str, key: str, config: dict, signer: Signer=None,
-                 handler: logging.Handler=logging.StreamHandler(),
-                 log_level: int | str=30):
+                 log_level: int | str=30, workers: int=8,
+                 metadata: dict | None=None, limiter: RateLimiter | None=None):
         # Logging
-        self.logger = log_factory(__name__, log_level, handler)
+        self.logger = get_logger(__name__, log_level)
 
         # Instance Variables
         #self.client: resource_search.ResourceSearchClient = (
         #    resource_search.ResourceSearchClient(config, signer=signer))
-        self.client: dict[str, resource_search.ResourceSearchClient] = {}
+        self.client: SearchClients | None = None
         self.tag: str = tag
         self.key:str = key
-        self.filter: str = AbstractFilter()
-
-        # Regions set first
+        self.filter: AbstractFilter = AbstractFilter()
+        self.query = QueryTags(tag, key, log_level=log_level)
+        self.cache: SearchCache | None = None
+        self.index: InventoryIndex | None = None
+        self.prefetcher: Prefetcher | None = None
+        # Identical searches in flight at once are only sent once
+        self.flight = SingleFlight()
+
+        # Kept to refresh regions and resource types later
+        self.config = config
+        self.signer = signer
+        self.limiter = limiter
+
+        # Regions set first, from startup metadata if provided
         self.home_region: str = '' # ex. us-ashburn-1
         self.region_names: list[str] = []
         self.region_keys: list[str] = []
-        self.set_regions(config, signer=signer)
-
+        self.resource_list: list[str] = []
         self.set_clients(config, signer=signer)
-        self.resource_list: list[str] = self.get_resource_types()
+        if metadata:
+            self.set_metadata(metadata)
+        else:
+            self.set_regions(config, signer=signer)
+            self.resource_list[:] = self.get_resource_types()
 
-        self.logger.debug(f'Created Search: {self}')
+        # Bounded pool used to fan out searches across regions
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='search')
+
+        self.logger.debug('Created Search: %s', self)
 
     def __repr__(self):
         sep = '\n\t'
@@ -61,34 +110,285 @@ class Search:
         '''
 
     def set_filter(self, filter: AbstractFilter):
+        # Indexed and cached results are records, which only hold some fields
+        missing = set(filter.fields) - set(ResourceRecord.__struct_fields__)
+        if missing:
+            raise ValueError(f'{filter} reads fields missing from records: {missing}')
         self.filter = filter
 
+    def set_cache(self, cache: SearchCache):
+        self.cache = cache
+
+    def set_index(self, index: InventoryIndex):
+        self.index = index
+
+    def set_prefetcher(self, prefetcher: Prefetcher):
+        self.prefetcher = prefetcher
+
+    def set_flight(self, flight: SingleFlight):
+        self.flight = flight
+
+    # Seconds since the inventory index was refreshed, None if not in use
+    def staleness(self) -> float | None:
+        if self.index:
+            return self.index.staleness(self.region_names)
+
+    # Drop cached and indexed results after a user's resource is deleted
+    def invalidate(self, user: str, region: str, identifier: str | None=None):
+        if self.cache is not None:
+            self.cache.invalidate(user, region, self.all_regions)
+        if self.prefetcher is not None:
+            self.prefetcher.invalidate(user, region, self.all_regions)
+        if self.index and identifier:
+            self.index.remove(region, [identifier])
+
     def get_user_resources(self, user: str, page: str=None, limit: int=25,
                            resource=resource_default, **kwargs) -> Response:
         '''Get resources created by user. Support pagination via page, limits on
-        number of resources to return, and filtering on resource type.
+        number of resources to return, and filtering on resource type. The data
+        of the response is a RecordPage of ResourceRecords.
 
         Keyword arguments:
-        region -- region name for client selection (default home region)
+        region -- region name for client selection (default home region), or
+                  Search.all_regions to search every subscribed region
+        session -- session id to prefetch the following pages for, if a
+                   prefetcher is set
         '''
 
-        # Can't 'return allAdditionalFields' with 'all' resource type
-        query =  (f"query {resource} resources where definedTags.namespace = "
-                  f"'{self.tag}' && definedTags.key = '{self.key}' && "
-                  f"definedTags.value = '{user}' && lifeCycleState != 'TERMINATED' &&"
-                   " lifeCycleState != 'TERMINATING'")
-        self.logger.debug(f'get_user_resources query: {query}')
+        region = kwargs.get('region', self.home_region)
 
-        details = resource_search.models.StructuredSearchDetails(query=query)
+        session = kwargs.get('session')
+        if self.prefetcher is not None and session:
+            prefix = (user, resource, region, limit, session)
+            results = self.prefetcher.get((*prefix, page)) if page else None
+            if results is None:
+                results = self.get_user_resources(user, page=page, limit=limit,
+                                                  resource=resource, region=region)
+            else:
+                self.logger.debug('Prefetch hit for %s page %s: %s', prefix, page,
+                                  self.prefetcher.stats())
+
+            self.prefetcher.prefetch(prefix, results.next_page,
+                lambda next_page: self.get_user_resources(
+                    user, page=next_page, limit=limit, resource=resource,
+                    region=region))
+            return results
+
+        key = (user, resource, region, page, limit)
+        if self.cache is not None:
+            results = self.cache.get(key)
+            if results is not None:
+                self.logger.debug('Cache hit for %s', key)
+                return results
+
+        # A delete invalidating results while they are fetched also drops them
+        fetched = time_ns()
+
+        if self.indexed(region):
+            results = self.get_indexed_resources(user, page=page, limit=limit,
+                                                 resource=resource, region=region)
+        else:
+            if page and page.startswith(self.index_page):
+                self.logger.info('Index page %s listed live, starting from the '
+                                 'first page', page)
+                page = None
+
+            if region == self.all_regions:
+                results = self.get_all_region_resources(user, page=page, limit=limit,
+                                                        resource=resource)
+            else:
+                query = self.user_query(user, resource)
+                self.logger.debug('get_user_resources query: %s', query)
+                results = self._search_region(region, query, page, limit)
 
-        results = self.client[kwargs.get('region', self.home_region)].search_resources(
-            details, page=page, limit=limit)
-        if results.status != 200:
-            self.logger.error(f'Non-200 Search result: {results}')
-            raise SearchError(f'Search response {results.status}')
-        
-        # Call filter before returning results
-        return self.filter.results(results)
+        if self.cache is not None:
+            self.cache.set(key, results, fetched)
+
+        return results
+
+    def get_all_region_resources(self, user: str, page: str=None, limit: int=25,
+                                 resource=resource_default) -> Response:
+        '''Get resources created by user in every subscribed region. Regions are
+        searched concurrently and merged newest first by time created. The page
+        is a composite cursor holding the position in each region, as returned
+        by the next_page of the previous response.
+        '''
+
+        query = self.user_query(user, resource)
+        self.logger.debug('get_all_region_resources query: %s', query)
+
+        cursor = self.decode_cursor(page) if page else {
+            region: [None, 0] for region in self.region_names}
+
+        # Search every region still holding results at the same time, in a copy
+        # of the request's context so searches are traced
+        futures = {region: self.executor.submit(contextvars.copy_context().run,
+                                                self._search_region, region,
+                                                query, token, limit)
+                   for region, (token, _) in cursor.items()}
+        responses = {region: future.result() for region, future in futures.items()}
+
+        # Skip results already handed out from a partially consumed page
+        streams = [[(region, item) for item in
+                    responses[region].data.items[cursor[region][1]:]]
+                   for region in responses]
+        merged = list(heapq.merge(*streams, reverse=True,
+                                  key=lambda r: r[1].time_created or EPOCH))[:limit]
+
+        # Advance each region past the items it contributed
+        consumed = {region: 0 for region in responses}
+        for region, _ in merged:
+            consumed[region] += 1
+
+        next_cursor = {}
+        for region, (token, offset) in cursor.items():
+            offset += consumed[region]
+            if offset < len(responses[region].data.items):
+                next_cursor[region] = [token, offset]
+            elif responses[region].next_page:
+                next_cursor[region] = [responses[region].next_page, 0]
+
+        headers = {}
+        if next_cursor:
+            headers['opc-next-page'] = self.encode_cursor(next_cursor)
+
+        return Response(200, headers, RecordPage(
+            items=[msgspec.structs.replace(item, region=region)
+                   for region, item in merged],
+            fetched=min((response.data.fetched for response in responses.values()),
+                        default=0)
+        ), None)
+
+    def get_indexed_resources(self, user: str, page: str=None, limit: int=25,
+                              resource=resource_default, **kwargs) -> Response:
+        '''Get resources created by user from the local inventory index. The
+        page is the offset into the user's resources after Search.index_page,
+        other pages start from the first.
+
+        Keyword arguments:
+        region -- region name or Search.all_regions (default home region)
+        '''
+
+        region = kwargs.get('region', self.home_region)
+        offset = 0
+        if page:
+            position = page.removeprefix(self.index_page)
+            if page.startswith(self.index_page) and position.isdigit():
+                offset = int(position)
+            else:
+                self.logger.info('Page %s is not an index page, starting from '
+                                 'the first page', page)
+
+        # Filters run after reading, keep reading until the page is full
+        items = []
+        for _ in range(self.refill_limit + 1):
+            with span('index'):
+                results = self.index.page(
+                    user,
+                    region=None if region == self.all_regions else region,
+                    resource=resource,
+                    offset=offset,
+                    limit=limit)
+            with span('filter'):
+                results = self.filter.results(results)
+            items += results.data.items
+            if len(items) >= limit or not results.next_page:
+                break
+            offset = int(results.next_page)
+
+        if results.next_page:
+            results.next_page = self.index_page + results.next_page
+            results.headers['opc-next-page'] = results.next_page
+
+        # Owner tags only change in the index on a full sync
+        regions = self.region_names if region == self.all_regions else [region]
+        results.data.items = items
+        results.data.fetched = min(self.index.sync_state(r)[1] for r in regions)
+        return results
+
+    # Index is only used once every region it would answer for has synced
+    def indexed(self, region: str) -> bool:
+        if not self.index:
+            return False
+
+        regions = self.region_names if region == self.all_regions else [region]
+        return all(self.index.sync_state(r) for r in regions)
+
+    # Build the query for resources tagged with the username, pushing down the
+    # clauses of filters the search service can apply itself
+    def user_query(self, user: str, resource: str=resource_default) -> str:
+        clause = self.filter.clause()
+        return self.query.query(user=user, resource=resource,
+                                clauses=[clause] if clause else [])
+
+    def _search_region(self, region: str, query: str, page: str | None,
+                       limit: int) -> Response:
+        '''Run a search against one region and apply the filter. If the filter
+        could not be pushed into the query and removed items, following pages are
+        searched until the page is full, up to the refill limit. The response
+        holds records of every item kept and the next page after the last page
+        searched. Identical searches already in flight share one result.
+        '''
+
+        key = (' '.join(query.split()), region, page, limit)
+        return self.flight.do(key, lambda: self._search_pages(region, query, page,
+                                                              limit))
+
+    def _search_pages(self, region: str, query: str, page: str | None,
+                      limit: int) -> Response:
+        details = resource_search.models.StructuredSearchDetails(query=query)
+        fetched = time()
+
+        items = []
+        for _ in range(self.refill_limit + 1):
+            with span('oci_search', region=region):
+                results = self.client[region].search_resources(details, page=page,
+                                                               limit=limit)
+            if results.status != 200:
+                self.logger.error('Non-200 Search result in %s: %s', region, results)
+                raise SearchError(f'Search response {results.status}')
+
+            # Call filter before returning results
+            with span('filter'):
+                items += self.filter.results(results).data.items
+            page = results.next_page
+            if self.filter.exact or len(items) >= limit or not page:
+                break
+
+        headers = {}
+        if page:
+            headers['opc-next-page'] = page
+
+        with span('project'):
+            records = project(items)
+
+        return Response(200, headers, RecordPage(items=records, fetched=fetched),
+                        None)
+
+    # Composite cursors map region names to [page token, offset into page]
+    @staticmethod
+    def encode_cursor(cursor: dict[str, list]) -> str:
+        raw = json.dumps(cursor, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, page: str) -> dict[str, list]:
+        try:
+            raw = base64.urlsafe_b64decode(page + '=' * (-len(page) % 4))
+            cursor = json.loads(raw)
+        except ValueError as e:
+            raise SearchError(f'Invalid page cursor: {e}')
+
+        # Only allow known regions through to client selection, and at least
+        # one, as a finished listing has no cursor
+        if (not isinstance(cursor, dict) or not cursor
+                or not set(cursor) <= set(self.region_names)):
+            raise SearchError(f'Invalid page cursor regions: {cursor}')
+        for position in cursor.values():
+            if (not isinstance(position, list) or len(position) != 2
+                    or not isinstance(position[1], int)):
+                raise SearchError(f'Invalid page cursor position: {position}')
+
+        return cursor
     
     def get_resource_by_id(self, ocid: str, **kwargs) -> dict:
         '''Return a single resource that is looked up by unique OCID.
@@ -97,68 +397,119 @@ class Search:
         region -- region name for client selection (default home region)
         '''
 
-        self.logger.debug(f'Searching for resource {ocid}')
+        self.logger.debug('Searching for resource %s', ocid)
 
         query = f"query all resources where identifier = '{ocid}'"
         details = resource_search.models.StructuredSearchDetails(query=query)
         result = self.client[kwargs.get('region', self.home_region)].search_resources(
             details)
         if result.status != 200:
-            self.logger.error(f'Search status code {result.status}')
+            self.logger.error('Search status code %s', result.status)
 
         result = to_dict(result.data)
 
         # Validate number of results
         if len(result) > 1:
-            self.logger.error(f'Get_resource_by_id returned more than 1 result: {result}')
+            self.logger.error('Get_resource_by_id returned more than 1 result: %s',
+                              result)
 
         return result[0]
     
     def validate_resource(self, username: str, ocid: str, **kwargs) -> bool:
         '''Validate that a resource belongs to user. Looks up user by username and
-        resource by OCID.
+        resource by OCID. Ownership is always searched live, as tag changes
+        only reach the inventory index on a full sync.
 
         Keyword arguments:
         region -- region name for client selection (default home region)
         '''
                 
-        self.logger.debug(f'Checking if {username} owns {ocid}')
+        self.logger.debug('Checking if %s owns %s', username, ocid)
 
+        region = kwargs.get('region', self.home_region)
         query = f"query all resources where identifier = '{ocid}'"
         details = resource_search.models.StructuredSearchDetails(query=query)
-        result = self.client[kwargs.get('region', self.home_region)].search_resources(
-            details)
+        result = self.client[region].search_resources(details)
         if result.status != 200:
-            self.logger.error(f'Search status code {result.status}')
+            self.logger.error('Search status code %s', result.status)
 
         result = to_dict(result.data)['items']
         # Result should only have 1 or 0 items
         if len(result) > 1:
-            self.logger.error(f'Get_resource_by_id returned more than 1 result: {result}')
+            self.logger.error('Get_resource_by_id returned more than 1 result: %s',
+                              result)
         try:
             owner = result[0]['defined_tags'][self.tag][self.key]
         except KeyError as e:
-            self.logger.error(f'{e}\n{result}')
+            self.logger.error('%s\n%s', e, result)
             return False
 
-        self.logger.debug(f'Owner of {ocid} is {owner}')
+        self.logger.debug('Owner of %s is %s', ocid, owner)
 
         return username == owner
     
+    def validate_resources(self, username: str, ocids: list[str], **kwargs) -> set[str]:
+        '''Validate many resources in one region at once, returning the OCIDs
+        that belong to user. Resources are looked up live with one search per
+        batch of identifiers.
+
+        Keyword arguments:
+        region -- region name for client selection (default home region)
+        '''
+
+        region = kwargs.get('region', self.home_region)
+        owned = set()
+
+        for item in self.search_identifiers(ocids, region):
+            try:
+                if item.defined_tags[self.tag][self.key] == username:
+                    owned.add(item.identifier)
+            except KeyError:
+                pass
+
+        self.logger.debug('%s owns %s of %s resources',
+                          username, len(owned), len(ocids))
+
+        return owned
+
+    # Return the lifecycle state of each resource found in a region
+    def lifecycle_states(self, ocids: list[str], region: str) -> dict[str, str]:
+        return {item.identifier: item.lifecycle_state
+                for item in self.search_identifiers(ocids, region)}
+
+    # Look up many resources with one search per batch of identifiers, only
+    # those also matching clause if given
+    def search_identifiers(self, ocids: list[str], region: str,
+                           clause: str | None=None) -> list:
+        items = []
+        for i in range(0, len(ocids), self.identifier_batch):
+            batch = ocids[i:i + self.identifier_batch]
+            query = 'query all resources where (' + ' || '.join(
+                f"identifier = '{ocid}'" for ocid in batch) + ')'
+            if clause:
+                query += f' && {clause}'
+            details = resource_search.models.StructuredSearchDetails(query=query)
+            result = list_call_get_all_results(self.client[region].search_resources,
+                                               details)
+            if result.status != 200:
+                self.logger.error('Search status code %s', result.status)
+
+            items += result.data
+
+        return items
+    
     # Return a list of searchable resource types as a list
     def get_resource_types(self, **kwargs) -> list[str]:
         response = list_call_get_all_results(
             self.client[self.home_region].list_resource_types)
 
         if response.status != 200:
-            self.logger.critical(
-                f'Unable to pull resource list for search: {response.status}')
+            self.logger.critical('Unable to pull resource list for search: %s',
+                                 response.status)
             raise SystemExit
         
         resource_list = [data.name for data in response.data]
-        self.logger.info(
-            f'Number resources returned: {len(resource_list)}\n'
-        )
+        self.logger.info('Number resources returned: %s\n', len(resource_list))
         
         return resource_list
         
@@ -170,34 +521,81 @@ class Search:
         response = client.list_region_subscriptions(config['tenancy'])
 
         if response.status != 200:
-            self.logger.critical(
-                f'Unable to get subscribed regions: {response.status}')
+            self.logger.critical('Unable to get subscribed regions: %s',
+                                 response.status)
             raise SystemExit
         
         # Filter out any regions that are not ready
+        region_keys = []
+        region_names = []
         for region in response.data:
             if region.status == RegionSubscription.STATUS_READY:
-                self.region_keys.append(region.region_key)
-                self.region_names.append(region.region_name)
+                region_keys.append(region.region_key)
+                region_names.append(region.region_name)
                 if region.is_home_region:
                     self.home_region = region.region_name
 
-        # Put in alphabetical order
-        self.region_keys = sorted(self.region_keys)
-        self.region_names = sorted(self.region_names)
-
-    # Creates clients for each subscribed region, depends on regions
+        # Put in alphabetical order, updating in place as other components hold
+        # references to the region lists
+        self.region_keys[:] = sorted(region_keys)
+        self.region_names[:] = sorted(region_names)
+
+    # Return regions and resource types for the startup snapshot
+    def metadata(self) -> dict:
+        return {
+            'home_region': self.home_region,
+            'region_names': self.region_names,
+            'region_keys': self.region_keys,
+            'resource_list': self.resource_list
+        }
+
+    def set_metadata(self, metadata: dict):
+        self.home_region = metadata['home_region']
+        self.region_names[:] = metadata['region_names']
+        self.region_keys[:] = metadata['region_keys']
+        self.resource_list[:] = metadata['resource_list']
+
+    # Fetch regions and resource types again, returning the new metadata
+    def refresh_metadata(self) -> dict:
+        self.set_regions(self.config, signer=self.signer)
+        self.resource_list[:] = self.get_resource_types()
+
+        return self.metadata()
+
+    # Clients for each subscribed region are created on first use, depends on
+    # regions
     def set_clients(self, config: dict, signer=None, **kwargs):
-        for region in self.region_names:
-            config['region'] = region
-            if signer:
-                signer.region = region
-                self.client[region] = resource_search.ResourceSearchClient(
-                    config, signer=signer)
-            else:
-                self.client[region] = resource_search.ResourceSearchClient(config)
+        self.client = SearchClients(config, self.region_names, signer=signer,
+                                    limiter=self.limiter)
     
 
+class SearchClients(dict):
+    """SearchClients maps region names to ResourceSearchClients, creating each
+       client the first time its region is used. Clients are dropped in forked
+       child processes so connection pools are never shared with the parent.
+    """
+
+    def __init__(self, config: dict, regions: list[str], signer: Signer=None,
+                 limiter: RateLimiter | None=None):
+        super().__init__()
+        self.config = config
+        self.regions = regions
+        self.signer = signer
+        self.limiter = limiter
+        os.register_at_fork(after_in_child=self.clear)
+
+    def __missing__(self, region: str) -> resource_search.ResourceSearchClient:
+        if region not in self.regions:
+            raise KeyError(region)
+
+        client = create_client(resource_search.ResourceSearchClient, self.config,
+                               region, signer=self.signer, limiter=self.limiter,
+                               service='search')
+
+        # Another thread may have created the client first
+        return self.setdefault(region, client)
+
+
 class SearchError(Exception):
     def __init__(self, error):
         self.error = error
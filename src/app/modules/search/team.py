@@ -0,0 +1,78 @@
+#!/usr/bin/python3.11
+
+import logging
+
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from oci import resource_search
+from oci.pagination import list_call_get_all_results
+
+from .query import QueryCompartments
+from .record import ResourceRecord, to_record
+from ..log import get_logger
+
+
+class TeamSearch:
+    """TeamSearch lists every resource in a set of compartments across all
+       subscribed regions. Compartments are split into chunks to keep queries
+       within search length limits, and every chunk is searched in every region
+       at once on a bounded pool.
+
+       Keyword arguments:
+       chunk_size -- compartments per query (default 50)
+       workers -- searches run at once (default 8)
+    """
+
+    def __init__(self, search, compartments: list[str], chunk_size: int=50,
+                 workers: int=8,
+                 log_level: int | str=logging.INFO):
+        # Logging
+        self.logger = get_logger(__name__, log_level)
+
+        self.search = search
+        self.compartments = compartments
+        self.chunk_size = chunk_size
+        self.query = QueryCompartments(search.tag, search.key, log_level=log_level)
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='team')
+
+    def __repr__(self) -> str:
+        return (f'TeamSearch - compartments: {len(self.compartments)} '
+                f'chunk_size: {self.chunk_size} '
+                f'workers: {self.executor._max_workers}')
+
+    def resources(self, resource: str='all') -> Iterator[ResourceRecord]:
+        '''Yield records for every resource in the compartments as each chunk
+        and region search completes, skipping resources already yielded.
+        '''
+
+        queries = self.query.queries(self.compartments, self.chunk_size,
+                                     resource=resource)
+        futures = {self.executor.submit(self._search, region, query): region
+                   for region in self.search.region_names for query in queries}
+        self.logger.debug('Searching %s compartment chunks in %s regions',
+                          len(queries), len(self.search.region_names))
+
+        seen = set()
+        try:
+            for future in as_completed(futures):
+                region = futures[future]
+                try:
+                    items = future.result()
+                except Exception as e:
+                    self.logger.error('Team search failed in %s: %s', region, e)
+                    continue
+
+                for item in items:
+                    if item.identifier not in seen:
+                        seen.add(item.identifier)
+                        yield to_record(item, region)
+        finally:
+            # The page was closed before every search finished
+            for future in futures:
+                future.cancel()
+
+    def _search(self, region: str, query: str) -> list:
+        details = resource_search.models.StructuredSearchDetails(query=query)
+        return list_call_get_all_results(
+            self.search.client[region].search_resources, details, limit=1000).data
@@ -0,0 +1,6 @@
+#!/usr/bin/python3.11
+
+from .serializer import MsgpackSerializer
+from .sqlite import SqliteCache
+from .resp import RespCache, RespError
+from .factory import create_session_cache
@@ -0,0 +1,24 @@
+#!/usr/bin/python3.11
+
+from cachelib import BaseCache, FileSystemCache
+
+from .resp import RespCache
+from .sqlite import SqliteCache
+
+
+# Create the session store selected by the configured session backend
+def create_session_cache(backend: str, timeout: int, **kwargs) -> BaseCache:
+    '''Keyword arguments:
+    path -- directory for filesystem sessions or file for sqlite sessions
+    url -- server url for redis sessions
+    '''
+
+    if backend.lower() == 'sqlite':
+        return SqliteCache(kwargs.get('path') or 'session/session.db',
+                           default_timeout=timeout)
+    elif backend.lower() == 'redis':
+        return RespCache(kwargs.get('url') or 'redis://localhost:6379/0',
+                         default_timeout=timeout)
+
+    # FileSystemCache saves sessions to ./session
+    return FileSystemCache(kwargs.get('path') or 'session', default_timeout=timeout)
@@ -0,0 +1,160 @@
+#!/usr/bin/python3.11
+
+import os
+import socket
+import threading
+
+from cachelib import BaseCache
+from urllib.parse import urlparse
+
+from .serializer import MsgpackSerializer
+
+
+class RespCache(BaseCache):
+    """RespCache is a cachelib cache on any server speaking the Redis protocol
+       (RESP), so sessions can be shared between pods without sticky sessions.
+       It implements only the commands sessions need, which also makes it easy
+       to run against a local stand-in server.
+
+       Keyword arguments:
+       url -- server location as redis://[:password@]host[:port][/db]
+       default_timeout -- seconds before entries expire (default 300)
+       key_prefix -- prefix for every key stored (default 'session:')
+       socket_timeout -- seconds to wait on the server (default 5)
+    """
+
+    def __init__(self, url: str='redis://localhost:6379/0', default_timeout: int=300,
+                 key_prefix: str='session:', socket_timeout: float=5):
+        super().__init__(default_timeout=default_timeout)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.key_prefix = key_prefix
+        self.socket_timeout = socket_timeout
+        self.serializer = MsgpackSerializer()
+        self.local = threading.local()
+        # Connections must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._reset)
+
+    def __repr__(self) -> str:
+        return f'RespCache - server: {self.host}:{self.port}/{self.db}'
+
+    def _reset(self):
+        self.local = threading.local()
+
+    # One connection per thread so replies are never interleaved
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port),
+                                            timeout=self.socket_timeout)
+            conn = (sock, sock.makefile('rb'))
+            self.local.conn = conn
+            if self.password:
+                self._call(conn, 'AUTH', self.password)
+            if self.db:
+                self._call(conn, 'SELECT', self.db)
+
+        return conn
+
+    def execute(self, *args):
+        try:
+            return self._call(self.connection(), *args)
+        except OSError:
+            # Reconnect once if the server closed an idle connection
+            self.close()
+            return self._call(self.connection(), *args)
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        self.local.conn = None
+        if conn:
+            conn[1].close()
+            conn[0].close()
+
+    def _call(self, conn, *args):
+        sock, reader = conn
+        sock.sendall(self._encode(args))
+        return self._read(reader)
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+
+        return b''.join(parts)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+
+        kind, data = line[:1], line[1:-2]
+        if kind == b'+':
+            return data.decode()
+        if kind == b'-':
+            raise RespError(data.decode())
+        if kind == b':':
+            return int(data)
+        if kind == b'$':
+            length = int(data)
+            if length < 0:
+                return None
+            value = reader.read(length + 2)
+            return value[:-2]
+        if kind == b'*':
+            length = int(data)
+            if length < 0:
+                return None
+            return [self._read(reader) for _ in range(length)]
+
+        raise RespError(f'Unknown reply type {kind}')
+
+    def get(self, key: str):
+        return self.serializer.loads(self.execute('GET', self.key_prefix + key))
+
+    def set(self, key: str, value, timeout: int | None=None) -> bool:
+        args = ['SET', self.key_prefix + key, self.serializer.dumps(value)]
+        timeout = self._normalize_timeout(timeout)
+        if timeout:
+            args += ['EX', timeout]
+
+        return self.execute(*args) == 'OK'
+
+    def add(self, key: str, value, timeout: int | None=None) -> bool:
+        args = ['SET', self.key_prefix + key, self.serializer.dumps(value), 'NX']
+        timeout = self._normalize_timeout(timeout)
+        if timeout:
+            args += ['EX', timeout]
+
+        return self.execute(*args) == 'OK'
+
+    def delete(self, key: str) -> bool:
+        return self.execute('DEL', self.key_prefix + key) == 1
+
+    def has(self, key: str) -> bool:
+        return self.execute('EXISTS', self.key_prefix + key) == 1
+
+    # Only remove keys under this cache's prefix
+    def clear(self) -> bool:
+        cursor = b'0'
+        while True:
+            cursor, keys = self.execute('SCAN', cursor, 'MATCH',
+                                        f'{self.key_prefix}*', 'COUNT', 1000)
+            if keys:
+                self.execute('DEL', *keys)
+            if cursor == b'0':
+                return True
+
+
+class RespError(Exception):
+    def __init__(self, error):
+        self.error = error
+
+    def __str__(self):
+        return(repr(self.error))
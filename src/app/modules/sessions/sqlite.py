@@ -0,0 +1,121 @@
+#!/usr/bin/python3.11
+
+import os
+import sqlite3
+import threading
+
+from cachelib import BaseCache
+from time import time
+
+from .serializer import MsgpackSerializer
+
+
+class SqliteCache(BaseCache):
+    """SqliteCache is a cachelib cache stored in a single SQLite database in WAL
+       mode so every worker on a host shares sessions. Expiry is indexed, so
+       cleanup only touches rows that have expired instead of scanning the whole
+       store.
+
+       Keyword arguments:
+       path -- SQLite database file
+       default_timeout -- seconds before entries expire (default 300)
+       cleanup_interval -- seconds between removing expired entries (default 60)
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            expires REAL NOT NULL,
+            value BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+    '''
+
+    def __init__(self, path: str, default_timeout: int=300,
+                 cleanup_interval: float=60):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path
+        self.cleanup_interval = cleanup_interval
+        self.next_cleanup = 0.0
+        self.serializer = MsgpackSerializer()
+        self.local = threading.local()
+        # Connections must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._reset)
+
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.schema)
+
+    def __repr__(self) -> str:
+        return f'SqliteCache - path: {self.path}'
+
+    def _reset(self):
+        self.local = threading.local()
+
+    # SQLite connections cannot be shared between threads, keep one per thread
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+
+        return conn
+
+    def _expires(self, timeout: int | None) -> float:
+        timeout = self._normalize_timeout(timeout)
+        # Timeout of 0 never expires
+        return time() + timeout if timeout else float('inf')
+
+    def get(self, key: str):
+        row = self.connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND expires > ?',
+            (key, time())).fetchone()
+
+        return self.serializer.loads(row[0]) if row else None
+
+    def set(self, key: str, value, timeout: int | None=None) -> bool:
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                         (key, self._expires(timeout), self.serializer.dumps(value)))
+        self.cleanup()
+
+        return True
+
+    def add(self, key: str, value, timeout: int | None=None) -> bool:
+        with self.connection() as conn:
+            # Expired entries do not count as existing
+            conn.execute('DELETE FROM cache WHERE key = ? AND expires <= ?',
+                         (key, time()))
+            cursor = conn.execute('INSERT OR IGNORE INTO cache VALUES (?, ?, ?)',
+                                  (key, self._expires(timeout),
+                                   self.serializer.dumps(value)))
+
+        return cursor.rowcount == 1
+
+    def delete(self, key: str) -> bool:
+        with self.connection() as conn:
+            cursor = conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+        return cursor.rowcount == 1
+
+    def has(self, key: str) -> bool:
+        return self.connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND expires > ?',
+            (key, time())).fetchone() is not None
+
+    def clear(self) -> bool:
+        with self.connection() as conn:
+            conn.execute('DELETE FROM cache')
+
+        return True
+
+    # Remove expired entries at most once per cleanup interval using the index
+    def cleanup(self):
+        now = time()
+        if now < self.next_cleanup:
+            return
+
+        self.next_cleanup = now + self.cleanup_interval
+        with self.connection() as conn:
+            conn.execute('DELETE FROM cache WHERE expires <= ?', (now,))
@@ -7,13 +7,9 @@ from oci import Signer
 from oci.config import from_file, get_config_value_or_default, DEFAULT_LOCATION, DEFAULT_PROFILE
 from oci.auth import signers
 
-log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-handler.setLevel(logging.INFO)
-log.addHandler(handler)
+from .log import get_logger
+
+log = get_logger(__name__, logging.INFO)
 
 # Signer entrypoint, this function should choose and return a tuple containing
 # a config dict and a signer
@@ -30,7 +26,7 @@ def create_signer(authentication_type: str | None=None,
         signer_func = func[authentication_type.lower()]
         return signer_func(**kwargs)
     except KeyError:
-        log.warn(f'Invalid signer type: {authentication_type}')
+        log.warning('Invalid signer type: %s', authentication_type)
         log.warn('Attempting to use default profile signer')
         return create_profile_signer()
 
@@ -38,7 +34,7 @@ def create_signer(authentication_type: str | None=None,
 # arguments for profile and location.
 def create_profile_signer(profile: str=DEFAULT_PROFILE,
                           location: str=DEFAULT_LOCATION, **kwargs) -> tuple[dict, Signer]:
-    log.info(f'Using profile {profile} at {location} for authentication')
+    log.info('Using profile %s at %s for authentication', profile, location)
     config = from_file(file_location=location, profile_name=profile)
     signer = Signer(
         tenancy=config["tenancy"],
@@ -56,11 +52,11 @@ def create_instance_principal_signer(**kwargs):
     try:
         signer = signers.InstancePrincipalsSecurityTokenSigner()
         cfg = {'region': signer.region, 'tenancy': signer.tenancy_id}
-        log.debug(f'Instance Principal signer created: {signer}\nConfig: {cfg}')
+        log.debug('Instance Principal signer created: %s\nConfig: %s', signer, cfg)
         return cfg, signer
     
     except Exception as e:
-        log.error(f'Instance Principal signer failed due to exception {e}')
+        log.error('Instance Principal signer failed due to exception %s', e)
         raise SystemExit
 
 # Cloud Shell signer, not recommended
@@ -84,10 +80,10 @@ def create_delegation_token_signer(**kwargs) -> tuple[dict, Signer]:
 
             return config, signer
     except KeyError as e:
-        log.error(f'Key Error exception during Delegation Token retrieval {e}')
+        log.error('Key Error exception during Delegation Token retrieval %s', e)
         raise SystemExit
     except Exception as e:
-        log.error(f'Exception during Delegation Token retrieval {e}')
+        log.error('Exception during Delegation Token retrieval %s', e)
         raise SystemExit
     
 # Function to create workload identity signer for use by Oracle Kubernetes Engine
@@ -96,8 +92,8 @@ def create_workload_principal_signer(**kwargs) -> tuple[dict, Signer]:
     try:
         signer = signers.get_oke_workload_identity_resource_principal_signer()
         cfg = {'region': signer.region, 'tenancy': signer.tenancy_id}
-        log.debug(f'Workload Principal signer created: {signer}\nConfig: {cfg}')
+        log.debug('Workload Principal signer created: %s\nConfig: %s', signer, cfg)
         return cfg, signer
     except Exception as e:
-        log.error(f'Workload Principal signer failed due to exception {e}')
+        log.error('Workload Principal signer failed due to exception %s', e)
         raise SystemExit
@@ -0,0 +1,150 @@
+#!/usr/bin/python3.11
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from collections.abc import Callable
+from time import time
+
+from .log import get_logger
+
+
+class Snapshot:
+    """Snapshot persists startup metadata such as subscribed regions, resource
+       types, OIDC configuration and JWKS to a file so workers can boot without
+       calling out to the network. Data older than the ttl is still used to boot.
+       Once tracking sections, every worker checks the snapshot periodically:
+       one worker at a time refreshes it when stale, and the others apply the
+       refreshed data when they see the file change.
+
+       Keyword arguments:
+       path -- JSON file holding the snapshot
+       ttl -- seconds before the snapshot is considered stale (default 3600)
+    """
+
+    # Checks per ttl for a stale snapshot or one refreshed by another worker
+    checks = 10
+
+    def __init__(self, path: str, ttl: float=3600,
+                 log_level: int | str=logging.INFO):
+        # Logging
+        self.logger = get_logger(__name__, log_level)
+
+        self.path = path
+        self.ttl = ttl
+        self.created: float = 0
+        self.data: dict = {}
+        self.sections: dict[str, tuple[Callable[[], dict],
+                                       Callable[[dict], None]]] = {}
+        self.stop = threading.Event()
+        self.pid: int | None = None
+        self.load()
+
+    def __repr__(self) -> str:
+        return (f'Snapshot - path: {self.path} ttl: {self.ttl} '
+                f'age: {self.age():.0f} sections: {list(self.data)}')
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            self.created = snapshot['created']
+            self.data = snapshot['data']
+            self.logger.info('Loaded %s', self)
+        except FileNotFoundError:
+            self.logger.info('No snapshot at %s', self.path)
+        except (ValueError, KeyError) as e:
+            self.logger.error('Ignoring unreadable snapshot %s: %s', self.path, e)
+
+    # Write atomically so workers never read a partial snapshot
+    def save(self, data: dict):
+        self.data = data
+        self.created = time()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+            json.dump({'created': self.created, 'data': data}, f)
+        os.replace(f.name, self.path)
+        self.logger.info('Saved %s', self)
+
+    def get(self, section: str) -> dict | None:
+        return self.data.get(section)
+
+    def age(self) -> float:
+        return time() - self.created
+
+    def stale(self) -> bool:
+        return not self.data or self.age() > self.ttl
+
+    def track(self, sections: dict[str, tuple[Callable[[], dict],
+                                              Callable[[dict], None]]]):
+        '''Keep sections fresh once started. Each section is a pair of a
+        callable fetching its data, which also updates this process, and a
+        callable applying data another worker fetched.
+        '''
+
+        self.sections = sections
+
+    def start(self):
+        '''Start checking the snapshot in a background thread. Safe to call on
+        every request as the thread is started once per process, so a
+        preloaded app starts it in each worker rather than in the master.
+        '''
+
+        if self.pid == os.getpid():
+            return
+
+        self.pid = os.getpid()
+        threading.Thread(target=self.run, name='snapshot', daemon=True).start()
+        self.logger.info('Started %s', self)
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error('Snapshot refresh failed: %s', e)
+
+            if self.stop.wait(self.ttl / self.checks):
+                return
+
+    def check(self):
+        self.reload()
+        if self.stale():
+            self._refresh()
+
+    # Load the file if it changed, applying data another worker saved
+    def reload(self):
+        try:
+            if os.stat(self.path).st_mtime <= self.created:
+                return
+        except FileNotFoundError:
+            return
+
+        created = self.created
+        self.load()
+        if self.created > created:
+            for name, (_, apply) in self.sections.items():
+                if name in self.data:
+                    apply(self.data[name])
+            self.logger.info('Applied %s', self)
+
+    def _refresh(self):
+        with open(f'{self.path}.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return # Another worker is refreshing, applied on a later check
+
+            try:
+                # Another worker may have just finished a refresh
+                self.reload()
+                if self.stale():
+                    self.save({name: fetch()
+                               for name, (fetch, _) in self.sections.items()})
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
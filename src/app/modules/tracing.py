@@ -0,0 +1,194 @@
+#!/usr/bin/python3.11
+
+import json
+import logging
+import random
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter_ns, time_ns
+
+from .log import LogPipeline
+
+# The trace of the request being handled and the span open in it. Threads
+# started for a request only add spans if they run in a copy of its context.
+current_trace: ContextVar['Trace | None'] = ContextVar('trace', default=None)
+current_span: ContextVar[str | None] = ContextVar('span', default=None)
+
+
+class Span:
+    """Span is a named, timed part of a trace. Times are perf_counter_ns."""
+
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end', 'attributes')
+
+    def __init__(self, name: str, span_id: str, parent_id: str | None,
+                 start: int, end: int, attributes: dict | None=None):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = start
+        self.end = end
+        self.attributes = attributes or {}
+
+    def __repr__(self) -> str:
+        return f'Span - name: {self.name} duration: {self.duration / 1e6:.1f}ms'
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+
+class Trace:
+    """Trace collects the spans of one request so its time can be broken down
+       into session load, OCI calls, filtering, projection, template render
+       and session save.
+
+       Keyword arguments:
+       started -- perf_counter_ns the request started at (default now)
+       attributes -- values describing the request, such as its route
+    """
+
+    def __init__(self, name: str, started: int | None=None,
+                 attributes: dict | None=None):
+        self.name = name
+        self.trace_id = f'{random.getrandbits(128):032x}'
+        self.span_id = new_span_id()
+        self.started = started or perf_counter_ns()
+        # Wall clock time the trace started for export
+        self.start_time = time_ns() - (perf_counter_ns() - self.started)
+        self.ended: int | None = None
+        self.attributes = attributes or {}
+        self.spans: list[Span] = []
+
+    def __repr__(self) -> str:
+        return (f'Trace - name: {self.name} id: {self.trace_id} '
+                f'spans: {len(self.spans)}')
+
+    def add(self, name: str, start: int, end: int, **attributes):
+        '''Add a span timed outside of the span context manager.'''
+
+        self.spans.append(Span(name, new_span_id(), self.span_id, start, end,
+                               attributes))
+
+    def end(self):
+        self.ended = perf_counter_ns()
+
+    def server_timing(self) -> str:
+        '''Return a Server-Timing header value with the total time of spans by
+        name, and the time of the request so far.
+        '''
+
+        totals: dict[str, list[int]] = {}
+        for span in self.spans:
+            total = totals.setdefault(span.name, [0, 0])
+            total[0] += span.duration
+            total[1] += 1
+
+        metrics = [f'{name};dur={duration / 1e6:.1f}'
+                   + (f';desc="{count} calls"' if count > 1 else '')
+                   for name, (duration, count) in totals.items()]
+        total = (self.ended or perf_counter_ns()) - self.started
+        metrics.append(f'total;dur={total / 1e6:.1f}')
+
+        return ', '.join(metrics)
+
+    def otlp(self, service: str) -> dict:
+        '''Return the trace as OTLP JSON, as read by OpenTelemetry collectors.'''
+
+        def unix(ns: int) -> str:
+            return str(self.start_time + ns - self.started)
+
+        def attributes(values: dict) -> list[dict]:
+            return [{'key': key, 'value': {'intValue': str(value)}
+                     if isinstance(value, int) else {'stringValue': str(value)}}
+                    for key, value in values.items()]
+
+        root = Span(self.name, self.span_id, None, self.started,
+                    self.ended or perf_counter_ns(), self.attributes)
+        spans = [{
+            'traceId': self.trace_id,
+            'spanId': span.span_id,
+            'parentSpanId': span.parent_id or '',
+            'name': span.name,
+            'kind': 2 if span is root else 1,
+            'startTimeUnixNano': unix(span.start),
+            'endTimeUnixNano': unix(span.end),
+            'attributes': attributes(span.attributes),
+        } for span in [root, *self.spans]]
+
+        return {'resourceSpans': [{
+            'resource': {'attributes': attributes({'service.name': service})},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]
+        }]}
+
+
+class TraceExporter:
+    """TraceExporter appends finished traces to a file as OTLP JSON lines, the
+       format read by the OpenTelemetry collector file receiver. Traces are
+       written by a LogPipeline so requests never wait on the file.
+
+       Keyword arguments:
+       path -- file to append traces to
+       service -- service name traces are reported under
+    """
+
+    def __init__(self, path: str, service: str='oci-management-portal'):
+        self.path = path
+        self.service = service
+
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger = logging.getLogger(f'{__name__}.export')
+        self.pipeline = LogPipeline(handler)
+        self.pipeline.attach(self.logger, logging.INFO)
+
+    def __repr__(self) -> str:
+        return f'TraceExporter - path: {self.path} service: {self.service}'
+
+    def export(self, trace: 'Trace'):
+        self.logger.info('%s', json.dumps(trace.otlp(self.service),
+                                          separators=(',', ':')))
+
+
+def new_span_id() -> str:
+    return f'{random.getrandbits(64):016x}'
+
+# Time a block as a span of the current trace, a no-op outside of a trace.
+# Spans opened inside the block are its children.
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    span_id = new_span_id()
+    parent = current_span.get()
+    current_span.set(span_id)
+    start = perf_counter_ns()
+    try:
+        yield
+    finally:
+        trace.spans.append(Span(name, span_id, parent or trace.span_id, start,
+                                perf_counter_ns(), attributes))
+        current_span.set(parent)
+
+# Start a trace for the request being handled
+def start_trace(name: str, started: int | None=None, **attributes) -> Trace:
+    trace = Trace(name, started=started, attributes=attributes)
+    current_trace.set(trace)
+    current_span.set(None)
+
+    return trace
+
+# End the current trace, returning it. Threads are reused between requests,
+# so the trace must be ended for the next request not to add to it.
+def end_trace() -> Trace | None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.end()
+    current_trace.set(None)
+    current_span.set(None)
+
+    return trace
@@ -1,24 +1,34 @@
 #!/usr/bin/python3.11
 
-import logging
+import hashlib
+import hmac
 
-from secrets import token_urlsafe
+from time import time
 from .config import Configuration
 
-# Generate a dict of random tokens and return it
-def generate_csrf_tokens(n: int) -> dict:
-    tokens = {}
+# Create a CSRF token bound to a session and resource. The token carries the
+# region the resource was listed in, when its owner was read from OCI and the
+# token's expiry, signed with the key so it can be verified without storing it.
+def create_csrf_token(key: bytes, sid: str, identifier: str, region: str,
+                      listed: int, expiry: int) -> str:
+    payload = f'{region}.{listed}.{expiry}'
+    signature = hmac.new(key, f'{sid}.{identifier}.{payload}'.encode(),
+                         hashlib.sha256).hexdigest()
 
-    for i in range(n):
-        tokens[token_urlsafe()] = None
+    return f'{payload}.{signature}'
 
-    return tokens
+# Verify a CSRF token for a session and resource, returning a tuple of
+# (region, listed) if valid or None if forged, mismatched or expired
+def verify_csrf_token(key: bytes, token: str | None, sid: str,
+                      identifier: str | None) -> tuple[str, int] | None:
+    try:
+        region, listed, expiry, signature = token.split('.')
+        listed, expiry = int(listed), int(expiry)
+    except (AttributeError, ValueError):
+        return None
 
-def log_factory(name: str, log_level: int | str,
-                handler: logging.Handler) -> logging.Logger:
-    logger = logging.getLogger(name)
-    logger.handlers.clear()
-    logger.addHandler(handler)
-    logger.setLevel(log_level)
+    expected = create_csrf_token(key, sid, identifier, region, listed, expiry)
+    if not hmac.compare_digest(expected, token) or expiry < time():
+        return None
 
-    return logger
+    return region, listed
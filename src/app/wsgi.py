@@ -1,12 +1,12 @@
 #!/usr/bin/python3.11
 
-from cachelib import FileSystemCache
 from datetime import timedelta
 from flask import Flask
 from flask_session import Session
 import logging
 
-from modules import add_handlers, Configuration
+from modules import add_handlers, Configuration, LogPipeline
+from modules.sessions import create_session_cache
 
 ### Globals
 TIMEOUT_IN_SECONDS = 900 # 10 minute session timeout
@@ -24,16 +24,23 @@ def app(*args, **kwargs) -> Flask:
     app = Flask(__name__)
     app.config['SESSION_COOKIE_NAME'] = 'omid'
     app.config['SESSION_TYPE'] = 'cachelib'
-    # FileSystemCache is a cachelib local filesystem cache, saves sessions to ./session
-    app.config['SESSION_CACHELIB'] = FileSystemCache('session',
-                                                    default_timeout=TIMEOUT_IN_SECONDS)
+    # Session store is a cachelib cache chosen by the session backend setting,
+    # default filesystem cache saves sessions to ./session
+    app.config['SESSION_CACHELIB'] = create_session_cache(cfg.sessionbackend,
+                                                          TIMEOUT_IN_SECONDS,
+                                                          path=cfg.sessionpath,
+                                                          url=cfg.sessionurl)
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(seconds=TIMEOUT_IN_SECONDS)
-    Session(app) # Using local filesystem session cache
-
-    # Flask Logging
-    app.logger.setLevel(cfg.get_log_level())
-    app.logger.addHandler(cfg.get_log_handler())
+    # Only save sessions that changed, handlers refresh active sessions
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+    Session(app)
+
+    # Logging, records from the app and every module are written off the
+    # request threads by the pipeline's listener
+    logs = LogPipeline(cfg.get_log_handler(), sample=cfg.get_log_sample())
+    logs.attach(app.logger, cfg.get_log_level())
+    logs.attach(logging.getLogger('modules'))
     app.logger.debug(cfg)
     app = add_handlers(app, cfg)
 
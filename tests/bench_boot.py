@@ -0,0 +1,38 @@
+"""Measure how long gunicorn workers take to boot the app and their max RSS,
+   with each worker building the app itself rather than forking a preloaded one.
+
+   python tests/bench_boot.py [--workers 4] [--runs 3] [--regions 3]
+                              [--app path/to/src/app]
+"""
+
+import argparse
+
+from statistics import mean
+
+from bench_workers import APP, serve
+
+
+def boot(workers: int, runs: int, app: str=APP, env: dict | None=None
+         ) -> tuple[float, float]:
+    """Return the mean seconds to boot a worker and mean max RSS in MiB"""
+    booted = []
+    for _ in range(runs):
+        with serve(workers, 1, preload=False, latency=0, env=env, app=app) as (_, _, run):
+            booted += run
+    return mean(seconds for seconds, _ in booted), mean(rss for _, rss in booted) / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--regions', type=int, default=3,
+                        help='regions the tenancy is subscribed to')
+    parser.add_argument('--app', default=APP,
+                        help='src/app of the checkout to measure (default this one)')
+    args = parser.parse_args()
+
+    seconds, rss = boot(args.workers, args.runs, app=args.app,
+                        env={'BENCH_REGIONS': str(args.regions)})
+    print(f'{args.app} with {args.regions} regions: worker boot {seconds:.2f}s  '
+          f'max RSS {rss:.1f} MiB')
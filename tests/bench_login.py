@@ -0,0 +1,171 @@
+"""Measure /callback latency when many users sign in at once, against a local
+   identity provider that signs real ID tokens and takes a handshake delay on
+   every new connection as TLS to a remote identity domain would.
+
+   python tests/bench_login.py [--workers 4] [--threads 4] [--clients 32]
+                               [--seconds 10] [--handshake 0.05] [--latency 0.02]
+                               [--app path/to/src/app]
+"""
+
+import argparse
+import http.server
+import json
+import threading
+import urllib.parse
+
+from contextlib import contextmanager
+from time import monotonic, sleep, time
+
+import jwt
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from bench_workers import APP, UnixConnection, serve
+
+
+class IdentityProviderHandler(http.server.BaseHTTPRequestHandler):
+    """IdentityProviderHandler serves discovery, JWKS, the token exchange and
+       userinfo for the client id `client`, keeping connections alive. The
+       authorization code is the nonce the ID token is issued for.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        sleep(self.server.handshake)
+
+    def send(self, body: dict):
+        sleep(self.server.latency)
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = self.server.url
+        if self.path == '/.well-known/openid-configuration':
+            self.send({'issuer': url,
+                       'authorization_endpoint': f'{url}/oauth2/v1/authorize',
+                       'token_endpoint': f'{url}/oauth2/v1/token',
+                       'userinfo_endpoint': f'{url}/oauth2/v1/userinfo',
+                       'jwks_uri': f'{url}/jwks',
+                       'id_token_signing_alg_values_supported': ['RS256']})
+        elif self.path == '/jwks':
+            self.send({'keys': [self.server.jwk]})
+        else:
+            subject = self.headers['Authorization'].removeprefix('Bearer ')
+            self.send({'sub': subject, 'email': f'{subject}@example.com'})
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(
+            self.rfile.read(int(self.headers['Content-Length'])).decode())
+        nonce = form['code'][0]
+        subject = f'user-{nonce[:8]}'
+        now = int(time())
+        token = jwt.encode({'iss': self.server.url, 'aud': 'client', 'sub': subject,
+                            'nonce': nonce, 'iat': now, 'exp': now + 3600},
+                           self.server.key, algorithm='RS256',
+                           headers={'kid': 'bench'})
+        self.send({'access_token': subject, 'id_token': token,
+                   'token_type': 'Bearer', 'expires_in': 3600})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def identity_provider(handshake: float, latency: float):
+    """Serve an identity provider on a local port, yielding the server, which
+       counts the connections opened to it.
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), IdentityProviderHandler)
+    server.daemon_threads = True
+    server.handshake = handshake
+    server.latency = latency
+    server.connections = 0
+    server.lock = threading.Lock()
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    server.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server.jwk = dict(jwt.algorithms.RSAAlgorithm.to_jwk(server.key.public_key(),
+                                                         as_dict=True),
+                      kid='bench', use='sig', alg='RS256')
+
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def get(sock: str, path: str, cookie: str | None=None):
+    connection = UnixConnection(sock)
+    connection.request('GET', path, headers={'Cookie': cookie} if cookie else {})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response
+
+
+def storm(sock: str, clients: int, seconds: float) -> dict:
+    """Sign in from clients in a loop for seconds, each login a new user,
+       timing the /callback requests.
+    """
+    latencies = [[] for _ in range(clients)]
+    stop = monotonic() + seconds
+
+    def client(i: int):
+        while monotonic() < stop:
+            response = get(sock, '/login')
+            cookie = response.getheader('Set-Cookie').split(';')[0]
+            query = urllib.parse.parse_qs(
+                urllib.parse.urlparse(response.getheader('Location')).query)
+
+            start = monotonic()
+            response = get(sock, f'/callback?state={query["state"][0]}'
+                                 f'&code={query["nonce"][0]}', cookie)
+            latencies[i].append(monotonic() - start)
+            assert response.status == 302, response.status
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ordered = sorted(latency for client in latencies for latency in client)
+    return {'logins': len(ordered) / seconds,
+            'p50': ordered[len(ordered) // 2] * 1000,
+            'p99': ordered[int(len(ordered) * 0.99)] * 1000}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--handshake', type=float, default=0.05,
+                        help='seconds to open a connection to the identity provider')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds the identity provider takes to answer')
+    parser.add_argument('--app', default=APP,
+                        help='src/app of the checkout to measure (default this one)')
+    args = parser.parse_args()
+
+    with identity_provider(args.handshake, args.latency) as idp:
+        with serve(args.workers, args.threads, latency=0, app=args.app,
+                   env={'BENCH_IDP_URL': idp.url}) as (sock, _, _):
+            booted = idp.connections
+            result = storm(sock, args.clients, args.seconds)
+
+    logins = result['logins'] * args.seconds
+    print(f'{args.workers} x {args.threads} threads, {args.clients} clients: '
+          f'{result["logins"]:6.1f} logins/s  /callback p50 {result["p50"]:6.1f} ms  '
+          f'p99 {result["p99"]:6.1f} ms  '
+          f'{(idp.connections - booted) / logins:4.2f} connections per login')
@@ -0,0 +1,66 @@
+"""Compare how long gunicorn takes to serve its first request and the pod's
+   memory when workers boot cold, calling Identity, Search and the identity
+   provider, and when they boot from a startup snapshot.
+
+   python tests/bench_startup.py [--workers 1 4] [--runs 3] [--latency 0.3]
+                                 [--app path/to/src/app]
+"""
+
+import argparse
+import os
+import tempfile
+
+from statistics import mean
+from time import monotonic
+
+from bench_workers import APP, UnixConnection, serve, workers_pss
+
+
+# Proportional set size of a process in MiB
+def pss(pid: int) -> float:
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        return sum(int(line.split()[1]) for line in smaps
+                   if line.startswith('Pss:')) / 1024
+
+
+def start(workers: int, preload: bool, env: dict, app: str=APP) -> tuple[float, float]:
+    """Return the seconds from starting gunicorn until its first response and
+       the PSS in MiB of the master and its workers.
+    """
+    started = monotonic()
+    with serve(workers, 1, preload=preload, latency=0, env=env, app=app) as (sock, process, _):
+        connection = UnixConnection(sock)
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        ready = monotonic() - started
+        assert response.status == 200, response.status
+        return ready, pss(process.pid) + workers_pss(process.pid)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.3,
+                        help='seconds each call made at boot takes')
+    parser.add_argument('--app', default=APP,
+                        help='src/app of the checkout to measure (default this one)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = os.path.join(directory, 'snapshot.json')
+        env = {'BENCH_STARTUP_LATENCY': str(args.latency)}
+        modes = {'cold': env, 'snapshot': dict(env, OCIDOMAIN_SNAPSHOT_PATH=snapshot)}
+        # The first boot with a snapshot path writes the snapshot
+        start(1, False, modes['snapshot'], app=args.app)
+
+        for workers in args.workers:
+            for preload in [False, True]:
+                for mode, environment in modes.items():
+                    runs = [start(workers, preload, environment, app=args.app)
+                            for _ in range(args.runs)]
+                    print(f'{workers} workers {"preload" if preload else "":7s} '
+                          f'{mode:8s}  first request {mean(r for r, _ in runs):5.2f}s  '
+                          f'pod PSS {mean(p for _, p in runs):6.1f} MiB', flush=True)
@@ -0,0 +1,167 @@
+"""Compare request throughput, latency and memory of sync and gthread gunicorn
+   workers serving the app with OCI Search stubbed at 50 ms a call.
+
+   python tests/bench_workers.py [--clients 16] [--seconds 10]
+"""
+
+import argparse
+import http.client
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.parse
+
+from contextlib import contextmanager
+from time import monotonic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'src', 'app')
+TESTS = os.path.join(ROOT, 'tests')
+BOOTED = re.compile(r'Worker (\d+) booted in ([\d.]+)s with max RSS (\d+) KiB')
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.connect(self.path)
+
+
+@contextmanager
+def serve(workers: int, threads: int, preload: bool=True, latency: float=0.05,
+          env: dict | None=None, app: str=APP):
+    """Start gunicorn with the repo's config on a unix socket in a temporary
+       directory, yielding the socket path, the master process and the boot
+       time and max RSS in KiB each worker logged. app is the directory the
+       app is imported from, another checkout's src/app to compare revisions.
+    """
+    with tempfile.TemporaryDirectory() as cwd:
+        sock = os.path.join(cwd, 'gunicorn.sock')
+        environment = dict(os.environ,
+                           GUNICORN_PRELOAD=str(preload).lower(),
+                           GUNICORN_THREADS=str(threads),
+                           PROMETHEUS_MULTIPROC_DIR=os.path.join(cwd, 'metrics'),
+                           BENCH_SEARCH_LATENCY=str(latency),
+                           OCIDOMAIN_CACHE_TTL='0',
+                           OCIDOMAIN_PREFETCH_DEPTH='0',
+                           OCIDOMAIN_RATE_LIMIT='0',
+                           **(env or {}))
+        process = subprocess.Popen([sys.executable, '-m', 'gunicorn',
+                                    '-c', os.path.join(APP, 'gunicorn.config.py'),
+                                    '-b', f'unix:{sock}', '-w', str(workers),
+                                    '--chdir', cwd,
+                                    '--pythonpath', f'{os.path.abspath(app)},{TESTS}',
+                                    'fakes:create_app()'],
+                                   env=environment, stderr=subprocess.PIPE, text=True)
+        booted = []
+        lines = []
+        for line in process.stderr:
+            lines.append(line)
+            match = BOOTED.search(line)
+            if match:
+                booted.append((float(match[2]), int(match[3])))
+                if len(booted) == workers:
+                    break
+        else:
+            raise RuntimeError('gunicorn exited before its workers booted:\n'
+                               + ''.join(lines[-20:]))
+        # Keep reading so gunicorn never blocks on a full pipe
+        threading.Thread(target=lambda: [None for _ in process.stderr], daemon=True).start()
+
+        try:
+            yield sock, process, booted
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+
+# Sign in through the stubbed identity provider, returning the session cookie
+def login(sock: str) -> str:
+    connection = UnixConnection(sock)
+    connection.request('GET', '/login')
+    response = connection.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie').split(';')[0]
+    query = urllib.parse.urlparse(response.getheader('Location')).query
+    state = urllib.parse.parse_qs(query)['state'][0]
+
+    connection.request('GET', f'/callback?state={state}&code=code',
+                       headers={'Cookie': cookie})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return (response.getheader('Set-Cookie') or cookie).split(';')[0]
+
+
+def load(sock: str, clients: int, seconds: float, path: str='/p') -> dict:
+    """Request path from signed in clients in a loop for seconds, each request
+       on a new connection as a browser behind a proxy would.
+    """
+    cookies = [login(sock) for _ in range(clients)]
+    latencies = [[] for _ in range(clients)]
+    resets = []
+    stop = monotonic() + seconds
+
+    def client(i: int):
+        while monotonic() < stop:
+            start = monotonic()
+            try:
+                connection = UnixConnection(sock)
+                connection.request('GET', path, headers={'Cookie': cookies[i]})
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+            except ConnectionError:
+                resets.append(i)
+                continue
+            assert response.status == 200, response.status
+            latencies[i].append(monotonic() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ordered = sorted(latency for client in latencies for latency in client)
+    return {'rps': len(ordered) / seconds,
+            'p50': ordered[len(ordered) // 2] * 1000,
+            'p99': ordered[int(len(ordered) * 0.99)] * 1000,
+            'resets': len(resets)}
+
+
+# Proportional set size of the master's workers in MiB, shared pages are
+# divided between the processes sharing them
+def workers_pss(pid: int) -> float:
+    children = subprocess.run(['ps', '-o', 'pid=', '--ppid', str(pid)],
+                              capture_output=True, text=True).stdout.split()
+    total = 0
+    for child in children:
+        with open(f'/proc/{child}/smaps_rollup') as smaps:
+            total += sum(int(line.split()[1]) for line in smaps if line.startswith('Pss:'))
+    return total / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    for workers, threads in [(4, 1), (1, 16), (4, 4)]:
+        with serve(workers, threads) as (sock, process, booted):
+            result = load(sock, args.clients, args.seconds)
+            pss = workers_pss(process.pid)
+        kind = 'sync' if threads == 1 else f'gthread {threads} threads'
+        print(f'{workers} x {kind:18s} {result["rps"]:6.1f} req/s  '
+              f'p50 {result["p50"]:6.1f} ms  p99 {result["p99"]:6.1f} ms  '
+              f'workers PSS {pss:6.1f} MiB  resets {result["resets"]}',
+              flush=True)
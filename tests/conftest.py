@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app is run from src/app and imports its modules from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'app'))
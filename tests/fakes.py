@@ -0,0 +1,187 @@
+"""Stand-ins for OCI Search, Identity and the identity provider so the app can
+   be run and benchmarked without a tenancy. The benchmark scripts serve the app
+   built by create_app() with gunicorn or Flask's test client.
+"""
+
+import json
+import os
+import oci
+
+from datetime import datetime, timedelta, timezone
+from time import sleep
+from unittest import mock
+from oci.auth import signers
+from oci.identity.models import RegionSubscription
+from oci.resource_search.models import (ResourceSummary, ResourceSummaryCollection,
+                                        ResourceType)
+from oci.response import Response
+
+REGIONS = ['us-ashburn-1', 'us-phoenix-1', 'eu-frankfurt-1']
+EMAIL = 'me@example.com'
+
+ENVIRONMENT = {'OCIDOMAIN_TAG_NAMESPACE': 'ns',
+               'OCIDOMAIN_TAG_KEY': 'key',
+               'OCIDOMAIN_IDM_ENDPOINT': 'https://idp.example.com',
+               'OCIDOMAIN_CLIENT_ID': 'client',
+               'OCIDOMAIN_CLIENT_SECRET': 'secret',
+               'OCIDOMAIN_LOG_LEVEL': 'warning'}
+
+OIDC = {'issuer': 'https://idp.example.com',
+        'jwks_uri': 'https://idp.example.com/jwks',
+        'id_token_signing_alg_values_supported': ['RS256']}
+
+
+# Calls the app makes at boot take BENCH_STARTUP_LATENCY seconds
+def startup_call():
+    sleep(float(os.environ.get('BENCH_STARTUP_LATENCY', '0')))
+
+
+def make_items(region: str, count: int) -> list[ResourceSummary]:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [ResourceSummary(identifier=f'ocid1.instance.{region}.{i}',
+                            display_name=f'{region}-{i}',
+                            resource_type='Instance',
+                            compartment_id='ocid1.compartment.oc1..c',
+                            lifecycle_state='RUNNING',
+                            time_created=start + timedelta(hours=i * len(REGIONS)
+                                                           + REGIONS.index(region)),
+                            defined_tags={'ns': {'key': EMAIL}})
+            for i in range(count)]
+
+
+class FakeSearchClient:
+    """FakeSearchClient replaces ResourceSearchClient, paging through the
+       resources of its region newest first after sleeping for latency seconds.
+    """
+
+    items = {region: make_items(region, 30) for region in REGIONS}
+    latency = 0.0
+
+    def __init__(self, config: dict, signer=None, **kwargs):
+        self.region = config['region']
+        self.base_client = mock.MagicMock()
+
+    def search_resources(self, details, page: str | None=None, limit: int=25,
+                         **kwargs) -> Response:
+        sleep(self.latency)
+        items = sorted(self.items.get(self.region, []), key=lambda i: i.time_created,
+                       reverse=True)
+        if "identifier = '" in details.query:
+            identifier = details.query.split("identifier = '")[1].split("'")[0]
+            items = [i for i in items if i.identifier == identifier]
+
+        start = int(page or 0)
+        headers = {}
+        if start + limit < len(items):
+            headers['opc-next-page'] = str(start + limit)
+        return Response(200, headers,
+                        ResourceSummaryCollection(items=items[start:start + limit]),
+                        None)
+
+    def list_resource_types(self, **kwargs) -> Response:
+        startup_call()
+        return Response(200, {}, [ResourceType(name='Instance'),
+                                  ResourceType(name='Volume')], None)
+
+
+class FakeIdentityClient:
+    """FakeIdentityClient subscribes the tenancy to REGIONS, or to as many of
+       the SDK's regions as BENCH_REGIONS sets, resources are only in REGIONS.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def list_region_subscriptions(self, tenancy: str) -> Response:
+        startup_call()
+        count = int(os.environ.get('BENCH_REGIONS', len(REGIONS)))
+        regions = (REGIONS + [region for region in oci.regions.REGIONS
+                              if region not in REGIONS])[:count]
+        return Response(200, {}, [RegionSubscription(region_key=region[:3].upper(),
+                                                     region_name=region,
+                                                     status='READY',
+                                                     is_home_region=i == 0)
+                                  for i, region in enumerate(regions)], None)
+
+
+class FakeResponse:
+    def __init__(self, body: dict):
+        self.body = body
+        self.text = json.dumps(body)
+        self.status_code = 200
+
+    def json(self) -> dict:
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+# An instance principal signer as the SDK accepts it, never asked to sign
+def fake_signer(*args, **kwargs) -> tuple[dict, mock.MagicMock]:
+    return ({'tenancy': 'ocid1.tenancy.oc1..t', 'region': REGIONS[0]},
+            mock.MagicMock(spec=signers.InstancePrincipalsSecurityTokenSigner))
+
+
+# Requests to the identity provider, both through a session and requests.get
+def fake_request(session, method: str, url: str, *args, **kwargs) -> FakeResponse:
+    if method == 'POST':
+        return FakeResponse({'access_token': 'access', 'id_token': 'id'})
+    if 'openid-configuration' in url:
+        startup_call()
+        return FakeResponse(OIDC)
+    return FakeResponse({'sub': 'me', 'email': EMAIL})
+
+
+def patches(idp: bool=True) -> list:
+    """Patches for the services the app calls, the identity provider only when
+       idp is set. The JWKS client is only patched where it exists so older
+       checkouts can be compared.
+    """
+    from modules.authenticator import authenticator
+
+    patched = [mock.patch('oci.resource_search.ResourceSearchClient', FakeSearchClient),
+               mock.patch('modules.search.search.IdentityClient', FakeIdentityClient),
+               mock.patch('modules.handlers.create_signer', fake_signer)]
+    if not idp:
+        return patched
+
+    patched += [mock.patch('requests.Session.request', fake_request),
+                mock.patch('modules.authenticator.Authenticator.decode_jwt',
+                           lambda self, token, nonce: {'sub': 'me', 'email': EMAIL,
+                                                       'nonce': nonce})]
+    if hasattr(authenticator, 'JWKSClient'):
+        patched.append(mock.patch('modules.authenticator.authenticator.JWKSClient.fetch_data',
+                                  lambda self: startup_call() or {'keys': []}))
+    return patched
+
+
+def create_app(latency: float | None=None, **kwargs):
+    """Build the app with the services patched, run with
+       gunicorn 'fakes:create_app()' from the tests directory. Settings in the
+       environment take precedence over ENVIRONMENT, BENCH_SEARCH_LATENCY sets
+       the search latency in seconds. BENCH_IDP_URL sends identity provider
+       calls to a real server there instead of patching them.
+    """
+    if os.environ.get('BENCH_IDP_URL'):
+        os.environ['OCIDOMAIN_IDM_ENDPOINT'] = os.environ['BENCH_IDP_URL']
+    for key, value in ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    if latency is None:
+        latency = float(os.environ.get('BENCH_SEARCH_LATENCY', '0'))
+    FakeSearchClient.latency = latency
+
+    for patch in patches(idp=not os.environ.get('BENCH_IDP_URL')):
+        patch.start()
+
+    import wsgi
+    return wsgi.app(**kwargs)
+
+
+def login(client):
+    """Sign a Flask test client in through /login and /callback"""
+    client.get('/login')
+    with client.session_transaction() as session:
+        state = session['state']
+    response = client.get(f'/callback?state={state}&code=code')
+    assert response.status_code == 302, response.data
@@ -0,0 +1,76 @@
+import http.server
+import threading
+
+import pytest
+
+from modules.authenticator import Authenticator, create_session
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    """StatusHandler answers every request with the server's status, recording
+       the method and path of each request.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.server.requests.append((self.command, self.path))
+
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    do_GET = do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def idp():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StatusHandler)
+    server.requests = []
+    server.status = 200
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_post_not_retried(idp, status: int):
+    idp.status = status
+    response = create_session(retries=3, backoff=0).post(f'{idp.url}/oauth2/v1/token',
+                                                         data={'code': 'code'})
+
+    assert response.status_code == status
+    assert idp.requests == [('POST', '/oauth2/v1/token')]
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_get_retried(idp, status: int):
+    idp.status = status
+    response = create_session(retries=3, backoff=0).get(f'{idp.url}/oauth2/v1/userinfo')
+
+    assert response.status_code == status
+    assert idp.requests == [('GET', '/oauth2/v1/userinfo')] * 4
+
+
+def test_token_exchange_sends_code_once(idp):
+    oauth = Authenticator(idp.url, 'client', 'secret', retries=3,
+                          metadata={'oidc_config': {
+                                        'issuer': idp.url,
+                                        'jwks_uri': f'{idp.url}/jwks',
+                                        'id_token_signing_alg_values_supported': ['RS256']},
+                                    'jwks': {'keys': []}})
+    idp.status = 503
+
+    with pytest.raises(KeyError):
+        oauth.retrive_token('code', 'nonce')
+
+    assert idp.requests == [('POST', '/oauth2/v1/token')]
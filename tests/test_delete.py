@@ -0,0 +1,54 @@
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from oci.exceptions import ServiceError
+
+from modules.delete import Deleter
+
+INSTANCE = {'identifier': 'ocid1.instance.oc1..i', 'resource_type': 'Instance'}
+
+
+@pytest.fixture
+def deleter() -> Deleter:
+    deleter = Deleter({'tenancy': 'ocid1.tenancy.oc1..t'}, None,
+                      regions=['us-ashburn-1'], workers=2)
+    deleter.clients.get = mock.MagicMock()
+    return deleter
+
+
+def test_terminate_calls_region_client(deleter: Deleter):
+    deleter.clients.get.return_value.terminate_instance.return_value.status = 204
+    assert deleter.terminate(INSTANCE, region='us-ashburn-1') == 204
+    deleter.clients.get.assert_called_once_with('us-ashburn-1', 'compute')
+
+
+def test_unsupported_resource_type(deleter: Deleter):
+    resource = dict(INSTANCE, resource_type='Vcn')
+    assert deleter.terminate(resource, region='us-ashburn-1') == HTTPStatus.NOT_IMPLEMENTED
+    deleter.clients.get.assert_not_called()
+
+
+def test_unsubscribed_region_is_bad_request(deleter: Deleter):
+    assert deleter.terminate(INSTANCE, region='eu-frankfurt-1') == HTTPStatus.BAD_REQUEST
+    deleter.clients.get.assert_not_called()
+
+
+def test_client_errors_are_raised(deleter: Deleter):
+    deleter.clients.get.side_effect = KeyError('compute')
+    with pytest.raises(KeyError):
+        deleter.terminate(INSTANCE, region='us-ashburn-1')
+
+    deleter.clients.get.side_effect = ServiceError(404, 'NotAuthorizedOrNotFound',
+                                                   {}, 'Not found')
+    with pytest.raises(ServiceError):
+        deleter.terminate(INSTANCE, region='us-ashburn-1')
+
+
+def test_terminate_many_returns_statuses(deleter: Deleter):
+    deleter.clients.get.return_value.terminate_instance.side_effect = ServiceError(
+        409, 'Conflict', {}, 'Conflict')
+    results = {region: status for _, region, status in deleter.terminate_many(
+        [(INSTANCE, 'us-ashburn-1'), (INSTANCE, 'eu-frankfurt-1')])}
+    assert results == {'us-ashburn-1': 409, 'eu-frankfurt-1': HTTPStatus.BAD_REQUEST}
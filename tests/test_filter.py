@@ -0,0 +1,120 @@
+import datetime
+import functools
+
+from hypothesis import given, strategies as st
+from oci.response import Response
+
+from modules.search.filter import (CompartmentFilter, ExpiryFilter,
+                                   FilterPipeline, LifecycleFilter,
+                                   ResourceTypeFilter, _parse_date, parse_date)
+from modules.search.record import RecordPage, ResourceRecord
+
+TAG, KEY = 'Prod', 'Expires'
+STATES = ['RUNNING', 'running', 'STOPPED', 'TERMINATED', '', None]
+TYPES = ['Instance', 'instance', 'Bucket', 'Volume', None]
+COMPARTMENTS = ['ocid1.compartment.oc1..a', 'ocid1.compartment.oc1..b', None]
+
+today = datetime.date.today()
+dates = st.integers(-3, 3).map(lambda d: str(today + datetime.timedelta(days=d)))
+expiries = st.one_of(
+    dates,
+    st.integers(-3, 3).map(lambda d: (today + datetime.timedelta(days=d))
+                           .strftime('%Y-%-m-%-d')),
+    st.sampled_from(['', 'never', '2024-13-01', '2024-02-30', ' 2024-01-05',
+                     '02024-01-05', '2024-01-05T00:00:00']),
+    st.text(max_size=12))
+# Mostly tagged with a date, so runs of expiring resources are common
+tags = st.one_of(
+    st.builds(lambda value: {TAG: {KEY: value}}, dates),
+    st.builds(lambda value: {TAG: {KEY: value}}, expiries),
+    st.sampled_from([{}, {TAG: {}}]),
+    st.builds(lambda value: {'Other': {KEY: value}}, expiries))
+records = st.builds(ResourceRecord,
+                    identifier=st.uuids().map(str),
+                    resource_type=st.sampled_from(TYPES),
+                    compartment_id=st.sampled_from(COMPARTMENTS),
+                    lifecycle_state=st.sampled_from(STATES),
+                    defined_tags=tags)
+filters = st.lists(st.one_of(
+    st.just(ExpiryFilter(TAG, KEY)),
+    st.lists(st.sampled_from(['RUNNING', 'stopped', 'TERMINATED']), min_size=1)
+        .map(lambda states: LifecycleFilter(*states)),
+    st.lists(st.sampled_from(['instance', 'BUCKET', 'volume']), min_size=1)
+        .map(lambda types: ResourceTypeFilter(*types)),
+    st.lists(st.sampled_from(COMPARTMENTS[:2]), min_size=1)
+        .map(lambda compartments: CompartmentFilter(*compartments))),
+    min_size=1, max_size=4)
+
+
+# What each filter kept before filters decided on one item at a time
+def kept(filter, item) -> bool:
+    if isinstance(filter, ExpiryFilter):
+        try:
+            expiry = datetime.datetime.strptime(
+                item.defined_tags[filter.tag][filter.key], '%Y-%m-%d').date()
+        except (KeyError, ValueError):
+            return True
+        return today > expiry
+    if isinstance(filter, LifecycleFilter):
+        return (item.lifecycle_state or '').upper() in filter.states
+    if isinstance(filter, ResourceTypeFilter):
+        return (item.resource_type or '').lower() in filter.resource_types
+    if isinstance(filter, CompartmentFilter):
+        return item.compartment_id in filter.compartments
+
+
+# Each filter making its own pass over the results, one after another
+def chained(filters, items):
+    for filter in filters:
+        items = [item for item in items if kept(filter, item)]
+    return items
+
+
+def response(items):
+    return Response(200, {}, RecordPage(items=list(items)), None)
+
+
+@given(st.lists(records, max_size=50), filters)
+def test_pipeline_matches_chained_filters(items, filters):
+    results = FilterPipeline(*filters).results(response(items))
+    assert results.data.items == chained(filters, items)
+
+
+@given(st.lists(records, max_size=50), filters)
+def test_pipeline_matches_filters_applied_in_turn(items, filters):
+    applied = functools.reduce(lambda results, filter: filter.results(results),
+                               filters, response(items))
+    results = FilterPipeline(*filters).results(response(items))
+    assert results.data.items == applied.data.items
+
+
+@given(st.lists(records, max_size=50), filters)
+def test_composed_filters_match_pipeline(items, filters):
+    composed = functools.reduce(lambda a, b: a & b, filters)
+    results = composed.results(response(items))
+    assert results.data.items == chained(filters, items)
+
+
+@given(st.lists(records, max_size=50), filters, st.randoms())
+def test_filter_order_does_not_change_results(items, filters, random):
+    shuffled = random.sample(filters, len(filters))
+    assert (FilterPipeline(*filters).results(response(items)).data.items
+            == FilterPipeline(*shuffled).results(response(items)).data.items)
+
+
+@given(st.one_of(expiries, st.text()))
+def test_parse_date_matches_strptime(value):
+    try:
+        expected = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        expected = None
+    assert parse_date(value) == expected
+
+
+@given(st.lists(st.text(min_size=11), max_size=20))
+def test_parse_date_does_not_cache_long_values(values):
+    _parse_date.cache_clear()
+    for value in values:
+        assert parse_date(value) is None
+    assert _parse_date.cache_info().currsize == 0
+    assert _parse_date.cache_info().maxsize is not None
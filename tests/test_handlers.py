@@ -0,0 +1,44 @@
+import contextlib
+
+import pytest
+
+import fakes
+
+
+@pytest.fixture
+def create_client(tmp_path, monkeypatch):
+    """Return a factory for test clients of the app built with the services
+       faked and the given settings, run in a temporary directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    for key, value in fakes.ENVIRONMENT.items():
+        monkeypatch.setenv(key, value)
+
+    with contextlib.ExitStack() as stack:
+        for patch in fakes.patches():
+            stack.enter_context(patch)
+
+        def create(**settings):
+            for key, value in settings.items():
+                monkeypatch.setenv(f'OCIDOMAIN_{key}', value)
+
+            import wsgi
+            return wsgi.app().test_client()
+
+        yield create
+
+
+def test_server_timing_off_by_default(create_client):
+    client = create_client()
+    fakes.login(client)
+    assert 'Server-Timing' not in client.get('/p').headers
+
+
+def test_server_timing_only_for_signed_in_users(create_client):
+    client = create_client(SERVER_TIMING='true')
+    assert 'Server-Timing' not in client.get('/').headers
+    assert 'Server-Timing' not in client.get('/p').headers
+
+    fakes.login(client)
+    timing = client.get('/p').headers['Server-Timing']
+    assert 'oci_search' in timing and 'session_load' in timing
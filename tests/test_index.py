@@ -0,0 +1,122 @@
+import logging
+
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+
+from modules.search import (AbstractFilter, Indexer, InventoryIndex, ResourceRecord,
+                            Search)
+
+REGION = 'us-ashburn-1'
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def records(count: int) -> list[tuple[str, ResourceRecord]]:
+    return [('me', ResourceRecord(identifier=f'ocid1.instance.oc1..{i:03}',
+                                  resource_type='Instance',
+                                  time_created=START + timedelta(hours=i)))
+            for i in range(count)]
+
+
+@pytest.fixture
+def index(tmp_path) -> InventoryIndex:
+    index = InventoryIndex(str(tmp_path / 'inventory.db'))
+    index.replace(REGION, records(12))
+    index.mark_synced(REGION, None, full=True)
+    return index
+
+
+@pytest.fixture
+def indexer(index: InventoryIndex) -> Indexer:
+    search = mock.MagicMock(region_names=[REGION])
+    search.search_identifiers.return_value = []
+    indexer = Indexer(search, index, sweep_size=5)
+    indexer.fetch = mock.MagicMock(return_value=[])
+    return indexer
+
+
+def swept(indexer: Indexer) -> list[list[str]]:
+    return [call.args[0] for call in indexer.search.search_identifiers.call_args_list]
+
+
+def test_incremental_syncs_rotate_through_index(indexer: Indexer):
+    identifiers = indexer.index.identifiers(REGION)
+    for _ in range(4):
+        indexer.sync_incremental(REGION, None)
+
+    # Each sync checks a bounded slice, wrapping around at the end
+    assert swept(indexer) == [identifiers[:5], identifiers[5:10], identifiers[10:],
+                              identifiers[:5]]
+
+
+def test_incremental_sync_removes_terminated(indexer: Indexer):
+    identifiers = indexer.index.identifiers(REGION)
+    indexer.search.search_identifiers.return_value = [
+        ResourceRecord(identifier=identifiers[2], lifecycle_state='TERMINATED')]
+
+    indexer.sync_incremental(REGION, None)
+
+    assert indexer.index.identifiers(REGION) == identifiers[:2] + identifiers[3:]
+    assert indexer.index.sweep_position(REGION) == identifiers[4]
+
+
+def test_full_sync_replaces_without_sweep(indexer: Indexer):
+    indexer.sync_incremental(REGION, None)
+    indexer.search.search_identifiers.reset_mock()
+    indexer.fetch.return_value = records(3)
+
+    indexer.sync_full(REGION)
+
+    indexer.search.search_identifiers.assert_not_called()
+    assert len(indexer.index.identifiers(REGION)) == 3
+    assert indexer.index.sweep_position(REGION) is None
+
+
+def test_sweep_disabled(indexer: Indexer):
+    indexer.sweep_size = 0
+    indexer.sync_incremental(REGION, None)
+    assert swept(indexer) == [[]]
+    assert indexer.index.sweep_position(REGION) is None
+
+
+@pytest.fixture
+def search(index: InventoryIndex) -> Search:
+    # Only the attributes listing pages needs, without clients
+    search = Search.__new__(Search)
+    search.logger = logging.getLogger(__name__)
+    search.region_names = [REGION]
+    search.home_region = REGION
+    search.filter = AbstractFilter()
+    search.cache = None
+    search.prefetcher = None
+    search.index = index
+    search._search_region = mock.MagicMock()
+    return search
+
+
+def names(response) -> list[str]:
+    return [item.identifier for item in response.data.items]
+
+
+def test_index_pages(search: Search):
+    first = search.get_user_resources('me', limit=5)
+    assert first.next_page == 'index-5'
+
+    second = search.get_user_resources('me', page=first.next_page, limit=5)
+    assert names(second) == search.index.identifiers(REGION)[6:1:-1]
+
+
+@pytest.mark.parametrize('page', ['AAAAAXYZtoken', Search.encode_cursor(
+    {REGION: ['token', 3]}), 'index-', 'index--5'])
+def test_other_pages_served_from_index_start_over(search: Search, page: str):
+    first = search.get_user_resources('me', limit=5)
+    assert names(search.get_user_resources('me', page=page, limit=5)) == names(first)
+
+
+def test_index_page_listed_live_starts_over(search: Search):
+    search.index = None
+    search.user_query = mock.MagicMock(return_value='query')
+
+    search.get_user_resources('me', page='index-5', limit=5)
+    search._search_region.assert_called_once_with(REGION, 'query', None, 5)
@@ -0,0 +1,47 @@
+import threading
+
+from http import HTTPStatus
+
+from modules.delete.jobs import DeleteJobs
+
+
+def test_finished_jobs_are_reported_once(tmp_path):
+    jobs = DeleteJobs(str(tmp_path / 'jobs.db'))
+    jobs.add('me', 'us-ashburn-1', 'a', 'Instance')
+    jobs.add('me', 'us-ashburn-1', 'b', 'Instance')
+
+    assert jobs.report('me') == ([('a', HTTPStatus.ACCEPTED),
+                                  ('b', HTTPStatus.ACCEPTED)], True)
+
+    jobs.update('us-ashburn-1', {'a': 'TERMINATED', 'b': 'TERMINATING'}, 3600)
+    assert jobs.report('me') == ([('a', HTTPStatus.OK),
+                                  ('b', HTTPStatus.ACCEPTED)], True)
+    assert jobs.report('me') == ([('b', HTTPStatus.ACCEPTED)], True)
+
+
+def test_job_finished_while_reporting_is_reported(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    jobs = DeleteJobs(path)
+    jobs.add('me', 'us-ashburn-1', 'a', 'Instance')
+
+    # The tracker, in another process, finishes the job right after the report
+    # has read it as pending
+    tracker = threading.Thread(target=lambda: DeleteJobs(path).update(
+        'us-ashburn-1', {'a': 'TERMINATED'}, 3600))
+    selected = []
+    def trace(statement):
+        if selected and not tracker.is_alive() and not tracker.ident:
+            tracker.start()
+            # Blocked until the report commits, unless reading and marking
+            # are separate transactions
+            tracker.join(timeout=0.5)
+        if statement.startswith('SELECT identifier'):
+            selected.append(statement)
+    jobs.connection().set_trace_callback(trace)
+
+    assert jobs.report('me') == ([('a', HTTPStatus.ACCEPTED)], True)
+    tracker.join()
+    jobs.connection().set_trace_callback(None)
+
+    assert jobs.report('me') == ([('a', HTTPStatus.OK)], False)
+    assert jobs.report('me') == ([], False)
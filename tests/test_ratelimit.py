@@ -0,0 +1,228 @@
+import functools
+import os
+import random
+import subprocess
+import threading
+
+from time import monotonic, sleep
+
+import pytest
+
+from oci.exceptions import ConnectTimeout, RequestException, ServiceError
+from oci.retry import DEFAULT_RETRY_STRATEGY
+
+from modules import ratelimit
+from modules.ratelimit import RateLimiter
+
+
+class ThrottledService:
+    """ThrottledService stands in for an OCI service allowing rate calls per
+       second after a burst, throttling the rest with 429s as OCI does.
+    """
+
+    def __init__(self, rate: float, burst: float, latency: float=0.01,
+                 clock=monotonic, sleep=sleep):
+        self.rate = rate
+        self.burst = burst
+        self.latency = latency
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.calls = 0
+        self.throttles = 0
+        self.lock = threading.Lock()
+
+    def call(self):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.calls += 1
+            throttled = self.tokens < 1
+            if throttled:
+                self.throttles += 1
+            else:
+                self.tokens -= 1
+
+        self.sleep(self.latency)
+        if throttled:
+            raise ServiceError(429, 'TooManyRequests', {}, 'Too many requests')
+        return 'ok'
+
+
+class Clock:
+    """Clock stands in for time and sleep, sleeping moves the time on at once"""
+
+    def __init__(self, now: float=1_700_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += max(seconds, 0)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock.time)
+    monkeypatch.setattr(ratelimit, 'sleep', clock.sleep)
+    monkeypatch.setattr(ratelimit, 'random', random.Random(0))
+    return clock
+
+
+# Make calls from threads at once, returning how many succeeded and the seconds
+# taken
+def run(call, service: ThrottledService, threads: int, calls: int):
+    succeeded = []
+
+    def worker():
+        for _ in range(calls):
+            try:
+                call(service.call)
+                succeeded.append(1)
+            except ServiceError:
+                pass
+
+    started = monotonic()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return len(succeeded), monotonic() - started
+
+
+def test_limiter_adapts_to_throttling(clock: Clock):
+    # Configured well above what the service allows, so it must back off
+    service = ThrottledService(rate=40, burst=10, clock=clock.time, sleep=clock.sleep)
+    limiter = RateLimiter(rate=200, burst=20, attempts=8)
+
+    started = clock.time()
+    for _ in range(400):
+        limiter.call('search:test', service.call)
+
+    # Throttles are bounded as the rate halves, not one per call
+    assert service.throttles < service.calls / 10
+    _, _, rate, _ = limiter.buckets['search:test']
+    assert rate < 200
+    # Paced near the rate the service allows
+    assert 400 / (clock.time() - started) > 20
+
+
+def test_shared_buckets(clock: Clock, tmp_path):
+    path = str(tmp_path / 'ratelimit.db')
+    first = RateLimiter(path, rate=1, burst=3)
+    second = RateLimiter(path, rate=1, burst=3)
+
+    # Workers draw on one bucket
+    assert [first.take('search:test') for _ in range(3)] == [0, 0, 0]
+    assert second.take('search:test') > 0
+
+    # and throttling seen by one slows the other
+    first.throttled('search:test')
+    with second.transaction() as bucket:
+        assert bucket('search:test')[2] == 0.5
+
+
+def test_shared_concurrency_limit(tmp_path):
+    path = str(tmp_path / 'ratelimit.db')
+    first = RateLimiter(path, concurrency=2)
+    second = RateLimiter(path, concurrency=2)
+    acquired = threading.Event()
+
+    def third():
+        with first.limit('search:test'):
+            acquired.set()
+
+    with first.limit('search:test'):
+        with second.limit('search:test'):
+            thread = threading.Thread(target=third)
+            thread.start()
+            assert not acquired.wait(0.2)
+        assert acquired.wait(5)
+    thread.join()
+
+    # The window is shared too
+    second.limit('search:test').decrease()
+    with first.limit('search:test').transaction() as conn:
+        assert first.limit('search:test').size(conn) == 1
+
+
+def test_shared_concurrency_limit_drops_dead_workers(tmp_path):
+    path = str(tmp_path / 'ratelimit.db')
+    limiter = RateLimiter(path, concurrency=2)
+    worker = subprocess.Popen(['true'])
+    worker.wait()
+
+    # A worker that died with calls in flight does not hold the limit forever
+    with limiter.connection() as conn:
+        conn.execute('INSERT INTO inflight VALUES (?, ?, 2)',
+                     ('search:test', worker.pid))
+    with limiter.limit('search:test'):
+        rows = limiter.connection().execute(
+            'SELECT pid, active FROM inflight').fetchall()
+    assert rows == [(os.getpid(), 1)]
+    assert limiter.connection().execute('SELECT * FROM inflight').fetchall() == []
+
+
+@pytest.mark.parametrize('error', [
+    ServiceError(429, 'TooManyRequests', {}, 'Too many requests'),
+    ServiceError(500, 'InternalServerError', {}, 'Internal error'),
+    ServiceError(503, 'ServiceUnavailable', {}, 'Unavailable'),
+    ServiceError(409, 'IncorrectState', {}, 'Incorrect state'),
+    RequestException('Connection aborted'),
+    ConnectTimeout('Connect timeout'),
+])
+def test_limiter_retries_what_sdk_retries(error, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'sleep', lambda seconds: None)
+    limiter = RateLimiter(attempts=3)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) < 3:
+            raise error
+        return 'ok'
+
+    assert limiter.call('search:test', call) == 'ok'
+    assert DEFAULT_RETRY_STRATEGY.checkers.should_retry(exception=error)
+
+
+@pytest.mark.parametrize('error', [
+    ServiceError(400, 'InvalidParameter', {}, 'Invalid parameter'),
+    ServiceError(404, 'NotAuthorizedOrNotFound', {}, 'Not found'),
+    ServiceError(409, 'Conflict', {}, 'Conflict'),
+    ServiceError(501, 'NotImplemented', {}, 'Not implemented'),
+])
+def test_limiter_raises_what_sdk_raises(error, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'sleep', lambda seconds: None)
+    limiter = RateLimiter(attempts=3)
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise error
+
+    with pytest.raises(ServiceError):
+        limiter.call('search:test', call)
+    assert len(calls) == 1
+    assert not DEFAULT_RETRY_STRATEGY.checkers.should_retry(exception=error)
+
+
+# Compare the limiter with SDK retries alone against a throttling service:
+#   PYTHONPATH=src/app python tests/test_ratelimit.py
+if __name__ == '__main__':
+    for name, call in [
+            ('sdk retries', DEFAULT_RETRY_STRATEGY.make_retrying_call),
+            ('limiter 200/s', functools.partial(
+                RateLimiter(rate=200, burst=20, attempts=8).call, 'search:test')),
+            ('limiter 40/s', functools.partial(
+                RateLimiter(rate=40, burst=10, attempts=8).call, 'search:test'))]:
+        service = ThrottledService(rate=40, burst=10)
+        succeeded, seconds = run(call, service, threads=16, calls=20)
+        print(f'{name:14s} {succeeded:3d}/320 succeeded in {seconds:5.1f}s '
+              f'{service.calls:4d} calls {service.throttles:4d} throttled')
@@ -0,0 +1,115 @@
+import json
+import pickle
+
+from datetime import datetime, timedelta, timezone
+from timeit import timeit
+
+import pytest
+
+from oci.resource_search.models import ResourceSummary, ResourceSummaryCollection
+from oci.response import Response
+from oci.util import to_dict
+
+from modules.search import RecordPage, ResourceRecord, decode_response, encode_response
+from modules.search.record import project
+
+HEADERS = {'opc-next-page': 'AAAAAAAAAAH9bQ4c0uxGsNdPKnZj6YpyCcD2zG1WZrl9J6fR6Bf2rX6hZ1lJdA',
+           'opc-request-id': '2F6B1C2D9E4A4F0B8C7D6E5F4A3B2C1D/5E4D3C2B1A09F8E7D6C5B4A3F2E1D0C9'}
+
+
+# Resources as OCI Search returns them, with the fields records drop. They are
+# read from JSON like the SDK reads responses, so no two hold the same string.
+def summaries(count: int) -> list[ResourceSummary]:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    items = json.loads(json.dumps([{
+        'identifier': f'ocid1.instance.oc1.iad.anuwcljt{i:04}bq6ld7wdx4ktkvm3nqhjmbhkr5j5pzqmz5s7yxyt5g4i4ca',
+        'display_name': f'instance-20240101-{i:04}',
+        'resource_type': 'Instance',
+        'compartment_id': 'ocid1.compartment.oc1..aaaaaaaa2xkgfq6wyi3osl7sm4ln5mzh6ggi7mq4fkfj3b5q7rgrwwxwqfya',
+        'lifecycle_state': 'RUNNING',
+        'availability_domain': 'Uocm:US-ASHBURN-AD-1',
+        'time_created': (start + timedelta(minutes=i)).isoformat(),
+        'defined_tags': {'Oracle-Tags': {'CreatedBy': 'me@example.com',
+                                         'CreatedOn': '2024-01-01T00:00:00.000Z'},
+                         'ns': {'key': 'me@example.com'}},
+        'freeform_tags': {},
+        'system_tags': {'orcl-cloud': {'free-tier-retained': 'true'}},
+        'identity_context': {}} for i in range(count)]))
+
+    for item in items:
+        item['time_created'] = datetime.fromisoformat(item['time_created'])
+    return [ResourceSummary(**item) for item in items]
+
+
+# A page as the search cache kept it before records, pickled by cachelib
+def pickled_page(count: int) -> bytes:
+    return pickle.dumps(Response(200, HEADERS,
+                                 ResourceSummaryCollection(items=summaries(count)),
+                                 None))
+
+
+def record_page(count: int) -> Response:
+    return Response(200, HEADERS, RecordPage(items=project(summaries(count), 'us-ashburn-1'),
+                                             fetched=1_700_000_000.5), None)
+
+
+def test_project_keeps_card_fields():
+    item = summaries(1)[0]
+    record = project([item], 'us-ashburn-1')[0]
+
+    assert record == ResourceRecord(identifier=item.identifier,
+                                    display_name=item.display_name,
+                                    resource_type='Instance',
+                                    compartment_id=item.compartment_id,
+                                    lifecycle_state='RUNNING',
+                                    time_created=item.time_created,
+                                    defined_tags=item.defined_tags,
+                                    region='us-ashburn-1')
+    assert project([ResourceSummary(identifier='ocid1.instance.oc1..a')])[0].defined_tags == {}
+
+
+def test_round_trip():
+    page = record_page(25)
+    decoded = decode_response(encode_response(page))
+
+    assert decoded.status == 200
+    assert decoded.headers == HEADERS
+    assert decoded.next_page == HEADERS['opc-next-page']
+    assert decoded.data == page.data
+    assert decoded.data.items[0].time_created.tzinfo is not None
+
+
+@pytest.mark.parametrize('count', [25, 100])
+def test_encoded_page_smaller_than_pickled_response(count: int):
+    encoded = encode_response(record_page(count))
+    assert len(encoded) < 0.85 * len(pickled_page(count))
+    assert len(encoded) / count < 450
+
+
+@pytest.mark.parametrize('data', [b'', b'not msgpack', pickled_page(1)])
+def test_decode_rejects_other_data(data: bytes):
+    with pytest.raises(ValueError):
+        decode_response(data)
+
+
+# Compare projecting search results with converting them with to_dict, and
+# encoded pages with the pickled responses they replaced:
+#   PYTHONPATH=src/app python tests/test_record.py
+if __name__ == '__main__':
+    for count in [25, 100, 1000]:
+        items = summaries(count)
+        runs = max(10, 10_000 // count)
+        converted = timeit(lambda: to_dict(items), number=runs) / runs
+        projected = timeit(lambda: project(items), number=runs) / runs
+        print(f'{count:5d} items  to_dict {converted * 1000:7.2f} ms  '
+              f'project {projected * 1000:7.2f} ms')
+
+    for count in [25, 100, 1000]:
+        old = pickled_page(count)
+        new = encode_response(record_page(count))
+        runs = max(10, 10_000 // count)
+        old_decode = timeit(lambda: pickle.loads(old), number=runs) / runs
+        new_decode = timeit(lambda: decode_response(new), number=runs) / runs
+        print(f'{count:5d} items  pickled Response {len(old):8d} B '
+              f'{old_decode * 1e6:8.1f} us decode  '
+              f'msgpack RecordPage {len(new):8d} B {new_decode * 1e6:8.1f} us decode')
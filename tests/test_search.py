@@ -0,0 +1,33 @@
+import pytest
+
+from modules.search import Search, SearchError
+
+
+@pytest.fixture
+def search():
+    # Only the attributes cursors need, without clients
+    search = Search.__new__(Search)
+    search.region_names = ['us-ashburn-1', 'us-phoenix-1']
+    return search
+
+
+def test_cursor_round_trip(search):
+    cursor = {'us-ashburn-1': ['token', 3], 'us-phoenix-1': [None, 0]}
+    assert search.decode_cursor(Search.encode_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize('cursor', [
+    {},
+    {'eu-frankfurt-1': ['token', 0]},
+    {'us-ashburn-1': ['token']},
+    {'us-ashburn-1': ['token', '0']},
+    ['us-ashburn-1'],
+])
+def test_invalid_cursors_are_rejected(search, cursor):
+    with pytest.raises(SearchError):
+        search.decode_cursor(Search.encode_cursor(cursor))
+
+
+def test_malformed_cursor_is_rejected(search):
+    with pytest.raises(SearchError):
+        search.decode_cursor('not a cursor')
@@ -0,0 +1,284 @@
+import random
+import socketserver
+import threading
+
+from fnmatch import fnmatchcase
+from time import monotonic, perf_counter
+
+import pytest
+
+from modules.sessions import RespCache, RespError, SqliteCache
+from modules.sessions import sqlite
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """RespServer is a local stand-in for a Redis server, speaking RESP and
+       implementing only the commands RespCache sends. Expiry follows clock,
+       which tests can replace.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, password: str | None=None):
+        super().__init__(('127.0.0.1', 0), RespHandler)
+        self.password = password
+        self.data: dict[tuple[int, bytes], tuple[bytes, float]] = {}
+        self.lock = threading.Lock()
+        self.clock = monotonic
+        self.commands: list[bytes] = []
+
+    @property
+    def url(self) -> str:
+        password = f':{self.password}@' if self.password else ''
+        return f'redis://{password}127.0.0.1:{self.server_address[1]}/1'
+
+    def live(self, db: int, key: bytes) -> bytes | None:
+        entry = self.data.get((db, key))
+        if entry is None or entry[1] <= self.clock():
+            self.data.pop((db, key), None)
+            return None
+        return entry[0]
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.db = 0
+        self.authenticated = not self.server.password
+        while True:
+            args = self.read()
+            if args is None:
+                return
+            self.server.commands.append(args[0].upper())
+            try:
+                self.wfile.write(self.dispatch(args[0].upper(), args[1:]))
+            except ValueError as e:
+                self.wfile.write(b'-ERR %s\r\n' % str(e).encode())
+
+    def read(self) -> list[bytes] | None:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def dispatch(self, command: bytes, args: list[bytes]) -> bytes:
+        server = self.server
+        if command == b'AUTH':
+            if args[0].decode() != server.password:
+                raise ValueError('invalid password')
+            self.authenticated = True
+            return b'+OK\r\n'
+        if not self.authenticated:
+            return b'-NOAUTH Authentication required\r\n'
+
+        with server.lock:
+            if command == b'SELECT':
+                self.db = int(args[0])
+                return b'+OK\r\n'
+            if command == b'GET':
+                value = server.live(self.db, args[0])
+                return (b'$-1\r\n' if value is None
+                        else b'$%d\r\n%s\r\n' % (len(value), value))
+            if command == b'SET':
+                key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+                if b'NX' in options and server.live(self.db, key) is not None:
+                    return b'$-1\r\n'
+                expires = float('inf')
+                if b'EX' in options:
+                    expires = server.clock() + int(options[options.index(b'EX') + 1])
+                server.data[(self.db, key)] = (value, expires)
+                return b'+OK\r\n'
+            if command == b'DEL':
+                deleted = sum(server.live(self.db, key) is not None
+                              and server.data.pop((self.db, key)) is not None
+                              for key in args)
+                return b':%d\r\n' % deleted
+            if command == b'EXISTS':
+                return b':%d\r\n' % (server.live(self.db, args[0]) is not None)
+            if command == b'SCAN':
+                pattern = args[args.index(b'MATCH') + 1].decode()
+                keys = [key for db, key in list(server.data)
+                        if db == self.db and server.live(db, key) is not None
+                        and fnmatchcase(key.decode(), pattern)]
+                return (b'*2\r\n$1\r\n0\r\n*%d\r\n' % len(keys)
+                        + b''.join(b'$%d\r\n%s\r\n' % (len(key), key) for key in keys))
+
+        raise ValueError(f'unknown command {command}')
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+SESSION = {'_permanent': True, 'user': 'someone@example.com',
+           'vault': 'Zm9vYmFyYmF6cXV4', 'region': 'us-ashburn-1',
+           'resource_type': 'all', 'refreshed': 1_700_000_000,
+           'state': 'c3RhdGU', 'nonce': 'bm9uY2U'}
+
+
+@pytest.fixture
+def server():
+    server = RespServer(password='secret')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sqlite, 'time', clock)
+    return clock
+
+
+def test_resp_round_trip(server):
+    cache = RespCache(server.url, default_timeout=60)
+
+    assert cache.get('a') is None
+    assert cache.set('a', SESSION)
+    assert cache.get('a') == SESSION
+    assert cache.has('a')
+    assert not cache.add('a', {'other': 1})
+    assert cache.add('b', {'other': 1})
+    assert cache.delete('a')
+    assert not cache.has('a')
+    # Authenticated and stored in the configured database under the prefix
+    assert server.commands[:2] == [b'AUTH', b'SELECT']
+    assert (1, b'session:b') in server.data
+
+
+def test_resp_expiry(server):
+    server.clock = clock = Clock()
+    cache = RespCache(server.url, default_timeout=60)
+
+    cache.set('a', SESSION)
+    cache.set('b', SESSION, timeout=0)
+    clock.now += 61
+    assert cache.get('a') is None
+    assert cache.add('a', SESSION)
+    assert cache.get('b') == SESSION
+
+
+def test_resp_clear_keeps_other_keys(server):
+    cache = RespCache(server.url, default_timeout=60)
+    other = RespCache(server.url, default_timeout=60, key_prefix='other:')
+
+    cache.set('a', SESSION)
+    cache.set('b', SESSION)
+    other.set('a', SESSION)
+    assert cache.clear()
+    assert cache.get('a') is None and cache.get('b') is None
+    assert other.get('a') == SESSION
+
+
+def test_resp_reconnects(server):
+    cache = RespCache(server.url, default_timeout=60)
+    cache.set('a', SESSION)
+
+    # The server closing an idle connection is retried once on a new one
+    cache.connection()[0].close()
+    assert cache.get('a') == SESSION
+
+
+def test_resp_wrong_password(server):
+    url = server.url
+    server.password = 'other'
+    with pytest.raises(RespError):
+        RespCache(url).get('a')
+
+
+def test_sqlite_round_trip(tmp_path, clock):
+    cache = SqliteCache(str(tmp_path / 'session.db'), default_timeout=60)
+
+    assert cache.get('a') is None
+    assert cache.set('a', SESSION)
+    assert cache.get('a') == SESSION
+    assert cache.has('a')
+    assert not cache.add('a', {'other': 1})
+    assert cache.add('b', {'other': 1})
+    assert cache.delete('a')
+    assert not cache.delete('a')
+    assert cache.clear() and not cache.has('b')
+
+
+def test_sqlite_expiry(tmp_path, clock):
+    cache = SqliteCache(str(tmp_path / 'session.db'), default_timeout=60,
+                        cleanup_interval=30)
+
+    cache.set('a', SESSION)
+    cache.set('b', SESSION, timeout=0)
+    clock.now += 61
+    assert cache.get('a') is None and not cache.has('a')
+    # Expired entries can be added again
+    assert cache.add('a', SESSION)
+
+    # Cleanup removes expired rows, at most once per interval
+    cache.set('c', SESSION, timeout=10)
+    clock.now += 31
+    cache.set('d', SESSION)
+    keys = {key for key, in cache.connection().execute('SELECT key FROM cache')}
+    assert keys == {'a', 'b', 'd'}
+
+
+def test_sqlite_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'session.db')
+    SqliteCache(path).set('a', SESSION)
+    assert SqliteCache(path).get('a') == SESSION
+
+
+# Time session reads and writes with this many live sessions, returning the
+# mean and p99 microseconds of each
+def benchmark(cache, sessions: int, samples: int=2000) -> dict[str, tuple]:
+    for i in range(sessions):
+        cache.set(f'sid{i}', dict(SESSION, user=f'user{i}@example.com'))
+
+    timings = {'read': [], 'write': []}
+    for _ in range(samples):
+        key = f'sid{random.randrange(sessions)}'
+        started = perf_counter()
+        session = cache.get(key)
+        timings['read'].append(perf_counter() - started)
+        session['refreshed'] += 1
+        started = perf_counter()
+        cache.set(key, session)
+        timings['write'].append(perf_counter() - started)
+
+    return {name: (sum(times) / len(times) * 1e6,
+                   sorted(times)[int(len(times) * 0.99)] * 1e6)
+            for name, times in timings.items()}
+
+
+# Compare session stores at 10k and 100k live sessions:
+#   PYTHONPATH=src/app python tests/test_sessions.py
+if __name__ == '__main__':
+    import tempfile
+
+    from cachelib import FileSystemCache
+
+    random.seed(1)
+    server = RespServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for sessions in (10_000, 100_000):
+        for name, create in [
+                ('filesystem', lambda path: FileSystemCache(path, threshold=0,
+                                                            default_timeout=900)),
+                ('sqlite', lambda path: SqliteCache(f'{path}/session.db',
+                                                    default_timeout=900)),
+                ('resp stand-in', lambda path: RespCache(
+                    server.url, default_timeout=900,
+                    key_prefix=f'{sessions}:'))]:
+            with tempfile.TemporaryDirectory() as path:
+                results = benchmark(create(path), sessions)
+            print(f'{sessions:7d} sessions {name:14s} ' + '  '.join(
+                f'{op} mean {mean:6.1f} us p99 {p99:7.1f} us'
+                for op, (mean, p99) in results.items()), flush=True)
@@ -0,0 +1,79 @@
+import threading
+
+import oci
+import pytest
+import requests
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from oci import resource_search
+
+from modules.ratelimit import RateLimiter, create_client
+
+REGIONS = ['us-ashburn-1', 'us-phoenix-1', 'eu-frankfurt-1', 'uk-london-1',
+           'ap-tokyo-1', 'sa-saopaulo-1']
+DATE = 'Thu, 01 Jan 2026 00:00:00 GMT'
+
+
+@pytest.fixture(scope='module')
+def config() -> dict:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM,
+                            serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode()
+    return {'tenancy': 'ocid1.tenancy.oc1..t',
+            'user': 'ocid1.user.oc1..u',
+            'fingerprint': ':'.join(['ab'] * 16),
+            'key_content': pem,
+            'region': REGIONS[0]}
+
+
+@pytest.fixture(scope='module')
+def signer(config: dict) -> oci.Signer:
+    return oci.Signer(config['tenancy'], config['user'], config['fingerprint'], None,
+                      private_key_content=config['key_content'])
+
+
+# A search request with a fixed date so its signature can be computed up front
+def request(region: str, i: int) -> requests.PreparedRequest:
+    return requests.Request('POST',
+                            f'https://query.{region}.oci.oraclecloud.com/20180409/resources?i={i}',
+                            headers={'date': DATE},
+                            json={'query': f'query {i}'}).prepare()
+
+
+def test_region_clients_share_signer(config: dict, signer: oci.Signer):
+    """Workers create region clients and sign requests from many threads at
+       once with one signer, each client must use its own region and the shared
+       signer and every signature must match one made on a single thread.
+    """
+    expected = {(region, i): signer(request(region, i)).headers['authorization']
+                for region in REGIONS for i in range(10)}
+    limiter = RateLimiter(None)
+    errors = []
+
+    def work(t: int):
+        for n in range(50):
+            region = REGIONS[(t + n) % len(REGIONS)]
+            i = n % 10
+            limited = n % 2 == 1
+            client = create_client(resource_search.ResourceSearchClient, config,
+                                   region, signer=signer,
+                                   limiter=limiter if limited else None,
+                                   service='search')
+            # The limiter wraps the measured client in a limited one
+            base = (client.client.client if limited else client.client).base_client
+            if region not in base.endpoint:
+                errors.append(('endpoint', region, base.endpoint))
+            if base.signer is not signer:
+                errors.append(('signer', region))
+            if signer(request(region, i)).headers['authorization'] != expected[(region, i)]:
+                errors.append(('signature', region, i))
+
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
@@ -0,0 +1,102 @@
+import fcntl
+import json
+import os
+
+from time import time
+from unittest import mock
+
+import pytest
+
+from modules.snapshot import Snapshot
+
+TTL = 60
+
+
+# Write a snapshot as a worker did age seconds ago
+def write(path: str, data: dict, age: float):
+    created = time() - age
+    with open(path, 'w') as f:
+        json.dump({'created': created, 'data': data}, f)
+    os.utime(path, (created, created))
+
+
+def tracked(path: str, fetched: dict) -> tuple[Snapshot, mock.MagicMock, mock.MagicMock]:
+    snapshot = Snapshot(path, ttl=TTL)
+    fetch = mock.MagicMock(return_value=fetched)
+    apply = mock.MagicMock()
+    snapshot.track({'search': (fetch, apply)})
+    return snapshot, fetch, apply
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    path = str(tmp_path / 'snapshot.json')
+    write(path, {'search': {'regions': ['old']}}, age=TTL + 10)
+    return path
+
+
+def test_fresh_snapshot_not_refreshed(path: str):
+    write(path, {'search': {'regions': ['old']}}, age=TTL - 10)
+    snapshot, fetch, apply = tracked(path, {'regions': ['new']})
+
+    snapshot.check()
+
+    fetch.assert_not_called()
+    apply.assert_not_called()
+    assert snapshot.get('search') == {'regions': ['old']}
+
+
+def test_stale_snapshot_refreshed(path: str):
+    snapshot, fetch, apply = tracked(path, {'regions': ['new']})
+    assert snapshot.get('search') == {'regions': ['old']} and snapshot.stale()
+
+    snapshot.check()
+
+    fetch.assert_called_once_with()
+    assert not snapshot.stale()
+    assert Snapshot(path, ttl=TTL).get('search') == {'regions': ['new']}
+    # The worker refreshing updated itself when fetching
+    apply.assert_not_called()
+
+
+def test_waiting_worker_reloads_instead_of_fetching(path: str):
+    refreshing, refreshing_fetch, _ = tracked(path, {'regions': ['new']})
+    waiting, waiting_fetch, waiting_apply = tracked(path, {'regions': ['other']})
+
+    # Another worker holds the refresh lock, so this one keeps the stale data
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        waiting.check()
+        waiting_fetch.assert_not_called()
+        assert waiting.get('search') == {'regions': ['old']}
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    refreshing.check()
+    refreshing_fetch.assert_called_once_with()
+
+    # and applies the refreshed data on its next check without fetching
+    waiting.check()
+    waiting_fetch.assert_not_called()
+    waiting_apply.assert_called_once_with({'regions': ['new']})
+    assert waiting.get('search') == {'regions': ['new']} and not waiting.stale()
+
+
+def test_refresh_after_another_worker_applies_its_data(path: str):
+    first, first_fetch, _ = tracked(path, {'regions': ['new']})
+    second, second_fetch, second_apply = tracked(path, {'regions': ['other']})
+
+    first.check()
+    second.check()
+
+    first_fetch.assert_called_once_with()
+    second_fetch.assert_not_called()
+    second_apply.assert_called_once_with({'regions': ['new']})
+
+
+def test_unreadable_snapshot_ignored(tmp_path):
+    path = tmp_path / 'snapshot.json'
+    path.write_text('{"created":')
+
+    snapshot = Snapshot(str(path), ttl=TTL)
+
+    assert snapshot.data == {} and snapshot.stale()
@@ -0,0 +1,120 @@
+import re
+
+from datetime import datetime, timezone
+from time import monotonic, sleep
+from types import SimpleNamespace
+
+import pytest
+
+from oci.resource_search.models import ResourceSummary, ResourceSummaryCollection
+from oci.response import Response
+
+from modules.search import TeamSearch
+from modules.search.query import QueryCompartments
+
+REGIONS = ['us-ashburn-1', 'us-phoenix-1', 'eu-frankfurt-1']
+COMPARTMENT = re.compile(r"compartmentId = '([^']+)'")
+
+
+def compartments(count: int) -> list[str]:
+    return [f'ocid1.compartment.oc1..aaaaaaaa{i:04}xkgfq6wyi3osl7sm4ln5mzh6ggi7mq4fkfj3b5q7rgrwwxwq'
+            for i in range(count)]
+
+
+class CompartmentClient:
+    """CompartmentClient stands in for a region's ResourceSearchClient, returning
+       the resources in the compartments a query names after latency seconds.
+    """
+
+    def __init__(self, items: list[ResourceSummary], latency: float=0):
+        self.items = items
+        self.latency = latency
+        self.queries = []
+
+    def search_resources(self, details, page: str | None=None, limit: int=1000,
+                         **kwargs) -> Response:
+        sleep(self.latency)
+        self.queries.append(details.query)
+        named = set(COMPARTMENT.findall(details.query))
+        return Response(200, {}, ResourceSummaryCollection(
+            items=[item for item in self.items if item.compartment_id in named]), None)
+
+
+def team_search(items: dict[str, list[ResourceSummary]], count: int, latency: float=0,
+                **kwargs) -> TeamSearch:
+    search = SimpleNamespace(tag='ns', key='key', region_names=list(items),
+                             client={region: CompartmentClient(region_items, latency)
+                                     for region, region_items in items.items()})
+    return TeamSearch(search, compartments(count), **kwargs)
+
+
+def resources(region: str, count: int, per_compartment: int=2) -> list[ResourceSummary]:
+    return [ResourceSummary(identifier=f'ocid1.instance.{region}.{n}.{i}',
+                            resource_type='Instance',
+                            compartment_id=compartment,
+                            time_created=datetime(2024, 1, 1, tzinfo=timezone.utc))
+            for n, compartment in enumerate(compartments(count))
+            for i in range(per_compartment)]
+
+
+@pytest.mark.parametrize('count, size', [(500, 50), (120, 50), (7, 50), (10, 1)])
+def test_queries_cover_compartments_within_chunk_length(count: int, size: int):
+    query = QueryCompartments('ns', 'key')
+    chunks = query.queries(compartments(count), size)
+
+    named = [COMPARTMENT.findall(chunk) for chunk in chunks]
+    assert sum(named, []) == compartments(count)
+    assert all(len(chunk) <= size for chunk in named)
+    # Query length is bounded by the chunk size, not by how many compartments
+    longest = len(query.query(compartments=compartments(size)))
+    assert max(len(chunk) for chunk in chunks) <= longest
+
+
+def test_resources_in_every_compartment_and_region():
+    search = team_search({region: resources(region, 120) for region in REGIONS}, 120,
+                         chunk_size=50)
+
+    listed = list(search.resources())
+
+    assert len(listed) == 3 * 120 * 2
+    assert {record.region for record in listed} == set(REGIONS)
+    for client in search.search.client.values():
+        assert len(client.queries) == 3
+
+
+def test_resources_deduplicated_by_identifier():
+    # Resources such as policies are listed by search in every region
+    shared = resources('global', 10)
+    search = team_search({region: resources(region, 10) + shared for region in REGIONS},
+                         10, chunk_size=3)
+
+    identifiers = [record.identifier for record in search.resources()]
+
+    assert len(identifiers) == len(set(identifiers)) == 3 * 20 + 20
+    assert set(identifiers) >= {item.identifier for item in shared}
+
+
+def test_failed_search_skipped():
+    search = team_search({region: resources(region, 10) for region in REGIONS}, 10)
+    search.search.client['us-phoenix-1'].search_resources = None
+
+    listed = list(search.resources())
+
+    assert {record.region for record in listed} == {'us-ashburn-1', 'eu-frankfurt-1'}
+
+
+# Time listing 500 compartments in 3 regions with 50 ms searches, as one query
+# per region and in chunks searched one at a time and in parallel:
+#   PYTHONPATH=src/app python tests/test_team.py
+if __name__ == '__main__':
+    items = {region: resources(region, 500, per_compartment=1) for region in REGIONS}
+    for size, workers in [(500, 3), (50, 1), (50, 8), (25, 8), (50, 16)]:
+        search = team_search(items, 500, latency=0.05, chunk_size=size, workers=workers)
+        start = monotonic()
+        listed = sum(1 for _ in search.resources())
+        seconds = monotonic() - start
+        queries = [query for client in search.search.client.values()
+                   for query in client.queries]
+        print(f'chunks of {size:3d} {workers:2d} workers  {len(queries):3d} searches '
+              f'of up to {max(map(len, queries)):5d} characters  '
+              f'{listed} resources in {seconds:.2f}s')
@@ -0,0 +1,171 @@
+import logging
+import os
+import tempfile
+
+from time import sleep
+from timeit import timeit
+
+import pytest
+
+from modules.log import LogPipeline
+from modules.metrics import REQUEST_SECONDS, MeasuredClient
+from modules.tracing import current_span, current_trace, end_trace, span, start_trace
+
+
+@pytest.fixture
+def trace():
+    trace = start_trace('home', route='/', method='GET')
+    yield trace
+    end_trace()
+
+
+def spans(trace) -> dict:
+    return {span.name: span for span in trace.spans}
+
+
+def test_spans_nest(trace):
+    with span('outer'):
+        with span('inner', region='us-ashburn-1'):
+            pass
+        with span('inner_after'):
+            pass
+    with span('sibling'):
+        pass
+
+    named = spans(trace)
+    # Spans are recorded as they end
+    assert [span.name for span in trace.spans] == ['inner', 'inner_after', 'outer',
+                                                   'sibling']
+    assert named['outer'].parent_id == trace.span_id
+    assert named['inner'].parent_id == named['outer'].span_id
+    assert named['inner_after'].parent_id == named['outer'].span_id
+    assert named['sibling'].parent_id == trace.span_id
+    assert named['inner'].attributes == {'region': 'us-ashburn-1'}
+    assert named['outer'].start <= named['inner'].start <= named['inner'].end \
+        <= named['outer'].end
+    assert current_span.get() is None
+
+
+def test_span_ends_when_block_raises(trace):
+    with pytest.raises(ValueError):
+        with span('outer'):
+            with span('inner'):
+                raise ValueError
+
+    assert [span.name for span in trace.spans] == ['inner', 'outer']
+    assert current_span.get() is None
+
+
+def test_span_outside_trace():
+    with span('orphan'):
+        pass
+    assert current_trace.get() is None
+
+
+def test_end_trace_clears_context(trace):
+    with span('outer'):
+        assert end_trace() is trace
+    assert current_trace.get() is None
+    assert trace.ended is not None
+
+
+def test_server_timing():
+    trace = start_trace('home', started=1_000_000)
+    end_trace()
+    trace.add('session_load', 1_000_000, 1_400_000)
+    trace.add('oci_search', 1_500_000, 3_500_000, region='us-ashburn-1')
+    trace.add('oci_search', 1_500_000, 4_500_000, region='us-phoenix-1')
+    trace.add('render', 5_000_000, 6_300_000)
+    trace.ended = 11_000_000
+
+    assert trace.server_timing() == ('session_load;dur=0.4, '
+                                     'oci_search;dur=5.0;desc="2 calls", '
+                                     'render;dur=1.3, total;dur=10.0')
+
+
+def test_otlp_keeps_nesting(trace):
+    with span('outer'):
+        with span('inner'):
+            pass
+    trace.end()
+
+    exported = trace.otlp('dashboard')['resourceSpans'][0]['scopeSpans'][0]['spans']
+    by_name = {span['name']: span for span in exported}
+    assert by_name['home']['parentSpanId'] == '' and by_name['home']['kind'] == 2
+    assert by_name['outer']['parentSpanId'] == by_name['home']['spanId']
+    assert by_name['inner']['parentSpanId'] == by_name['outer']['spanId']
+    assert int(by_name['outer']['startTimeUnixNano']) \
+        <= int(by_name['inner']['startTimeUnixNano'])
+
+
+class SlowStream:
+    """SlowStream stands in for a terminal or disk taking a millisecond a write"""
+
+    def write(self, text: str):
+        sleep(0.001)
+
+    def flush(self):
+        pass
+
+
+# Log calls made handling a page, one at INFO and the rest at DEBUG
+def log_request(logger: logging.Logger, items: list, lazy: bool):
+    if lazy:
+        logger.info('Listed %s items', len(items))
+        for _ in range(4):
+            logger.debug('Items: %s', items)
+    else:
+        logger.info(f'Listed {len(items)} items')
+        for _ in range(4):
+            logger.debug(f'Items: {items}')
+
+
+# Hooks run around a page: a trace with its spans and Server-Timing header, the
+# request histogram and an OCI call measured by MeasuredClient
+def trace_request(client: MeasuredClient):
+    start_trace('home', route='/p', method='GET')
+    with span('oci_search', region='us-ashburn-1'):
+        client.search_resources()
+    for name in ['filter', 'project', 'render']:
+        with span(name):
+            pass
+    current_trace.get().server_timing()
+    end_trace()
+    REQUEST_SECONDS.labels('/p', 'GET', 200).observe(0.01)
+
+
+# Time the logging, tracing and metrics run per request outside of the
+# request's own work, in microseconds:
+#   PYTHONPATH=src/app python tests/test_tracing.py
+if __name__ == '__main__':
+    items = [{'identifier': f'ocid1.instance.oc1..{i}', 'display_name': f'instance-{i}'}
+             for i in range(25)]
+    runs = 5_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'app.log')
+        for name, handler, lazy, queued in [
+                ('file, f-strings', logging.FileHandler(path), False, False),
+                ('file, lazy', logging.FileHandler(path), True, False),
+                ('file, lazy, queued', logging.FileHandler(path), True, True),
+                ('1 ms stream, f-strings', logging.StreamHandler(SlowStream()), False, False),
+                ('1 ms stream, lazy, queued', logging.StreamHandler(SlowStream()), True, True)]:
+            logger = logging.getLogger(f'bench.{name}')
+            logger.propagate = False
+            if queued:
+                pipeline = LogPipeline(handler)
+                pipeline.attach(logger, logging.INFO)
+            else:
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+
+            count = runs if 'file' in name else 200
+            seconds = timeit(lambda: log_request(logger, items, lazy), number=count)
+            print(f'logging {name:26s} {seconds / count * 1e6:8.1f} us')
+            if queued:
+                pipeline.stop()
+
+    client = MeasuredClient(type('Client', (), {'search_resources': lambda self: None})(),
+                            'search', 'us-ashburn-1')
+    seconds = timeit(lambda: trace_request(client), number=runs)
+    print(f'{"tracing and metrics":34s} {seconds / runs * 1e6:8.1f} us')